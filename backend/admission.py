@@ -0,0 +1,116 @@
+import os
+import math
+import time
+from dotenv import load_dotenv
+from core.metrics import Counter, Gauge
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Admission control cho queue chatbot:
+#   - chatbot worker ghi số job hoàn thành theo từng phút (chatbot_completed:{phút})
+#   - API ước lượng thời gian chờ = độ dài queue / throughput quan sát được trong cửa sổ gần nhất
+#   - nếu thời gian chờ vượt ngân sách → từ chối (429) thay vì để job nằm trong queue quá TTL kết quả
+#   - nếu queue quá dài, hoặc không có worker nào còn sống (heartbeat hết hạn) → 503
+#   - throughput = 0 nhưng worker còn heartbeat: worker vừa rảnh (chưa có job trong cửa sổ) → vẫn nhận
+CHATBOT_WAIT_BUDGET_SECONDS = float(os.getenv("CHATBOT_WAIT_BUDGET_SECONDS", 300))
+CHATBOT_MAX_QUEUE_LENGTH = int(os.getenv("CHATBOT_MAX_QUEUE_LENGTH", 1000))
+# dưới ngưỡng này luôn nhận job (worker có thể đang rảnh nên chưa có throughput)
+CHATBOT_ADMIT_QUEUE_LENGTH = int(os.getenv("CHATBOT_ADMIT_QUEUE_LENGTH", 20))
+CHATBOT_THROUGHPUT_WINDOW_MINUTES = int(os.getenv("CHATBOT_THROUGHPUT_WINDOW_MINUTES", 5))
+CHATBOT_RETRY_AFTER_MAX = int(os.getenv("CHATBOT_RETRY_AFTER_MAX", 300))
+CHATBOT_HEARTBEAT_TTL = int(os.getenv("CHATBOT_HEARTBEAT_TTL", 120))  # worker im lặng quá lâu → coi như kẹt/chết
+CHATBOT_COMPLETED_PREFIX = "chatbot_completed:"
+CHATBOT_HEARTBEAT_KEY = "chatbot_worker_heartbeat"
+
+chatbot_admission_shed_total = Counter(
+    "chatbot_admission_shed_total", "Số request chatbot bị từ chối bởi admission control", ("reason",))
+chatbot_queue_length = Gauge(
+    "chatbot_queue_length", "Độ dài queue chatbot ở lần kiểm tra gần nhất")
+chatbot_estimated_wait_seconds = Gauge(
+    "chatbot_estimated_wait_seconds", "Thời gian chờ ước lượng ở lần kiểm tra gần nhất (giây)")
+chatbot_throughput_per_second = Gauge(
+    "chatbot_throughput_per_second", "Số job chatbot hoàn thành mỗi giây (trung bình trong cửa sổ)")
+Gauge("chatbot_admission_wait_budget_seconds", "Ngân sách thời gian chờ tối đa (giây)",
+      callback=lambda: CHATBOT_WAIT_BUDGET_SECONDS)
+Gauge("chatbot_admission_max_queue_length", "Độ dài queue tối đa trước khi trả 503",
+      callback=lambda: CHATBOT_MAX_QUEUE_LENGTH)
+
+
+class AdmissionRejected(Exception):
+    """
+    Job bị từ chối. `status_code` là 429 hoặc 503, `retry_after` tính bằng giây.
+    """
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def _minute_key(minute: int) -> str:
+    return f"{CHATBOT_COMPLETED_PREFIX}{minute}"
+
+
+async def record_chatbot_completion(redis_conn):
+    """
+    Gọi từ chatbot worker mỗi khi xử lý xong một job (thành công hay lỗi).
+    """
+    key = _minute_key(int(time.time() // 60))
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.incr(key)
+        pipe.expire(key, (CHATBOT_THROUGHPUT_WINDOW_MINUTES + 2) * 60)
+        await pipe.execute()
+
+
+async def record_chatbot_heartbeat(redis_conn):
+    """
+    Gọi từ chatbot worker mỗi vòng lặp (trước BRPOP): worker rảnh vẫn cập nhật mỗi vài giây,
+    worker treo trong 1 job hoặc đã chết thì key hết hạn sau CHATBOT_HEARTBEAT_TTL.
+    """
+    await redis_conn.set(CHATBOT_HEARTBEAT_KEY, int(time.time()), ex=CHATBOT_HEARTBEAT_TTL)
+
+
+async def check_chatbot_admission(redis_conn, queue: str):
+    """
+    Raise AdmissionRejected nếu job mới phải chờ quá CHATBOT_WAIT_BUDGET_SECONDS.
+    Chỉ tốn 1 round trip (LLEN + MGET + GET heartbeat trong cùng pipeline).
+    """
+    now = time.time()
+    current_minute = int(now // 60)
+    # các phút đã trọn vẹn + phần đã trôi qua của phút hiện tại
+    minutes = [current_minute - i for i in range(CHATBOT_THROUGHPUT_WINDOW_MINUTES + 1)]
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.llen(queue)
+        pipe.mget([_minute_key(m) for m in minutes])
+        pipe.exists(CHATBOT_HEARTBEAT_KEY)
+        queue_length, counts, worker_alive = await pipe.execute()
+
+    completed = sum(int(c) for c in counts if c is not None)
+    window_seconds = CHATBOT_THROUGHPUT_WINDOW_MINUTES * 60 + (now - current_minute * 60)
+    throughput = completed / window_seconds
+    chatbot_queue_length.set(queue_length)
+    chatbot_throughput_per_second.set(throughput)
+
+    if queue_length <= CHATBOT_ADMIT_QUEUE_LENGTH:
+        chatbot_estimated_wait_seconds.set(queue_length / throughput if throughput else 0)
+        return
+
+    if queue_length >= CHATBOT_MAX_QUEUE_LENGTH:
+        chatbot_admission_shed_total.inc(1, "queue_full")
+        raise AdmissionRejected(503, CHATBOT_RETRY_AFTER_MAX, "queue_full")
+
+    if throughput == 0:
+        if not worker_alive:
+            # queue đang dồn, không job nào hoàn thành và không worker nào còn heartbeat → worker kẹt/chết
+            chatbot_admission_shed_total.inc(1, "no_worker")
+            raise AdmissionRejected(503, CHATBOT_RETRY_AFTER_MAX, "no_worker")
+        # worker còn sống, chỉ là trước đó rảnh nên chưa có throughput để ước lượng → nhận job
+        chatbot_estimated_wait_seconds.set(0)
+        return
+
+    estimated_wait = queue_length / throughput
+    chatbot_estimated_wait_seconds.set(estimated_wait)
+    if estimated_wait > CHATBOT_WAIT_BUDGET_SECONDS:
+        retry_after = min(CHATBOT_RETRY_AFTER_MAX, max(1, math.ceil(estimated_wait - CHATBOT_WAIT_BUDGET_SECONDS)))
+        chatbot_admission_shed_total.inc(1, "wait_budget")
+        raise AdmissionRejected(429, retry_after, "wait_budget")
@@ -1,8 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from .router import router
 from fastapi.middleware.cors import CORSMiddleware  # Import CORSMiddleware
-app = FastAPI()
+from core.postgresql_client import init_db, close_db
+from core.redis_client import close_redis
+from core.cache import start_invalidation_listener, stop_invalidation_listener
+from core.forecast_generation import ensure_generation_schema
+from .result_stream import start_result_listener, stop_result_listener
+from .password_utils import shutdown_password_executor
+from core.metrics import render_prometheus
+from .metrics_middleware import MetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mở sẵn pool PostgreSQL trước khi nhận request đầu tiên
+    await init_db("api")
+    await ensure_generation_schema()
+    start_invalidation_listener()
+    start_result_listener()
+    try:
+        yield
+    finally:
+        await stop_result_listener()
+        await stop_invalidation_listener()
+        await close_redis()
+        await close_db()
+        shutdown_password_executor()
+
+app = FastAPI(lifespan=lifespan)
 
 # Cấu hình CORS
 app.add_middleware(
@@ -11,12 +39,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],  # frontend khác origin cần đọc được header này khi bị 429/503
 )
 
+# Đo số request và latency theo route (xuất ra /metrics)
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the API!"}
 
-# python -m uvicorn backend.app:app --reload ( chạy từ thư mục gốc )
\ No newline at end of file
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# python -m uvicorn backend.app:app --reload ( chạy từ thư mục gốc )
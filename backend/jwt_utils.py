@@ -1,10 +1,15 @@
 
 import os
+import time
+import hashlib
+import threading
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from cachetools import TLRUCache
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from core.metrics import Counter, Gauge
 
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 SECRET_KEY = os.getenv("SECRET_KEY", "demo_secret")  # fallback nếu chưa có .env
@@ -12,6 +17,21 @@ ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Cache các token đã verify (key = sha256 của token) để không phải jwt.decode lại mỗi request.
+# Mỗi entry hết hạn đúng tại "exp" của token; token sai/hết hạn không bao giờ được cache.
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", 10000))
+_token_cache = TLRUCache(
+    maxsize=TOKEN_CACHE_MAXSIZE,
+    ttu=lambda _key, payload, _now: payload["exp"],
+    timer=time.time,
+)
+# get_current_user là hàm sync → FastAPI chạy trong threadpool, cần lock
+_token_cache_lock = threading.Lock()
+
+token_cache_requests_total = Counter(
+    "jwt_token_cache_requests_total", "Số lần tra cache token theo kết quả", ("result",))
+Gauge("jwt_token_cache_size", "Số token đang nằm trong cache", callback=lambda: len(_token_cache))
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     """
     Tạo JWT token có chứa thông tin user
@@ -23,19 +43,39 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def decode_token_cached(token: str) -> dict:
+    """
+    jwt.decode có cache: token đã verify và chưa tới exp thì trả payload từ cache.
+    Raise JWTError giống jwt.decode khi token không hợp lệ.
+    """
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    with _token_cache_lock:
+        payload = _token_cache.get(digest)
+    if payload is not None:
+        token_cache_requests_total.inc(1, "hit")
+        return payload
+
+    token_cache_requests_total.inc(1, "miss")
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if isinstance(payload.get("exp"), (int, float)):
+        with _token_cache_lock:
+            _token_cache[digest] = payload
+    return payload
+
+
 def verify_access_token(token: str):
     """
     Giải mã và verify JWT
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token_cached(token)
         return payload
     except JWTError:
         return None
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token_cached(token)
         user_id: int = payload.get("user_id")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
@@ -0,0 +1,45 @@
+import time
+from core.metrics import Counter, Histogram
+
+# Metrics cho từng route của API (scrape qua /metrics).
+# Label route là template của route (vd: /get_data_to_visualize/{city_id}) chứ không phải path thật,
+# để số lượng series không tăng theo city_id / request_id.
+http_requests_total = Counter(
+    "http_requests_total", "Số request HTTP theo route và status", ("method", "route", "status"))
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP (giây)", ("method", "route"))
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware thuần (không dùng BaseHTTPMiddleware) để chi phí mỗi request chỉ vài µs:
+    không tạo Request object, chỉ bọc `send` để lấy status code.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # router của FastAPI gắn route đã match vào scope
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            http_request_duration_seconds.observe(time.perf_counter() - start, method, route_path)
+            http_requests_total.inc(1, method, route_path, status_code)
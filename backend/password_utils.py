@@ -0,0 +1,43 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+# bcrypt tốn ~100-300ms CPU mỗi lần hash/verify. Chạy trên event loop sẽ chặn mọi request khác,
+# nên đẩy sang thread pool riêng (bcrypt nhả GIL trong lúc hash).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# số thao tác hash/verify được chạy đồng thời; phần còn lại chờ trên event loop (không chiếm thread)
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", PASSWORD_HASH_WORKERS))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_semaphore = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def _verify_password_sync(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash mật khẩu trên thread pool riêng, không chặn event loop.
+    """
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, _hash_password_sync, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """
+    So khớp mật khẩu với hash đã lưu trên thread pool riêng.
+    """
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, _verify_password_sync, password, hashed_password)
+
+
+def shutdown_password_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
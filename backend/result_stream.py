@@ -0,0 +1,202 @@
+import asyncio
+import traceback
+from core.redis_client import get_redis_cache_conn
+
+# Chatbot worker publish kết quả lên channel "chatbot_result:{request_id}" ngay sau khi SETEX.
+# Mỗi process API chỉ giữ 1 subscription (PSUBSCRIBE chatbot_result:*) và chia kết quả
+# cho các client đang chờ trong process đó → không phải GET Redis theo từng request.
+CHATBOT_RESULT_CHANNEL_PREFIX = "chatbot_result:"
+
+_waiters = {}  # request_id -> set[asyncio.Future]
+_listener_task = None
+_listener_ready = None
+
+
+def chatbot_result_channel(request_id: str) -> str:
+    return f"{CHATBOT_RESULT_CHANNEL_PREFIX}{request_id}"
+
+
+async def publish_chatbot_result(redis_conn, request_id: str, result: str):
+    """
+    Gọi từ chatbot worker sau khi đã lưu kết quả vào Redis DB1.
+    """
+    await redis_conn.publish(chatbot_result_channel(request_id), result)
+
+
+def _resolve(request_id: str, result: str):
+    for future in _waiters.pop(request_id, set()):
+        if not future.done():
+            future.set_result(result)
+
+
+async def _listen_results():
+    while True:
+        pubsub = None
+        try:
+            redis_cache = await get_redis_cache_conn()
+            pubsub = redis_cache.pubsub(ignore_subscribe_messages=True)
+            await pubsub.psubscribe(f"{CHATBOT_RESULT_CHANNEL_PREFIX}*")
+            _listener_ready.set()
+            async for message in pubsub.listen():
+                if message.get("type") != "pmessage":
+                    continue
+                request_id = message["channel"][len(CHATBOT_RESULT_CHANNEL_PREFIX):]
+                _resolve(request_id, message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ResultStream] Mất kết nối pub/sub: {e}. Thử lại sau 1s")
+            traceback.print_exc()
+            _listener_ready.clear()
+            await asyncio.sleep(1)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def start_result_listener():
+    """
+    Chạy task nền nhận kết quả chatbot. Gọi trong lifespan của FastAPI.
+    """
+    global _listener_task, _listener_ready
+    if _listener_task is None or _listener_task.done():
+        _listener_ready = asyncio.Event()
+        _listener_task = asyncio.create_task(_listen_results())
+    return _listener_task
+
+
+async def stop_result_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+def register_waiter(request_id: str) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(request_id, set()).add(future)
+    return future
+
+
+def unregister_waiter(request_id: str, future: asyncio.Future):
+    futures = _waiters.get(request_id)
+    if futures is None:
+        return
+    futures.discard(future)
+    if not futures:
+        _waiters.pop(request_id, None)
+
+
+async def get_result_future(request_id: str, redis_cache) -> asyncio.Future:
+    """
+    Đăng ký chờ kết quả của request_id. Sau khi đăng ký sẽ GET đúng 1 lần
+    để bắt trường hợp worker đã publish trước khi client kết nối.
+    """
+    start_result_listener()
+    future = register_waiter(request_id)
+    try:
+        try:
+            await asyncio.wait_for(_listener_ready.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            print("[ResultStream] Listener chưa sẵn sàng, chỉ dựa vào lần GET đầu tiên")
+        result = await redis_cache.get(request_id)
+    except BaseException:
+        # lỗi/huỷ trước khi trả future cho caller → caller không thể tự huỷ đăng ký
+        unregister_waiter(request_id, future)
+        raise
+    if result is not None and not future.done():
+        future.set_result(result)
+    return future
+
+
+# ---------- Stream token của agent (Redis Stream "chatbot_stream:{request_id}") ----------
+# Worker XADD từng phần câu trả lời; mỗi process API có 1 task XREAD gom tất cả stream
+# đang có client chờ vào cùng một lệnh, rồi chia event cho từng client.
+CHATBOT_STREAM_PREFIX = "chatbot_stream:"
+CHATBOT_STREAM_TTL = 1800        # giây, giống TTL của kết quả
+CHATBOT_STREAM_MAXLEN = 5000     # giới hạn số event mỗi stream
+TOKEN_STREAM_BLOCK_MS = 500      # thời gian BLOCK của XREAD gom
+
+_token_subscribers = {}  # stream_key -> {queue: last_id đã giao cho queue đó}
+_token_reader_task = None
+
+
+def _stream_id(entry_id) -> tuple:
+    ms, _, seq = (entry_id.decode() if isinstance(entry_id, bytes) else entry_id).partition("-")
+    return int(ms), int(seq or 0)
+
+
+def chatbot_stream_key(request_id: str) -> str:
+    return f"{CHATBOT_STREAM_PREFIX}{request_id}"
+
+
+async def append_stream_event(redis_conn, request_id: str, event_type: str, data: str = "", first: bool = False):
+    """
+    Gọi từ chatbot worker: thêm 1 event (token, tool_start, tool_end, reset, done, error) vào stream.
+    """
+    key = chatbot_stream_key(request_id)
+    if first:
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"type": event_type, "data": data}, maxlen=CHATBOT_STREAM_MAXLEN, approximate=True)
+            pipe.expire(key, CHATBOT_STREAM_TTL)
+            await pipe.execute()
+    else:
+        await redis_conn.xadd(key, {"type": event_type, "data": data}, maxlen=CHATBOT_STREAM_MAXLEN, approximate=True)
+
+
+async def _read_token_streams():
+    while _token_subscribers:
+        try:
+            redis_cache = await get_redis_cache_conn()
+            # mỗi stream đọc từ id nhỏ nhất trong các subscriber (subscriber mới vào bắt đầu từ "0-0")
+            streams = {key: min(queues.values(), key=_stream_id) for key, queues in _token_subscribers.items()}
+            response = await redis_cache.xread(streams, count=200, block=TOKEN_STREAM_BLOCK_MS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ResultStream] Lỗi XREAD token stream: {e}")
+            await asyncio.sleep(0.5)
+            continue
+
+        for key, entries in response or []:
+            queues = _token_subscribers.get(key)
+            if queues is None:
+                continue
+            for entry_id, fields in entries:
+                entry = _stream_id(entry_id)
+                for queue, last_id in list(queues.items()):
+                    # chỉ giao event mà queue chưa nhận (các subscriber có thể ở vị trí khác nhau)
+                    if entry > _stream_id(last_id):
+                        queues[queue] = entry_id
+                        queue.put_nowait(fields)
+
+
+def subscribe_token_stream(request_id: str) -> asyncio.Queue:
+    """
+    Đăng ký nhận event của một request. Mỗi subscriber đọc từ đầu ("0-0") nên không mất token
+    nếu worker đã bắt đầu trả lời trước khi client kết nối (kể cả khi đã có client khác đang nghe).
+    """
+    global _token_reader_task
+    key = chatbot_stream_key(request_id)
+    queue = asyncio.Queue()
+    _token_subscribers.setdefault(key, {})[queue] = "0-0"
+    if _token_reader_task is None or _token_reader_task.done():
+        _token_reader_task = asyncio.create_task(_read_token_streams())
+    return queue
+
+
+def unsubscribe_token_stream(request_id: str, queue: asyncio.Queue):
+    key = chatbot_stream_key(request_id)
+    queues = _token_subscribers.get(key)
+    if queues is None:
+        return
+    queues.pop(queue, None)
+    if not queues:
+        _token_subscribers.pop(key, None)
@@ -1,21 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 import uuid
 import json
+import orjson
 import os
+import asyncio
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-import bcrypt
+import asyncpg
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 # Import Pydantic model từ file model.py
 from .model import UserCityInput, ChatbotRequest, ChatbotResponse, ResultResponse, UserRegister, UserLogin, DiseaseUpdate
 # Import các client khác (giả định đã tồn tại)
 from core.postgresql_client import get_db
-from core.redis_client import get_redis_data, get_redis_cache_conn, get_redis_history_conn
+from core.redis_client import get_redis_data, get_redis_cache_conn, get_redis_history_conn, get_redis_cache_bytes_conn
+from core import codec
+from core.inflight import claim_city, release_city
+from core.forecast_generation import ACTIVE_GENERATION_SQL
+from core.cache import cached, invalidate_tags, get_city_generation
 from .jwt_utils import create_access_token, get_current_user, verify_access_token
+from .password_utils import hash_password, verify_password
+from .admission import check_chatbot_admission, AdmissionRejected
 from datetime import timedelta
-from .storage_history_message import append_chat_history, get_recent_chat_history
-from chatbot.chat_summary import summarize_chat_history
+from .storage_history_message import append_chat_history, get_cached_summary
+from .result_stream import get_result_future, unregister_waiter, subscribe_token_stream, unsubscribe_token_stream
 
 # Khởi tạo APIRouter
 router = APIRouter()
@@ -23,31 +32,22 @@ router = APIRouter()
 # endpoint đăng ký tài khoản
 @router.post("/register")
 async def register(user: UserRegister, db_pool=Depends(get_db)):
+    # Hash password (chạy trên thread pool, không chặn event loop)
+    hashed_pw = await hash_password(user.password)
+
+    # Insert user: 1 round trip, dựa vào unique constraint để phát hiện trùng username/email
+    query = """
+        INSERT INTO users (username, email, password)
+        VALUES ($1, $2, $3);
+    """
     async with db_pool.acquire() as conn:
-        # Check trùng username
-        exists_username = await conn.fetchval(
-            "SELECT 1 FROM users WHERE username=$1;", user.username
-        )
-        if exists_username:
+        try:
+            await conn.execute(query, user.username, user.email, hashed_pw)
+        except asyncpg.exceptions.UniqueViolationError as e:
+            if "email" in (e.constraint_name or ""):
+                raise HTTPException(status_code=400, detail="Email already exists")
             raise HTTPException(status_code=400, detail="Username already exists")
 
-        # Check trùng email
-        exists_email = await conn.fetchval(
-            "SELECT 1 FROM users WHERE email=$1;", user.email
-        )
-        if exists_email:
-            raise HTTPException(status_code=400, detail="Email already exists")
-
-        # Hash password
-        hashed_pw = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
-        # Insert user
-        query = """
-            INSERT INTO users (username, email, password)
-            VALUES ($1, $2, $3);
-        """
-        await conn.execute(query, user.username, user.email, hashed_pw)
-
     return {"message": "User registered successfully"}
 
 # endpoint đăng nhập
@@ -57,25 +57,36 @@ async def login(user: UserLogin, db_pool=Depends(get_db)):
         query = "SELECT user_id, password FROM users WHERE username=$1;"
         row = await conn.fetchrow(query, user.username)
 
-        if not row:
-            raise HTTPException(status_code=400, detail="Invalid username or password")
-
-        stored_pw = row["password"]
-        if not bcrypt.checkpw(user.password.encode("utf-8"), stored_pw.encode("utf-8")):
-            raise HTTPException(status_code=400, detail="Invalid username or password")
+    if not row:
+        raise HTTPException(status_code=400, detail="Invalid username or password")
+
+    # verify trên thread pool, connection đã được trả về pool trước khi chờ bcrypt
+    stored_pw = row["password"]
+    if not await verify_password(user.password, stored_pw):
+        raise HTTPException(status_code=400, detail="Invalid username or password")
+
+    # Nếu đúng → tạo JWT token
+    access_token_expires = timedelta(minutes=30)
+    access_token = create_access_token(
+        data={"user_id": row["user_id"], "username": user.username},
+        expires_delta=access_token_expires
+    )
 
-        # Nếu đúng → tạo JWT token
-        access_token_expires = timedelta(minutes=30)
-        access_token = create_access_token(
-            data={"user_id": row["user_id"], "username": user.username},
-            expires_delta=access_token_expires
-        )
+    return {
+        "message": "Login successful",
+        "access_token": access_token,
+        "token_type": "bearer"
+    }
 
-        return {
-            "message": "Login successful",
-            "access_token": access_token,
-            "token_type": "bearer"
-        }
+# tọa độ của city gần như không đổi → cache 1 ngày
+@cached("city_location", ttl=86400, tags=lambda city_id: [f"city:{city_id}"])
+async def get_city_location(city_id: int):
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT longitude, latitude FROM city WHERE city_id = $1;", city_id)
+    if row is None:
+        return None
+    return {"longitude": row["longitude"], "latitude": row["latitude"]}
 
 # endpoint này giúp cập nhật city_id cho user và thu thập dữ liệu dự đoán nếu chưa có trong database
 @router.post("/update_city_info_for_user")
@@ -99,18 +110,13 @@ async def update_city_info_for_user(
         print(f"Đã kiểm tra và thêm/bỏ qua user_city: user_id={user_id}, city_id={city_id}")
 
         # Bước 2: Kiểm tra và push job vào Redis queue
-        query_check_weather = "SELECT EXISTS(SELECT 1 FROM weather WHERE city_id = $1);"
+        query_check_weather = f"SELECT EXISTS(SELECT 1 FROM weather WHERE city_id = $1 AND generation = {ACTIVE_GENERATION_SQL});"
         exists_in_weather = await conn.fetchval(query_check_weather, city_id)
 
         if not exists_in_weather:
             print(f"Không tìm thấy city_id {city_id} trong bảng weather. Đang lấy thông tin city.")
 
-            query_get_city_info = """
-                SELECT longitude, latitude
-                FROM city
-                WHERE city_id = $1;
-            """
-            city_info = await conn.fetchrow(query_get_city_info, city_id)
+            city_info = await get_city_location(city_id)
 
             if city_info:
                 job_data = {
@@ -119,8 +125,16 @@ async def update_city_info_for_user(
                     "longitude": city_info["longitude"],
                     "latitude": city_info["latitude"]
                 }
-                await redis_data.lpush(QUEUE_DATA, json.dumps(job_data))
-                print(f"Đã push job {job_data['job_id']} vào Redis queue.")
+                # city đã có job đang chờ/đang crawl (user khác vừa chọn) → không push thêm
+                if await claim_city(redis_data, city_id, job_data["job_id"], source="api"):
+                    try:
+                        await redis_data.lpush(QUEUE_DATA, codec.encode(job_data))
+                    except Exception:
+                        await release_city(redis_data, city_id, job_data["job_id"])
+                        raise
+                    print(f"Đã push job {job_data['job_id']} vào Redis queue.")
+                else:
+                    print(f"city_id {city_id} đang được crawl bởi job khác → không push job.")
             else:
                 raise HTTPException(status_code=404, detail=f"Không tìm thấy thông tin của city_id {city_id}.")
         else:
@@ -145,97 +159,166 @@ async def update_user_disease_info(
         result = await conn.execute(query, payload.disease_id, payload.describe_disease, user_id)
 
     if result.startswith("UPDATE 1"):
+        # thông tin bệnh đã đổi → bỏ cache liên quan tới user này
+        await invalidate_tags(f"user:{user_id}")
         return {"status": "success", "message": "Cập nhật thông tin bệnh thành công"}
     else:
         raise HTTPException(status_code=404, detail="Không tìm thấy user hoặc không cập nhật được")
 
 
 #------ Endpoint giúp lấy dữ liệu weather, climate, uv để trực qua trên front-end
-@router.get("/get_data_to_visualize/{city_id}")
-async def get_data_to_visual(
-    city_id: int,
-    db_pool = Depends(get_db)
-):
-    SQL_GET_DATA_TO_VISUALIZE = """
-        SELECT 
+# Payload đã render được cache theo (city_id, generation). Worker tăng generation sau mỗi lần insert,
+# nên generation vừa là version của cache vừa là ETag gửi cho client.
+VISUALIZE_CACHE_TTL = int(os.getenv("VISUALIZE_CACHE_TTL", 86400))
+VISUALIZE_MAX_AGE = int(os.getenv("VISUALIZE_MAX_AGE", 300))
+
+# Các chỉ số trả về cho mỗi period (giữ đúng thứ tự của response cũ)
+VISUALIZE_METRICS = (
+    "temp", "feels_like", "weather_description", "weather_icon", "pop",
+    "humidity", "wind_speed", "aqi", "pm2_5", "pm10", "uvi",
+)
+
+# Gom nhóm theo ngày, sắp xếp ngày và period (theo period_order) ngay trong Postgres,
+# trả về sẵn JSON text để gửi thẳng cho client (không qua dict Python / jsonable_encoder).
+_SQL_VISUALIZE_ROWS = f"""
+    WITH joined AS (
+        SELECT
             w.report_day, w.report_month, w.report_year, w.period, w.humidity,
             w.temp, w.feels_like, w.weather_description, w.weather_icon, w.pop, w.wind_speed,
-            cl.aqi, cl.pm2_5, cl.pm10, u.uvi
+            cl.aqi, cl.pm2_5, cl.pm10, u.uvi,
+            CASE w.period
+                WHEN 'Early Morning' THEN 1
+                WHEN 'Morning' THEN 2
+                WHEN 'Noon' THEN 3
+                WHEN 'Afternoon' THEN 4
+                WHEN 'Evening' THEN 5
+                ELSE 99
+            END AS period_rank
         FROM weather w
         JOIN climate cl ON w.city_id = cl.city_id
         JOIN uv u ON w.city_id = u.city_id
         WHERE w.city_id = $1
+        AND w.generation = {ACTIVE_GENERATION_SQL}
+        AND cl.generation = w.generation AND u.generation = w.generation
         AND w.report_day = cl.report_day AND w.report_day = u.report_day
         AND w.report_month = cl.report_month AND w.report_month = u.report_month
         AND w.report_year = cl.report_year AND w.report_year = u.report_year
         AND w.period = cl.period AND w.period = u.period
+    )
+"""
+
+# shape "rows": mỗi ngày có list periods, mỗi period là 1 object (giống response cũ)
+_period_object = ", ".join(["'period', period"] + [f"'{m}', {m}" for m in VISUALIZE_METRICS])
+SQL_GET_DATA_TO_VISUALIZE = _SQL_VISUALIZE_ROWS + f"""
+    , days AS (
+        SELECT report_year, report_month, report_day,
+               jsonb_agg(jsonb_build_object({_period_object}) ORDER BY period_rank) AS periods
+        FROM joined
+        GROUP BY report_year, report_month, report_day
+    )
+    SELECT jsonb_build_object(
+        'status', 'success',
+        'data', jsonb_agg(jsonb_build_object(
+            'day', report_day, 'month', report_month, 'year', report_year, 'periods', periods
+        ) ORDER BY report_year, report_month, report_day)
+    )::text
+    FROM days
+    HAVING count(*) > 0
+"""
+
+# shape "columnar": mỗi ngày có 1 mảng cho từng chỉ số (không lặp lại tên field theo period)
+_columnar_arrays = ",\n".join(
+    f"jsonb_agg({m} ORDER BY period_rank) AS {m}" for m in ("period",) + VISUALIZE_METRICS
+)
+_columnar_object = ", ".join(
+    ["'day', report_day", "'month', report_month", "'year', report_year"]
+    + [f"'{m}', {m}" for m in ("period",) + VISUALIZE_METRICS]
+)
+SQL_GET_DATA_TO_VISUALIZE_COLUMNAR = _SQL_VISUALIZE_ROWS + f"""
+    , days AS (
+        SELECT report_year, report_month, report_day,
+               {_columnar_arrays}
+        FROM joined
+        GROUP BY report_year, report_month, report_day
+    )
+    SELECT jsonb_build_object(
+        'status', 'success',
+        'shape', 'columnar',
+        'data', jsonb_agg(jsonb_build_object({_columnar_object}) ORDER BY report_year, report_month, report_day)
+    )::text
+    FROM days
+    HAVING count(*) > 0
+"""
+
+async def build_visualization_payload(db_pool, city_id: int, shape: str = "rows") -> bytes | None:
     """
+    Lấy JSON đã gom nhóm sẵn từ Postgres và trả về dạng bytes (None nếu không có dữ liệu).
+    """
+    query = SQL_GET_DATA_TO_VISUALIZE_COLUMNAR if shape == "columnar" else SQL_GET_DATA_TO_VISUALIZE
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch(SQL_GET_DATA_TO_VISUALIZE, city_id)
+        payload = await conn.fetchval(query, city_id)
+    if payload is None:
+        return None
+    return payload.encode("utf-8")
 
-    if not rows:
-        raise HTTPException(status_code=404, detail=f"Không có dữ liệu cho city_id {city_id}")
-    # Chuyển từ list record -> list dict
-    data = [dict(row) for row in rows]
-
-    # Gom nhóm theo ngày
-    grouped = {}
-    for row in data:
-        key = (row['report_day'], row['report_month'], row['report_year'])
-        if key not in grouped:
-            grouped[key] = {
-                "day": row['report_day'],
-                "month": row['report_month'],
-                "year": row['report_year'],
-                "periods": []
-            }
-        # Thêm period vào ngày
-        grouped[key]["periods"].append({
-            "period": row['period'],
-            "temp": row['temp'],
-            "feels_like": row['feels_like'],
-            "weather_description": row['weather_description'],
-            "weather_icon": row['weather_icon'],
-            "pop": row['pop'],
-            "humidity": row['humidity'],
-            "wind_speed": row['wind_speed'],
-            "aqi": row['aqi'],
-            "pm2_5": row['pm2_5'],
-            "pm10": row['pm10'],
-            "uvi": row['uvi']
-        })
-
-    # Define a custom order for periods
-    period_order = {
-        'Early Morning': 1,
-        'Morning': 2,
-        'Noon': 3,
-        'Afternoon': 4,
-        'Evening': 5
-    }
-
-    # Chuyển về list, sort ngày và sort periods trong ngày
-    result = list(grouped.values())
-    result.sort(key=lambda x: (x['year'], x['month'], x['day']))
-    for item in result:
-        item["periods"].sort(key=lambda x: period_order.get(x['period'], 99))
+async def get_visualization_payload(db_pool, redis_cache, city_id: int, generation: str, shape: str = "rows") -> bytes | None:
+    """
+    Đọc payload đã render sẵn theo generation của city từ Redis, nếu chưa có thì build từ Postgres.
+    """
+    cache_key = f"visual:{city_id}:{generation}:{shape}"
+    payload = await redis_cache.get(cache_key)
+    if payload is None:
+        payload = await build_visualization_payload(db_pool, city_id, shape)
+        if payload is not None:
+            await redis_cache.set(cache_key, payload, ex=VISUALIZE_CACHE_TTL)
+    return payload
 
-    return {"status": "success", "data": result}  # khi có dữ liệu
+@router.get("/get_data_to_visualize/{city_id}")
+async def get_data_to_visual(
+    city_id: int,
+    request: Request,
+    shape: str = "rows",
+    db_pool = Depends(get_db),
+    redis_cache = Depends(get_redis_cache_bytes_conn)
+):
+    """
+    shape="rows" (mặc định): mỗi period là 1 object như trước.
+    shape="columnar": mỗi ngày có 1 mảng cho từng chỉ số → payload nhỏ hơn nhiều.
+    """
+    if shape not in ("rows", "columnar"):
+        raise HTTPException(status_code=400, detail="shape phải là 'rows' hoặc 'columnar'")
+    generation = await get_city_generation(city_id)
+    etag = f'"visual-{city_id}-{generation}-{shape}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={VISUALIZE_MAX_AGE}, must-revalidate"}
+
+    # Client đã có đúng phiên bản → 304, không đụng tới Postgres
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    payload = await get_visualization_payload(db_pool, redis_cache, city_id, generation, shape)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"Không có dữ liệu cho city_id {city_id}")
+    # khi có dữ liệu
+    return Response(content=payload, media_type="application/json", headers=headers)
 
 #-----------
 # endpoint lấy passive_suggest_tion cho user và city mà user thiết lặp
+SQL_GET_PASSIVE_SUGGESTION = """
+    SELECT 
+        s.text_suggestion
+    FROM suggestion s
+    WHERE s.city_id = $1 AND s.user_id = $2
+    -- chỉ lấy gợi ý của ngày hiện tại (giờ Việt Nam): bảng không còn bị TRUNCATE mỗi đêm nên cặp
+    -- user-city không được làm mới (city thiếu dự báo, job RAG lỗi) vẫn còn gợi ý của ngày cũ
+    AND make_date(s.report_year, s.report_month, s.report_day) = (now() AT TIME ZONE 'Asia/Ho_Chi_Minh')::date
+"""
+
 @router.get("/get_passive_suggestion/{city_id}")
 async def get_passive_suggestion(
     city_id: int,
     user_id: int = Depends(get_current_user),  # lấy user_id từ JWT
     db_pool = Depends(get_db)
 ):
-    SQL_GET_PASSIVE_SUGGESTION = """
-        SELECT 
-            s.text_suggestion
-        FROM suggestion s
-        WHERE s.city_id = $1 AND s.user_id = $2
-    """
     async with db_pool.acquire() as conn:
         row = await conn.fetch(SQL_GET_PASSIVE_SUGGESTION, city_id, user_id)
 
@@ -245,6 +328,55 @@ async def get_passive_suggestion(
     
     return {"status": "success", "suggestion": row[0]['text_suggestion']}
 
+#-----------
+# endpoint gom dữ liệu cho màn hình dashboard trong 1 request
+SQL_GET_USER_PROFILE = """
+    SELECT u.username, u.email, u.disease_id, d.disease_name, u.describe_disease
+    FROM users u
+    LEFT JOIN disease d ON u.disease_id = d.disease_id
+    WHERE u.user_id = $1
+"""
+
+async def _fetch_passive_suggestion(db_pool, city_id: int, user_id: int) -> str | None:
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval(SQL_GET_PASSIVE_SUGGESTION, city_id, user_id)
+
+async def _fetch_user_profile(db_pool, user_id: int) -> dict | None:
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(SQL_GET_USER_PROFILE, user_id)
+    return dict(row) if row else None
+
+@router.get("/dashboard/{city_id}")
+async def get_dashboard(
+    city_id: int,
+    shape: str = "rows",
+    user_id: int = Depends(get_current_user),
+    db_pool = Depends(get_db),
+    redis_cache = Depends(get_redis_cache_bytes_conn)
+):
+    """
+    Trả về dữ liệu visualize, passive suggestion và profile của user trong một response.
+    3 truy vấn chạy đồng thời, mỗi truy vấn trên một connection riêng của pool.
+    Phần nào không có dữ liệu sẽ là null.
+    """
+    if shape not in ("rows", "columnar"):
+        raise HTTPException(status_code=400, detail="shape phải là 'rows' hoặc 'columnar'")
+    generation = await get_city_generation(city_id)
+    visual, suggestion, profile = await asyncio.gather(
+        get_visualization_payload(db_pool, redis_cache, city_id, generation, shape),
+        _fetch_passive_suggestion(db_pool, city_id, user_id),
+        _fetch_user_profile(db_pool, user_id),
+    )
+    content = orjson.dumps({
+        "status": "success",
+        "city_id": city_id,
+        # payload visualize đã là JSON bytes → nhúng thẳng, không parse lại
+        "visual": orjson.Fragment(visual) if visual is not None else None,
+        "suggestion": suggestion,
+        "profile": profile,
+    })
+    return Response(content=content, media_type="application/json", headers={"Cache-Control": "private, no-cache"})
+
 #------------------------------------------------------------------------------------------------------
 #---------Endpoint_chatbot----------
 QUEUE_CHATBOT = os.getenv("QUEUE_CHATBOT", "queue_chatbot")
@@ -261,16 +393,20 @@ async def submit_chatbot_query(
     Nhận yêu cầu từ người dùng, tạo job và đẩy vào Redis Queue để xử lý bất đồng bộ.
     Trả về request_id để người dùng có thể lấy kết quả sau.
     """
+    # 0. Từ chối sớm nếu queue đã dồn quá ngân sách chờ (vd: worker hết quota Gemini)
+    try:
+        await check_chatbot_admission(redis_data, QUEUE_CHATBOT)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail="Hệ thống chatbot đang quá tải, vui lòng thử lại sau.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     # 1. Tạo request_id duy nhất
     request_id = str(uuid.uuid4())
-    # lấy bảng tóm tắt 6 tin nhắn của user_id trong redis db2
-    history_context_raw = await get_recent_chat_history(user_id, NUM_HISTORY_FOR_CONTEXT, redis_history)
-    if history_context_raw:
-        # Chỉ gọi tóm tắt khi có dữ liệu
-        history_context_summary = await summarize_chat_history(history_context_raw)
-    else:
-        history_context_summary = ""  # user mới, chưa có lịch sử
-    # push user_input vào trong redis db để lưu dữ liệu lịch sử. Nhớ strim
+    # lấy bản tóm tắt hội thoại đã được cập nhật nền trong redis db2 (user mới → chuỗi rỗng)
+    history_context_summary = await get_cached_summary(user_id, redis_history)
+    # push user_input vào trong redis db để lưu dữ liệu lịch sử (tự trim và tóm tắt nền)
     await append_chat_history(user_id, "user", request_body.user_input, redis_history)
     # 2. Tạo job data bao gồm tất cả các tham số và request_id
     job_data = {
@@ -283,7 +419,7 @@ async def submit_chatbot_query(
     
     # 3. Đẩy job vào queue (sử dụng đối tượng đã được Dependency Injection cung cấp)
     try:
-        await redis_data.lpush(QUEUE_CHATBOT, json.dumps(job_data))
+        await redis_data.lpush(QUEUE_CHATBOT, codec.encode(job_data))
         print(f"[API] Đã đẩy job {request_id} vào queue '{QUEUE_CHATBOT}'")
     except Exception as e:
         print(f"[API ERROR] Không thể kết nối Redis hoặc đẩy job: {e}")
@@ -331,3 +467,87 @@ async def get_chatbot_result(
         data=result
     )
 
+CHATBOT_STREAM_TIMEOUT = int(os.getenv("CHATBOT_STREAM_TIMEOUT", 120))  # giây chờ tối đa trên 1 stream
+SSE_HEARTBEAT_SECONDS = 15  # gửi comment định kỳ để proxy (ngrok, nginx) không cắt kết nối
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/stream_chatbot_result/{request_id}")
+async def stream_chatbot_result(
+    request_id: str,
+    redis_cache = Depends(get_redis_cache_conn)
+):
+    """
+    Server-Sent Events: giữ kết nối mở và đẩy kết quả ngay khi chatbot worker publish,
+    thay cho việc client gọi /get_chatbot_result mỗi giây.
+    """
+    async def event_generator():
+        # đăng ký trong generator: client ngắt trước khi response bắt đầu thì không để lại waiter
+        future = await get_result_future(request_id, redis_cache)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CHATBOT_STREAM_TIMEOUT
+        try:
+            yield _sse_event("status", {"request_id": request_id, "status": "processing"})
+            while not future.done():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield _sse_event("timeout", {
+                        "request_id": request_id,
+                        "status": "processing",
+                        "message": "Kết quả chưa sẵn sàng. Vui lòng thử lại sau."
+                    })
+                    return
+                await asyncio.wait({future}, timeout=min(SSE_HEARTBEAT_SECONDS, remaining))
+                if not future.done():
+                    yield ": ping\n\n"
+            yield _sse_event("result", {
+                "request_id": request_id,
+                "status": "completed",
+                "message": "Đã tìm thấy kết quả.",
+                "data": future.result()
+            })
+        finally:
+            unregister_waiter(request_id, future)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stream_chatbot_tokens/{request_id}")
+async def stream_chatbot_tokens(request_id: str):
+    """
+    Server-Sent Events: chuyển tiếp từng phần câu trả lời (token) và tiến trình gọi tool
+    của agent ngay khi worker ghi vào Redis Stream. Event cuối là "done" chứa câu trả lời đầy đủ.
+    """
+    async def event_generator():
+        # đăng ký trong generator (trước yield đầu tiên) để finally luôn huỷ đăng ký
+        queue = subscribe_token_stream(request_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CHATBOT_STREAM_TIMEOUT
+        try:
+            yield _sse_event("status", {"request_id": request_id, "status": "processing"})
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield _sse_event("timeout", {"request_id": request_id, "status": "processing"})
+                    return
+                try:
+                    fields = await asyncio.wait_for(queue.get(), timeout=min(SSE_HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                event_type = fields.get("type", "token")
+                yield _sse_event(event_type, {"request_id": request_id, "data": fields.get("data", "")})
+                if event_type in ("done", "error"):
+                    return
+        finally:
+            unsubscribe_token_stream(request_id, queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
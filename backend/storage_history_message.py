@@ -1,17 +1,47 @@
 import os
 import json
+import time
+import asyncio
+import uuid
+import hashlib
+import traceback
+from core.redis_client import lpush_and_trim
+from chatbot.chat_summary import summarize_chat_history
 
 MAX_HISTORY = 10  # số tin nhắn tối đa lưu cho mỗi user
 NUM_HISTORY_FOR_CONTEXT = 6  # số tin nhắn lấy ra để gửi cho agent
+SUMMARY_LOCK_TTL = 120  # giây, tránh 2 process cùng tóm tắt cho 1 user
+
+# chỉ xoá lock / ghi tóm tắt khi lock vẫn thuộc về lần chạy này (lock có thể đã hết hạn và bị lần khác lấy)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_SET_IF_OWNER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# giữ tham chiếu tới các task nền để không bị garbage collect giữa chừng
+_background_tasks = set()
+
 async def append_chat_history(user_id: int, role: str, content: str, redis_conn):
     """
     Thêm 1 message vào lịch sử chat và giữ tối đa MAX_HISTORY phần tử.
     role: 'user' hoặc 'assistant'
+    Sau đó chạy nền việc gộp message mới vào bản tóm tắt của user.
     """
     key = f"chat_history:{user_id}"
-    message = json.dumps({"role": role, "content": content})
-    await redis_conn.lpush(key, message)
-    await redis_conn.ltrim(key, 0, MAX_HISTORY - 1)  # giữ MAX_HISTORY phần tử
+    message = json.dumps({"role": role, "content": content, "ts": time.time()})
+    # LPUSH + LTRIM (giữ MAX_HISTORY phần tử) trong cùng một round trip
+    await lpush_and_trim(redis_conn, key, message, MAX_HISTORY)
+    schedule_summary_refresh(user_id, redis_conn)
 
 async def get_recent_chat_history(user_id: int, n: int, redis_conn):
     """
@@ -21,4 +51,93 @@ async def get_recent_chat_history(user_id: int, n: int, redis_conn):
     history_raw = await redis_conn.lrange(key, 0, n-1)
     # Đảo thứ tự: mới → cũ => cũ → mới
     history = [json.loads(msg) for msg in history_raw[::-1]]
-    return history
\ No newline at end of file
+    return history
+
+#---------- Bản tóm tắt cuốn chiếu (rolling summary) ----------
+# Lưu cạnh chat_history:{user_id} dưới dạng JSON:
+#   {"summary": str, "covers": hash của các message đã gộp, "seen": [digest từng message]}
+
+def _message_digest(raw_message: str) -> str:
+    return hashlib.sha1(raw_message.encode("utf-8")).hexdigest()[:16]
+
+async def get_cached_summary(user_id: int, redis_conn) -> str:
+    """
+    Đọc bản tóm tắt đã có sẵn (không gọi LLM). User mới trả về chuỗi rỗng.
+    """
+    raw = await redis_conn.get(f"chat_summary:{user_id}")
+    if not raw:
+        return ""
+    return json.loads(raw).get("summary", "")
+
+async def _window_digests(user_id: int, redis_conn):
+    window_raw = (await redis_conn.lrange(f"chat_history:{user_id}", 0, NUM_HISTORY_FOR_CONTEXT - 1))[::-1]
+    digests = [_message_digest(raw) for raw in window_raw]
+    return window_raw, digests, hashlib.sha1("".join(digests).encode("utf-8")).hexdigest()
+
+async def _refresh_locked(user_id: int, redis_conn) -> str | None:
+    """
+    Giữ lock và gộp message mới tới khi bản tóm tắt phủ hết cửa sổ.
+    Trả về `covers` của cửa sổ đã phủ, None nếu không lấy được lock / LLM lỗi / mất lock.
+    """
+    summary_key = f"chat_summary:{user_id}"
+    lock_key = f"chat_summary_lock:{user_id}"
+    token = uuid.uuid4().hex
+    if not await redis_conn.set(lock_key, token, nx=True, ex=SUMMARY_LOCK_TTL):
+        return None  # process khác đang tóm tắt, nó sẽ gộp luôn message này
+    try:
+        while True:
+            window_raw, digests, covers = await _window_digests(user_id, redis_conn)
+
+            stored_raw = await redis_conn.get(summary_key)
+            stored = json.loads(stored_raw) if stored_raw else {}
+            if stored.get("covers") == covers:
+                return covers
+
+            seen = set(stored.get("seen", []))
+            new_messages = [json.loads(raw) for raw, d in zip(window_raw, digests) if d not in seen]
+            if not new_messages:
+                summary = stored.get("summary", "")
+            else:
+                summary = await summarize_chat_history(new_messages, previous_summary=stored.get("summary", ""))
+                if summary is None:
+                    return None  # LLM lỗi → giữ bản cũ, lần append sau sẽ thử lại
+
+            written = await redis_conn.eval(_SET_IF_OWNER_SCRIPT, 2, lock_key, summary_key, token, json.dumps(
+                {"summary": summary, "covers": covers, "seen": digests}, ensure_ascii=False
+            ))
+            if not written:
+                print(f"[ChatSummary] Lock tóm tắt của user {user_id} đã hết hạn → bỏ kết quả")
+                return None
+    finally:
+        await redis_conn.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+async def refresh_rolling_summary(user_id: int, redis_conn):
+    """
+    Gộp các message chưa được tóm tắt (trong NUM_HISTORY_FOR_CONTEXT message gần nhất)
+    vào bản tóm tắt hiện có. Lặp lại tới khi bản tóm tắt phủ hết message mới nhất,
+    nên message được thêm trong lúc đang tóm tắt cũng sẽ được gộp.
+    """
+    while True:
+        covers = await _refresh_locked(user_id, redis_conn)
+        if covers is None:
+            return
+        # message thêm vào giữa lần kiểm tra cuối và lúc nhả lock: refresh của nó bị SET NX từ chối,
+        # nên sau khi nhả lock đọc lại cửa sổ 1 lần, có thay đổi thì chạy lại
+        _, _, latest = await _window_digests(user_id, redis_conn)
+        if latest == covers:
+            return
+
+def schedule_summary_refresh(user_id: int, redis_conn):
+    """
+    Chạy refresh_rolling_summary dưới dạng task nền (không chặn request/worker).
+    """
+    async def _run():
+        try:
+            await refresh_rolling_summary(user_id, redis_conn)
+        except Exception as e:
+            print(f"[ChatSummary] Lỗi cập nhật tóm tắt cho user {user_id}: {e}")
+            traceback.print_exc()
+
+    task = asyncio.create_task(_run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -9,11 +9,16 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage
 from .tool_agent import get_data_weather_climate_uv, get_name_disease, get_data_from_vector_database
 from dotenv import load_dotenv, find_dotenv
-from core.redis_client import get_redis_data, get_redis_cache_conn, get_redis_history_conn
-import json
+from core.redis_client import get_redis_data_bytes_conn, get_redis_cache_conn, get_redis_history_conn, close_redis
+from core import codec
+from core.postgresql_client import init_db, close_db
+from core.metrics import Counter, start_metrics_server, stop_metrics_server
+from core.cache import start_invalidation_listener, stop_invalidation_listener
 import traceback
 import google.api_core.exceptions
 from backend.storage_history_message import append_chat_history
+from backend.result_stream import publish_chatbot_result, append_stream_event
+from backend.admission import record_chatbot_completion, record_chatbot_heartbeat
 from langchain.schema import SystemMessage
 import redis.asyncio as redis
 import time
@@ -22,6 +27,12 @@ from redis.exceptions import ResponseError, ConnectionError, TimeoutError
 
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 QUEUE_CHATBOT = os.getenv("QUEUE_CHATBOT", "queue_chatbot")
+# Bật/tắt chế độ stream token của agent vào Redis Stream
+CHATBOT_STREAMING = os.getenv("CHATBOT_STREAMING", "true").lower() in ("1", "true", "yes")
+
+# Time-to-first-token: tính từ lúc agent bắt đầu chạy tới khi token đầu tiên được ghi vào stream
+ttft_seconds_sum = Counter("chatbot_time_to_first_token_seconds_sum", "Tổng time-to-first-token (giây)")
+ttft_seconds_count = Counter("chatbot_time_to_first_token_seconds_count", "Số câu trả lời có token đầu tiên")
 # Khởi tạo một danh sách để chứa tất cả API key từ file .env
 GEMINI_API_KEYS = []
 for i in range(12):  # Duyệt từ 0 đến 11
@@ -117,8 +128,51 @@ async def retrieve_health_guideline(query_question: str, disease_name: str):
     if response_text is None: return "không có dữ liệu"
     return response_text
 
-async def agent_process(city_id_from_fastapi: int, user_id_from_fastapi: int, input_from_user: str, history_context: str ):
-    """Chạy ví dụ minh họa."""
+def _chunk_text(chunk) -> str:
+    """
+    Lấy phần text từ AIMessageChunk (Gemini có thể trả content dạng list các part).
+    """
+    content = getattr(chunk, "content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+async def run_agent_streaming(agent_executor, inputs: dict, request_id: str, redis_stream):
+    """
+    Chạy agent bằng astream_events và ghi token + tiến trình gọi tool vào Redis Stream
+    của request_id. Trả về câu trả lời cuối cùng giống ainvoke()["output"].
+    """
+    agent_output = None
+    started_at = time.perf_counter()
+    first_token = True
+    async for event in agent_executor.astream_events(inputs, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            text = _chunk_text(event["data"].get("chunk"))
+            if text:
+                await append_stream_event(redis_stream, request_id, "token", text)
+                if first_token:
+                    first_token = False
+                    ttft = time.perf_counter() - started_at
+                    ttft_seconds_sum.inc(ttft)
+                    ttft_seconds_count.inc()
+                    print(f"[Chatbot_Agent] Job {request_id}: token đầu tiên sau {ttft:.2f}s")
+        elif kind == "on_tool_start":
+            await append_stream_event(redis_stream, request_id, "tool_start", event["name"])
+        elif kind == "on_tool_end":
+            await append_stream_event(redis_stream, request_id, "tool_end", event["name"])
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # event kết thúc của AgentExecutor (runnable gốc)
+            output = event["data"].get("output") or {}
+            agent_output = output.get("output") if isinstance(output, dict) else output
+    return agent_output
+
+async def agent_process(city_id_from_fastapi: int, user_id_from_fastapi: int, input_from_user: str, history_context: str,
+                        request_id: str | None = None, redis_stream=None):
+    """
+    Chạy agent cho một câu hỏi. Nếu truyền request_id và redis_stream (và CHATBOT_STREAMING bật)
+    thì token được stream vào Redis Stream trong lúc agent đang chạy.
+    """
     if not GEMINI_API_KEYS:
         raise ValueError("Không tìm thấy GEMINI API keys nào trong file .env.")
     
@@ -169,11 +223,17 @@ async def agent_process(city_id_from_fastapi: int, user_id_from_fastapi: int, in
             else:
                 chat_history_for_agent = []
 
-            # Gửi câu hỏi đến mô hình thông qua agent
-            response = await agent_executor.ainvoke({
+            inputs = {
                 "input": user_query, 
                 "chat_history": chat_history_for_agent,
-            })
+            }
+            if CHATBOT_STREAMING and request_id and redis_stream is not None:
+                # mỗi lần thử (có thể với key khác) bắt đầu bằng "reset" để client xoá phần đã hiển thị
+                await append_stream_event(redis_stream, request_id, "reset", first=True)
+                return await run_agent_streaming(agent_executor, inputs, request_id, redis_stream)
+
+            # Gửi câu hỏi đến mô hình thông qua agent
+            response = await agent_executor.ainvoke(inputs)
             
             agent_output = response["output"]
             return agent_output
@@ -199,7 +259,7 @@ PING_INTERVAL = 1800  # 30 phút ping Redis 1 lần
 async def worker_loop():
     global redis_data
     global redis_cache
-    redis_data = await get_redis_data()
+    redis_data = await get_redis_data_bytes_conn()
     redis_cache = await get_redis_cache_conn()
     print("[Chatbot_Agent] Started worker loop...")
     last_ping = time.time()
@@ -212,20 +272,21 @@ async def worker_loop():
                     print("[Worker] Redis ping OK")
                 else:
                     print("[Worker] Redis ping failed → reconnecting")
-                    redis_data = await get_redis_data()
+                    redis_data = await get_redis_data_bytes_conn()
                     redis_cache = await get_redis_cache_conn()
             except Exception as e:
                 print(f"[Worker] Redis ping error: {e} → reconnecting")
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
                 redis_cache = await get_redis_cache_conn()
 
             last_ping = time.time()
         
         try:
             if redis_data is None or redis_cache is None:
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
                 redis_cache = await get_redis_cache_conn()
 
+            await record_chatbot_heartbeat(redis_data)
             job_json = await redis_data.brpop(QUEUE_CHATBOT, timeout=5)
         except ResponseError as e:
             print(f"[Worker] BRPOP was force-unblocked, retrying... {e}")
@@ -249,14 +310,15 @@ async def worker_loop():
             continue
 
         _, job_str = job_json
-        job_data = json.loads(job_str)
+        job_data = codec.decode(job_str)
         request_id = job_data["request_id"]
         city_id = job_data["city_id"]
         user_id = job_data["user_id"]
         user_input = job_data["user_input"]
         summary_history = job_data["history_context"]
         try:
-            agent_output = await agent_process(city_id, user_id, user_input, summary_history)
+            agent_output = await agent_process(city_id, user_id, user_input, summary_history,
+                                               request_id=request_id, redis_stream=redis_cache)
             if agent_output is None: agent_output = "Không thể xử lý câu hỏi này"
             # Lưu kết quả vào Redis Cache (DB1) với TTL
             # TTL (time-to-live) là 1800 giây (30 phút)
@@ -267,6 +329,9 @@ async def worker_loop():
                 value=agent_output
             )
             print(f"[Chatbot_Agent] Hoàn thành job {request_id}. Kết quả đã được lưu vào Redis cache với TTL {TTL_SECONDS} giây.")
+            # Báo cho API process (đang giữ kết nối SSE của client) là đã có kết quả
+            await publish_chatbot_result(redis_cache, request_id, agent_output)
+            await append_stream_event(redis_cache, request_id, "done", agent_output, first=True)
             # 2. Push bot response vào Redis history (DB2)
             redis_history = await get_redis_history_conn()
             await append_chat_history(user_id, "bot", agent_output, redis_history)
@@ -275,11 +340,34 @@ async def worker_loop():
         except Exception as e:
             print(f"[Chatbot_Agent] Error in worker loop for job {request_id}: {e}")
             traceback.print_exc()
+            try:
+                await append_stream_event(redis_cache, request_id, "error", str(e), first=True)
+            except Exception:
+                pass
+        finally:
+            # throughput quan sát được cho admission control phía API
+            try:
+                await record_chatbot_completion(redis_data)
+            except Exception as e:
+                print(f"[Chatbot_Agent] Không ghi được throughput: {e}")
     
+async def main():
+    # Khởi tạo sẵn pool PostgreSQL cho các tool của agent
+    await init_db("chatbot")
+    await start_metrics_server()
+    start_invalidation_listener()
+    try:
+        await worker_loop()
+    finally:
+        await stop_invalidation_listener()
+        await stop_metrics_server()
+        await close_redis()
+        await close_db()
+
 # Chạy chương trình
 if __name__ == "__main__":
     try:
-        asyncio.run(worker_loop())
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\n[Chatbot_Agent] Stopped by user (Ctrl+C)")
 
@@ -4,6 +4,7 @@ from typing import List, Dict
 from dotenv import load_dotenv, find_dotenv
 import os
 import asyncio
+import google.api_core.exceptions
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 
 
@@ -31,10 +32,11 @@ async def get_next_key() -> str:
         return key
 
 
-async def summarize_chat_history(history_context: List[Dict[str, str]]) -> str:
+async def summarize_chat_history(history_context: List[Dict[str, str]], previous_summary: str = "") -> str:
     """
     Nhận history_context (list of dict {"role": ..., "content": ...})
     Trả về 1 chuỗi tóm tắt ~6 câu.
+    Nếu có previous_summary thì chỉ cần gộp các tin nhắn mới vào bản tóm tắt cũ.
     """
 
     if not GEMINI_API_KEYS:
@@ -50,15 +52,27 @@ async def summarize_chat_history(history_context: List[Dict[str, str]]) -> str:
                 history_text += f"{role.upper()}: {content}\n"
 
             # 2. Tạo prompt tóm tắt
-            prompt = (
-                "Bạn là một trợ lý AI, nhiệm vụ là tóm tắt đoạn hội thoại dưới đây để "
-                "cung cấp context cho một agent xử lý tiếp theo. "
-                "Tóm tắt nên giữ các thông tin quan trọng, ý chính, "
-                "bỏ bớt chi tiết không cần thiết và viết gọn thành khoảng 6 câu. "
-                "Hãy sử dụng ngôn ngữ tự nhiên, dễ đọc, và theo trình tự thời gian của các tin nhắn.\n\n"
-                f"Hội thoại:\n{history_text}\n\n"
-                "Trả về kết quả tóm tắt duy nhất, không kèm thẻ hay định dạng khác."
-            )
+            if previous_summary:
+                prompt = (
+                    "Bạn là một trợ lý AI, nhiệm vụ là cập nhật bản tóm tắt hội thoại để "
+                    "cung cấp context cho một agent xử lý tiếp theo. "
+                    "Hãy gộp các tin nhắn mới vào bản tóm tắt hiện có, giữ các thông tin quan trọng, ý chính, "
+                    "bỏ bớt chi tiết không cần thiết hoặc đã cũ và viết gọn thành khoảng 6 câu. "
+                    "Hãy sử dụng ngôn ngữ tự nhiên, dễ đọc, và theo trình tự thời gian của các tin nhắn.\n\n"
+                    f"Bản tóm tắt hiện có:\n{previous_summary}\n\n"
+                    f"Tin nhắn mới:\n{history_text}\n\n"
+                    "Trả về bản tóm tắt mới duy nhất, không kèm thẻ hay định dạng khác."
+                )
+            else:
+                prompt = (
+                    "Bạn là một trợ lý AI, nhiệm vụ là tóm tắt đoạn hội thoại dưới đây để "
+                    "cung cấp context cho một agent xử lý tiếp theo. "
+                    "Tóm tắt nên giữ các thông tin quan trọng, ý chính, "
+                    "bỏ bớt chi tiết không cần thiết và viết gọn thành khoảng 6 câu. "
+                    "Hãy sử dụng ngôn ngữ tự nhiên, dễ đọc, và theo trình tự thời gian của các tin nhắn.\n\n"
+                    f"Hội thoại:\n{history_text}\n\n"
+                    "Trả về kết quả tóm tắt duy nhất, không kèm thẻ hay định dạng khác."
+                )
 
             api_key = await get_next_key()
             # 3. Gọi model Gemini thông qua LangChain
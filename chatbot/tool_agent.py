@@ -1,4 +1,6 @@
 from core.postgresql_client import get_db
+from core.cache import cached
+from core.forecast_generation import ACTIVE_GENERATION_SQL
 from rag.rule_based import interpret_daily_data_for_single_user_city
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
@@ -14,7 +16,7 @@ load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 CHROMA_SERVER_HOST = os.environ.get("CHROMA_SERVER_HOST", "103.133.224.14")
 CHROMA_SERVER_PORT = int(os.environ.get("CHROMA_SERVER_PORT", 8000))
 
-GET_DATA_QUERY_WEATHER_CLIMATE_UV = """
+GET_DATA_QUERY_WEATHER_CLIMATE_UV = f"""
     SELECT
         w.period, w.report_day, w.report_month, w.report_year,
         w.temp, w.feels_like, w.humidity, w.pop, w.wind_speed, w.wind_gust, w.visibility, w.clouds_all,
@@ -29,10 +31,18 @@ GET_DATA_QUERY_WEATHER_CLIMATE_UV = """
         cl.report_day = $1 AND cl.report_month = $2 AND cl.report_year = $3 AND
         uvid.report_day = $1 AND uvid.report_month = $2 AND uvid.report_year = $3 AND
         w.period = cl.period AND w.period = uvid.period
-        AND w.city_id = $4 AND cl.city_id = $4 AND uvid.city_id = $4;
+        AND w.city_id = $4 AND cl.city_id = $4 AND uvid.city_id = $4
+        AND w.generation = {ACTIVE_GENERATION_SQL}
+        AND cl.generation = w.generation AND uvid.generation = w.generation;
 """
 
 # hàm lấy dữ liệu từ 3 bảng weather, climate, uv
+# cache theo (ngày, city); worker xoá tag "city:{id}:forecast" mỗi khi insert dữ liệu mới
+@cached(
+    "weather_climate_uv",
+    ttl=6 * 3600,
+    tags=lambda day, month, year, city_id: ["forecast", f"city:{city_id}:forecast"],
+)
 async def get_data_weather_climate_uv(day: int, month: int, year: int, city_id: int):
     pool = await get_db()
     async with pool.acquire() as conn:
@@ -95,6 +105,8 @@ GET_DATA_DISEASE = """
     WHERE u.user_id = $1
 """
 
+# cache theo user; endpoint /update_disease xoá tag "user:{id}"
+@cached("user_disease", ttl=86400, tags=lambda user_id: [f"user:{user_id}"])
 async def get_name_disease(user_id: int):
     pool = await get_db()
     async with pool.acquire() as conn:
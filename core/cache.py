@@ -0,0 +1,201 @@
+import os
+import json
+import asyncio
+import functools
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from core.redis_client import get_redis_cache_conn
+from core.metrics import Counter
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Cache 2 tầng cho dữ liệu tham chiếu:
+#   L1: TTL-LRU trong process (rất nhanh, TTL ngắn để giới hạn độ trễ khi process khác invalidate)
+#   L2: Redis DB1 (dùng chung giữa API và các worker)
+# Mỗi entry gắn tag (vd: "user:12", "city:1566083:forecast"); invalidate_tags() xoá mọi entry mang tag đó.
+CACHE_L1_MAXSIZE = int(os.getenv("CACHE_L1_MAXSIZE", 2048))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", 30))
+CACHE_DEFAULT_TTL = int(os.getenv("CACHE_DEFAULT_TTL", 3600))
+CACHE_KEY_PREFIX = "cache"
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+_l1 = TTLCache(maxsize=CACHE_L1_MAXSIZE, ttl=CACHE_L1_TTL)
+_listener_task = None
+
+cache_requests_total = Counter(
+    "cache_requests_total", "Số lần đọc cache theo tầng và kết quả", ("namespace", "result"))
+
+
+def _tag_key(tag: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:tag:{tag}"
+
+
+def make_cache_key(namespace: str, args: tuple, kwargs: dict) -> str:
+    parts = [str(a) for a in args]
+    parts += [f"{k}={kwargs[k]}" for k in sorted(kwargs)]
+    return f"{CACHE_KEY_PREFIX}:{namespace}:" + ":".join(parts)
+
+
+def _evict_local(tags):
+    """
+    Xoá khỏi L1 mọi entry mang một trong các tag (L1 nhỏ nên quét tuyến tính là đủ).
+    """
+    tags = set(tags)
+    for key, (_, entry_tags) in list(_l1.items()):
+        if tags.intersection(entry_tags):
+            _l1.pop(key, None)
+
+
+def cached(namespace: str, ttl: int = CACHE_DEFAULT_TTL, tags=None):
+    """
+    Decorator read-through cho hàm truy vấn async.
+    Kết quả phải serialize được bằng JSON; kết quả None hoặc rỗng không được cache.
+
+    Args:
+        namespace (str): Tiền tố của key cache (vd: "city_location").
+        ttl (int): Thời gian sống của entry trong Redis (giây).
+        tags: list tag cố định hoặc hàm nhận cùng tham số với hàm gốc và trả về list tag.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = make_cache_key(namespace, args, kwargs)
+
+            entry = _l1.get(key)
+            if entry is not None:
+                cache_requests_total.inc(1, namespace, "l1_hit")
+                return entry[0]
+
+            entry_tags = tags(*args, **kwargs) if callable(tags) else list(tags or [])
+            redis_cache = None
+            try:
+                redis_cache = await get_redis_cache_conn()
+                raw = await redis_cache.get(key)
+                if raw is not None:
+                    value = json.loads(raw)
+                    _l1[key] = (value, entry_tags)
+                    cache_requests_total.inc(1, namespace, "l2_hit")
+                    return value
+            except Exception as e:
+                print(f"[Cache] Lỗi đọc Redis cho {key}: {e}")
+
+            cache_requests_total.inc(1, namespace, "miss")
+            value = await func(*args, **kwargs)
+            if value is None or value == [] or value == {}:
+                return value
+
+            _l1[key] = (value, entry_tags)
+            if redis_cache is not None:
+                try:
+                    async with redis_cache.pipeline(transaction=False) as pipe:
+                        pipe.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+                        for tag in entry_tags:
+                            pipe.sadd(_tag_key(tag), key)
+                            pipe.expire(_tag_key(tag), ttl)
+                        await pipe.execute()
+                except Exception as e:
+                    print(f"[Cache] Lỗi ghi Redis cho {key}: {e}")
+            return value
+
+        wrapper.namespace = namespace
+        return wrapper
+    return decorator
+
+
+async def invalidate_tags(*tags: str):
+    """
+    Xoá mọi entry (L1 + L2) mang các tag đã cho và báo cho các process khác xoá L1 của họ.
+    """
+    if not tags:
+        return
+    _evict_local(tags)
+    try:
+        redis_cache = await get_redis_cache_conn()
+        async with redis_cache.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.smembers(_tag_key(tag))
+            members = await pipe.execute()
+
+        keys = set()
+        for tag_members in members:
+            keys.update(tag_members)
+        keys.update(_tag_key(tag) for tag in tags)
+
+        async with redis_cache.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, json.dumps(list(tags)))
+            await pipe.execute()
+    except Exception as e:
+        print(f"[Cache] Lỗi invalidate tags {tags}: {e}")
+
+
+async def _listen_invalidations():
+    while True:
+        pubsub = None
+        try:
+            redis_cache = await get_redis_cache_conn()
+            pubsub = redis_cache.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _evict_local(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Cache] Mất kết nối kênh invalidate: {e}. Thử lại sau 1s")
+            _l1.clear()  # có thể đã lỡ message → bỏ L1 cho chắc
+            await asyncio.sleep(1)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def start_invalidation_listener():
+    """
+    Chạy task nền nhận thông báo invalidate từ process khác để xoá L1.
+    Gọi khi start API hoặc worker có dùng @cached.
+    """
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_listen_invalidations())
+    return _listener_task
+
+
+async def stop_invalidation_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+# ---------- Data generation theo city ----------
+# Worker tăng generation của city mỗi khi insert dữ liệu mới; API dùng generation làm ETag
+# và làm version cho payload đã render sẵn.
+# Version của city gồm cả generation dữ liệu dự báo đang active (đổi mỗi lần refresh ban đêm).
+FORECAST_GENERATION_KEY = "data_gen:forecast"
+
+
+def _city_generation_key(city_id: int) -> str:
+    return f"data_gen:city:{city_id}"
+
+
+async def get_city_generation(city_id: int) -> str:
+    redis_cache = await get_redis_cache_conn()
+    forecast, city = await redis_cache.mget(FORECAST_GENERATION_KEY, _city_generation_key(city_id))
+    return f"{forecast or 0}.{city or 0}"
+
+
+async def bump_city_generation(city_id: int) -> int:
+    try:
+        redis_cache = await get_redis_cache_conn()
+        return await redis_cache.incr(_city_generation_key(city_id))
+    except Exception as e:
+        print(f"[Cache] Lỗi tăng generation cho city_id {city_id}: {e}")
+        return 0
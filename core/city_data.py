@@ -0,0 +1,46 @@
+import os
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from core import codec
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Dữ liệu dự báo trong ngày của một city, dùng chung cho mọi job passive suggestion của city đó.
+# Scheduler ghi 1 blob/city vào Redis DB0 (encode bằng core.codec); job chỉ mang key `data_key`.
+# Worker gợi ý cache blob trong process vì các job cùng city thường nằm cạnh nhau trong queue.
+CITY_DATA_TTL = int(os.getenv("CITY_DATA_TTL", 86400))
+CITY_DATA_LOCAL_MAXSIZE = int(os.getenv("CITY_DATA_LOCAL_MAXSIZE", 256))
+CITY_DATA_LOCAL_TTL = float(os.getenv("CITY_DATA_LOCAL_TTL", 600))
+
+_local = TTLCache(maxsize=CITY_DATA_LOCAL_MAXSIZE, ttl=CITY_DATA_LOCAL_TTL)
+
+
+def city_data_key(day: int, month: int, year: int, city_id: int) -> str:
+    return f"suggestion_city_data:{year}-{month:02d}-{day:02d}:{city_id}"
+
+
+async def store_city_data(redis_conn, blobs: dict):
+    """
+    Ghi nhiều blob {key: daily_data} trong một pipeline.
+    """
+    if not blobs:
+        return
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for key, daily_data in blobs.items():
+            pipe.set(key, codec.encode(daily_data), ex=CITY_DATA_TTL)
+        await pipe.execute()
+
+
+async def load_city_data(redis_conn, key: str):
+    """
+    Đọc daily_data của city theo key (None nếu blob đã hết hạn).
+    """
+    daily_data = _local.get(key)
+    if daily_data is not None:
+        return daily_data
+    raw = await redis_conn.get(key)
+    if raw is None:
+        return None
+    daily_data = codec.decode(raw)
+    _local[key] = daily_data
+    return daily_data
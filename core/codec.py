@@ -0,0 +1,119 @@
+import os
+from decimal import Decimal
+import orjson
+from dotenv import load_dotenv
+from core.metrics import Counter
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# msgpack và zstandard là tuỳ chọn: thiếu thư viện thì tự quay về orjson / không nén
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec dùng chung cho mọi payload job trong Redis queue.
+# Định dạng: [version][flags][body]
+#   version: CODEC_VERSION (1 byte)
+#   flags  : 4 bit thấp = format (FORMAT_ORJSON | FORMAT_MSGPACK), bit FLAG_ZSTD = body đã nén zstd
+# Payload JSON cũ (bắt đầu bằng "{" hoặc "[") vẫn decode được, nên worker mới đọc được job do
+# producer cũ đẩy vào; đặt CODEC_WRITE_LEGACY=true để producer mới ghi JSON thuần trong lúc
+# vẫn còn worker cũ đang chạy.
+CODEC_VERSION = 1
+FORMAT_ORJSON = 1
+FORMAT_MSGPACK = 2
+FLAG_ZSTD = 0x80
+
+CODEC_FORMAT = os.getenv("CODEC_FORMAT", "orjson").lower()                   # orjson | msgpack
+CODEC_ZSTD_THRESHOLD = int(os.getenv("CODEC_ZSTD_THRESHOLD", 2048))         # bytes, 0 = không nén
+CODEC_ZSTD_LEVEL = int(os.getenv("CODEC_ZSTD_LEVEL", 3))
+CODEC_WRITE_LEGACY = os.getenv("CODEC_WRITE_LEGACY", "false").lower() in ("1", "true", "yes")
+
+codec_payloads_total = Counter(
+    "codec_payloads_total", "Số payload được encode/decode theo format", ("op", "format"))
+
+if CODEC_FORMAT == "msgpack" and msgpack is None:
+    print("[Codec] CODEC_FORMAT=msgpack nhưng chưa cài msgpack → dùng orjson")
+if CODEC_ZSTD_THRESHOLD and zstandard is None:
+    print("[Codec] Chưa cài zstandard → không nén payload")
+
+_zstd_compressor = zstandard.ZstdCompressor(level=CODEC_ZSTD_LEVEL) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def _default(value):
+    # asyncpg trả cột numeric dưới dạng Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def _format_name(fmt: int) -> str:
+    return "msgpack" if fmt == FORMAT_MSGPACK else "orjson"
+
+
+def encode(obj, fmt: str = None, zstd_threshold: int = None) -> bytes:
+    """
+    Serialize một job thành bytes có header version/format, nén zstd nếu vượt ngưỡng.
+
+    Args:
+        obj: dict/list chỉ gồm kiểu JSON (Decimal được đổi sang float).
+        fmt (str): "orjson" hoặc "msgpack" (mặc định theo CODEC_FORMAT).
+        zstd_threshold (int): ngưỡng nén (mặc định theo CODEC_ZSTD_THRESHOLD, 0 = không nén).
+    """
+    if CODEC_WRITE_LEGACY and fmt is None:
+        codec_payloads_total.inc(1, "encode", "json")
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    fmt = fmt or CODEC_FORMAT
+    threshold = CODEC_ZSTD_THRESHOLD if zstd_threshold is None else zstd_threshold
+    if fmt == "msgpack" and msgpack is not None:
+        format_code = FORMAT_MSGPACK
+        body = msgpack.packb(obj, default=_default, use_bin_type=True)
+    else:
+        format_code = FORMAT_ORJSON
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    flags = format_code
+    if threshold and len(body) > threshold and _zstd_compressor is not None:
+        body = _zstd_compressor.compress(body)
+        flags |= FLAG_ZSTD
+    codec_payloads_total.inc(1, "encode", _format_name(format_code))
+    return bytes((CODEC_VERSION, flags)) + body
+
+
+def decode(data):
+    """
+    Giải mã payload do encode() tạo ra, hoặc JSON thuần (str/bytes) từ producer cũ.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if not data:
+        raise ValueError("Payload rỗng")
+
+    if data[0] != CODEC_VERSION:
+        # payload cũ: JSON thuần
+        codec_payloads_total.inc(1, "decode", "json")
+        return orjson.loads(data)
+
+    flags = data[1]
+    body = data[2:]
+    if flags & FLAG_ZSTD:
+        if _zstd_decompressor is None:
+            raise RuntimeError("Payload được nén zstd nhưng chưa cài zstandard")
+        body = _zstd_decompressor.decompress(body)
+
+    format_code = flags & 0x0F
+    codec_payloads_total.inc(1, "decode", _format_name(format_code))
+    if format_code == FORMAT_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("Payload dạng msgpack nhưng chưa cài msgpack")
+        return msgpack.unpackb(body, raw=False)
+    if format_code == FORMAT_ORJSON:
+        return orjson.loads(body)
+    raise ValueError(f"Không hỗ trợ format {format_code} (codec version {CODEC_VERSION})")
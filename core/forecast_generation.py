@@ -0,0 +1,249 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+from core.postgresql_client import get_db
+from core.redis_client import get_redis_cache_conn
+from core.cache import invalidate_tags, FORECAST_GENERATION_KEY
+from core.metrics import Gauge
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Refresh dữ liệu dự báo theo "generation" thay vì TRUNCATE:
+#   - mỗi lần refresh ban đêm tạo 1 generation mới ở trạng thái 'staging'
+#   - worker ghi dữ liệu vào generation của job (cột generation trong weather/climate/uv)
+#   - khi mọi job của generation đã xong, 1 transaction chuyển nó thành 'active'
+#   - reader chỉ đọc generation đang active → luôn thấy 1 snapshot đầy đủ
+#   - các generation cũ hơn active bị xoá (prune) sau khi chuyển
+FORECAST_PENDING_TTL = int(os.getenv("FORECAST_PENDING_TTL", 86400))
+
+GENERATION_MIGRATION_LOCK_ID = 7_302_114_001  # khoá advisory cho migration generation
+
+# Dùng trong WHERE của các query đọc dữ liệu: Postgres chỉ tính subquery này 1 lần mỗi câu lệnh
+ACTIVE_GENERATION_SQL = "(SELECT generation FROM forecast_generation WHERE status = 'active')"
+
+# Cột dữ liệu của từng bảng (không tính id và generation)
+FORECAST_COLUMNS = {
+    "weather": [
+        "city_id", "report_year", "report_month", "report_day", "period",
+        "temp", "feels_like", "humidity", "pop", "rain_3h", "wind_speed", "wind_gust",
+        "visibility", "clouds_all", "weather_main", "weather_description", "weather_icon",
+    ],
+    "climate": [
+        "city_id", "report_year", "report_month", "report_day", "period",
+        "aqi", "co", "no", "no2", "o3", "so2", "pm2_5", "pm10", "nh3",
+    ],
+    "uv": [
+        "city_id", "report_year", "report_month", "report_day", "period", "uvi",
+    ],
+}
+
+_active_generation = None
+Gauge("forecast_active_generation", "Generation dữ liệu dự báo đang active (theo lần đọc gần nhất)",
+      callback=lambda: _active_generation)
+
+
+def _pending_key(generation: int) -> str:
+    return f"forecast_generation:{generation}:pending"
+
+
+def _activated_key(generation: int) -> str:
+    return f"forecast_generation:{generation}:activated"
+
+
+async def _is_migrated(conn) -> bool:
+    return await conn.fetchval("""
+        SELECT to_regclass('forecast_generation') IS NOT NULL
+           AND (SELECT count(*) FROM information_schema.columns
+                WHERE column_name = 'generation' AND table_name = ANY($1::text[])) = $2
+    """, list(FORECAST_COLUMNS), len(FORECAST_COLUMNS))
+
+
+async def ensure_generation_schema():
+    """
+    Tạo bảng forecast_generation và cột generation (idempotent).
+    Dữ liệu có sẵn trước khi migrate thuộc generation 0 và được đánh dấu active.
+    """
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        # đã migrate rồi thì không chạy DDL (ALTER TABLE luôn lấy lock dù có IF NOT EXISTS)
+        if await _is_migrated(conn):
+            return
+        async with conn.transaction():
+            # API, scheduler, worker cùng gọi lúc khởi động: chỉ 1 process chạy DDL,
+            # các process khác chờ lock rồi kiểm tra lại (CREATE ... IF NOT EXISTS song song vẫn có thể lỗi)
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", GENERATION_MIGRATION_LOCK_ID)
+            if await _is_migrated(conn):
+                return
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS forecast_generation (
+                    generation BIGINT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'staging',
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    activated_at TIMESTAMPTZ
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS forecast_generation_one_active
+                    ON forecast_generation (status) WHERE status = 'active';
+                INSERT INTO forecast_generation (generation, status, activated_at)
+                SELECT 0, 'active', now()
+                WHERE NOT EXISTS (SELECT 1 FROM forecast_generation);
+            """)
+            for table in FORECAST_COLUMNS:
+                await conn.execute(f"""
+                    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0;
+                    CREATE INDEX IF NOT EXISTS {table}_generation_city_idx ON {table} (generation, city_id);
+                """)
+
+
+async def get_active_generation(conn) -> int:
+    global _active_generation
+    _active_generation = await conn.fetchval(f"SELECT {ACTIVE_GENERATION_SQL}")
+    return _active_generation
+
+
+async def get_write_generations(conn, for_share: bool = False) -> list:
+    """
+    Các generation mà job không gắn generation (vd: city mới do API đẩy) cần ghi vào:
+    generation active và generation đang staging (nếu có), để city đó không mất dữ liệu sau khi chuyển.
+    for_share=True (trong transaction ghi dữ liệu): khoá các dòng theo thứ tự generation tăng dần
+    (cùng thứ tự với activate_generation) → không chuyển generation được cho tới khi ghi xong.
+    """
+    rows = await conn.fetch(f"""
+        SELECT generation, status FROM forecast_generation
+        WHERE status IN ('active', 'staging')
+        ORDER BY generation
+        {"FOR SHARE" if for_share else ""}
+    """)
+    # đọc lại status sau khi khoá: dòng vừa bị chuyển trong lúc chờ lock trả về trạng thái mới
+    active = next((row["generation"] for row in rows if row["status"] == "active"), None)
+    if active is None:
+        return []
+    return [row["generation"] for row in rows if row["status"] == "active" or row["generation"] > active]
+
+
+async def create_staging_generation() -> int:
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        generation = await conn.fetchval("""
+            INSERT INTO forecast_generation (generation, status)
+            SELECT COALESCE(max(generation), 0) + 1, 'staging' FROM forecast_generation
+            RETURNING generation
+        """)
+    print(f"[Forecast] Tạo generation staging {generation}")
+    return generation
+
+
+async def set_pending_jobs(redis_data, generation: int, count: int):
+    """
+    Ghi số job của generation còn phải chạy. Nếu không có job nào thì chuyển active ngay.
+    """
+    if count <= 0:
+        await activate_generation(generation)
+        return
+    await redis_data.set(_pending_key(generation), count, ex=FORECAST_PENDING_TTL)
+
+
+async def finish_generation_job(redis_data, generation: int):
+    """
+    Gọi ở worker sau mỗi job của generation (thành công hay lỗi).
+    Job cuối cùng sẽ chuyển generation sang active.
+    """
+    remaining = await redis_data.decr(_pending_key(generation))
+    if remaining == 0:
+        await activate_generation(generation)
+
+
+async def get_pending_jobs(redis_data, generation: int) -> int | None:
+    value = await redis_data.get(_pending_key(generation))
+    return int(value) if value is not None else None
+
+
+async def wait_for_activation(generation: int, timeout: float) -> bool:
+    """
+    Chờ tới khi generation được chuyển active (BLPOP trên key tín hiệu) hoặc hết timeout.
+    """
+    redis_cache = await get_redis_cache_conn()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        # BLPOP ngắn hơn socket timeout của Redis client
+        if await redis_cache.blpop(_activated_key(generation), timeout=max(1, min(20, int(remaining)))):
+            return True
+
+
+async def activate_generation(generation: int) -> bool:
+    """
+    Chuyển generation staging thành active trong 1 transaction.
+    City nào không crawl được ở generation mới sẽ được chép từ generation cũ,
+    để snapshot mới luôn có đủ các city như snapshot cũ.
+    """
+    global _active_generation
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # khoá generation active và generation cần chuyển trong 1 câu lệnh, theo thứ tự generation tăng dần
+            # (cùng thứ tự với worker khi ghi dữ liệu, xem get_write_generations) để không deadlock
+            rows = await conn.fetch("""
+                SELECT generation, status FROM forecast_generation
+                WHERE generation = $1 OR status = 'active'
+                ORDER BY generation
+                FOR UPDATE
+            """, generation)
+            statuses = {row["generation"]: row["status"] for row in rows}
+            status = statuses.get(generation)
+            if status != "staging":
+                print(f"[Forecast] Generation {generation} ở trạng thái {status} → không chuyển")
+                return False
+            previous = next((g for g, st in statuses.items() if st == "active"), None)
+            if previous is not None and previous > generation:
+                print(f"[Forecast] Generation {generation} cũ hơn generation active {previous} → bỏ")
+                await conn.execute(
+                    "UPDATE forecast_generation SET status = 'retired' WHERE generation = $1", generation)
+                return False
+
+            if previous is not None:
+                for table, columns in FORECAST_COLUMNS.items():
+                    column_list = ", ".join(columns)
+                    await conn.execute(f"""
+                        INSERT INTO {table} ({column_list}, generation)
+                        SELECT {column_list}, $2 FROM {table} old
+                        WHERE old.generation = $1
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {table} cur WHERE cur.generation = $2 AND cur.city_id = old.city_id
+                        )
+                    """, previous, generation)
+                await conn.execute(
+                    "UPDATE forecast_generation SET status = 'retired' WHERE generation = $1", previous)
+            await conn.execute(
+                "UPDATE forecast_generation SET status = 'active', activated_at = now() WHERE generation = $1",
+                generation)
+
+    _active_generation = generation
+    print(f"[Forecast] Generation {generation} đã active (trước đó: {previous})")
+    redis_cache = await get_redis_cache_conn()
+    async with redis_cache.pipeline(transaction=False) as pipe:
+        pipe.set(FORECAST_GENERATION_KEY, generation)
+        # tín hiệu cho pipeline orchestrator đang chờ (scheduler/pipeline.py)
+        pipe.lpush(_activated_key(generation), "active")
+        pipe.expire(_activated_key(generation), FORECAST_PENDING_TTL)
+        await pipe.execute()
+    await invalidate_tags("forecast")
+    await prune_generations()
+    return True
+
+
+async def prune_generations():
+    """
+    Xoá dữ liệu của các generation cũ hơn generation active (kể cả staging bị bỏ dở).
+    """
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        active = await get_active_generation(conn)
+        if active is None:
+            return
+        for table in FORECAST_COLUMNS:
+            result = await conn.execute(f"DELETE FROM {table} WHERE generation < $1", active)
+            print(f"[Forecast] Prune {table}: {result}")
+        await conn.execute("DELETE FROM forecast_generation WHERE generation < $1", active)
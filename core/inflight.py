@@ -0,0 +1,84 @@
+import os
+from dotenv import load_dotenv
+from core.metrics import Counter
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Marker "đang xử lý" cho job crawl dữ liệu của một city (Redis DB0, cùng chỗ với queue).
+#   inflight:city:{city_id} = job_id, SET NX EX → mỗi city chỉ có 1 job trong queue/đang chạy.
+# Producer (API, scheduler) claim trước khi LPUSH; worker xác nhận lại trước khi crawl
+# và xoá marker khi xong (thành công hay lỗi). TTL là lưới an toàn khi worker chết giữa chừng.
+INFLIGHT_CITY_TTL = int(os.getenv("INFLIGHT_CITY_TTL", 900))
+INFLIGHT_CITY_PREFIX = "inflight:city:"
+
+city_jobs_deduplicated_total = Counter(
+    "city_jobs_deduplicated_total", "Số job crawl city bị bỏ qua vì city đang được xử lý", ("source",))
+
+# Đã là chủ marker → gia hạn TTL; chưa ai giữ → claim; người khác giữ → 0
+_CLAIM_OR_OWN_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if owner then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Chỉ xoá marker nếu đúng job đang giữ (tránh xoá marker của job khác sau khi TTL hết hạn)
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _inflight_key(city_id: int) -> str:
+    return f"{INFLIGHT_CITY_PREFIX}{city_id}"
+
+
+async def claim_city(redis_conn, city_id: int, job_id: str, source: str = "api") -> bool:
+    """
+    Claim city cho job_id. Trả về False nếu city đã có job khác đang chờ/đang chạy.
+    """
+    claimed = await redis_conn.set(_inflight_key(city_id), job_id, nx=True, ex=INFLIGHT_CITY_TTL)
+    if not claimed:
+        city_jobs_deduplicated_total.inc(1, source)
+    return bool(claimed)
+
+
+async def claim_cities(redis_conn, jobs, source: str = "scheduler") -> list:
+    """
+    Claim nhiều city trong một pipeline. `jobs` là list dict có "city_id" và "job_id".
+    Trả về các job đã claim được (giữ nguyên thứ tự).
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for job in jobs:
+            pipe.set(_inflight_key(job["city_id"]), job["job_id"], nx=True, ex=INFLIGHT_CITY_TTL)
+        results = await pipe.execute()
+    claimed = [job for job, ok in zip(jobs, results) if ok]
+    if len(claimed) < len(jobs):
+        city_jobs_deduplicated_total.inc(len(jobs) - len(claimed), source)
+    return claimed
+
+
+async def confirm_city(redis_conn, city_id: int, job_id: str) -> bool:
+    """
+    Gọi ở worker trước khi crawl: True nếu job này đang giữ marker (hoặc vừa claim được,
+    vd: job được đẩy trước khi có marker). False nếu job khác của cùng city đang chạy.
+    """
+    owned = await redis_conn.eval(_CLAIM_OR_OWN_SCRIPT, 1, _inflight_key(city_id), job_id, INFLIGHT_CITY_TTL)
+    if not owned:
+        city_jobs_deduplicated_total.inc(1, "worker")
+    return bool(owned)
+
+
+async def release_city(redis_conn, city_id: int, job_id: str):
+    await redis_conn.eval(_RELEASE_SCRIPT, 1, _inflight_key(city_id), job_id)
@@ -0,0 +1,206 @@
+import os
+import asyncio
+import threading
+from bisect import bisect_left
+
+# Registry đơn giản cho metrics dạng Prometheus text format.
+# Mỗi process (API, worker, scheduler) giữ registry riêng của nó.
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(label_names, label_values) -> str:
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """
+    Bộ đếm chỉ tăng (ví dụ: số request bị shed, số lần chờ connection).
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount: float = 1.0, *label_values):
+        key = tuple(map(str, label_values))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(tuple(str(v) for v in label_values), 0.0)
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, label_values, value
+
+
+class Gauge:
+    """
+    Giá trị tức thời. Có thể set trực tiếp hoặc truyền vào `callback`
+    trả về số (không label) hoặc dict {tuple(label_values): value}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[tuple(str(v) for v in label_values)] = value
+
+    def inc(self, amount: float = 1.0, *label_values):
+        key = tuple(map(str, label_values))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *label_values):
+        self.inc(-amount, *label_values)
+
+    def collect(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"[Metrics] Gauge {self.name} callback lỗi: {e}")
+                return
+            if values is None:
+                return
+            if not isinstance(values, dict):
+                values = {(): values}
+            for label_values, value in values.items():
+                yield self.name, tuple(str(v) for v in label_values), value
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, label_values, value
+
+
+class Histogram:
+    """
+    Phân phối giá trị (ví dụ: latency) theo các bucket cố định.
+    observe() chỉ tăng 1 ô đếm; giá trị tích luỹ theo `le` được tính lúc render.
+    """
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.sample_label_names = self.label_names + ("le",)
+        self.buckets = tuple(sorted(buckets))
+        # key → [đếm theo từng bucket (bucket cuối là +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value: float, *label_values):
+        key = label_values
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for label_values, counts, total, count in items:
+            label_values = tuple(str(v) for v in label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", label_values + (le,), cumulative
+            yield f"{self.name}_sum", label_values, total
+            yield f"{self.name}_count", label_values, count
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+
+
+def render_prometheus() -> str:
+    """
+    Xuất toàn bộ metrics của process hiện tại theo Prometheus text format.
+    """
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        label_names = getattr(metric, "sample_label_names", metric.label_names)
+        for name, label_values, value in metric.collect():
+            lines.append(f"{name}{_format_labels(label_names, label_values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HTTP server nhỏ cho các worker (không chạy FastAPI) ----------
+METRICS_PORT = os.getenv("METRICS_PORT")
+_metrics_server = None
+
+
+async def _handle_metrics_request(reader, writer):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render_prometheus().encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode("ascii")
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int | None = None):
+    """
+    Mở endpoint /metrics cho process worker nếu có cấu hình METRICS_PORT.
+    API FastAPI không cần gọi hàm này vì đã có route /metrics.
+    """
+    global _metrics_server
+    port = port or (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None or _metrics_server is not None:
+        return _metrics_server
+    _metrics_server = await asyncio.start_server(_handle_metrics_request, "0.0.0.0", port)
+    print(f"[Metrics] Serving metrics on port {port}")
+    return _metrics_server
+
+
+async def stop_metrics_server():
+    global _metrics_server
+    if _metrics_server is not None:
+        _metrics_server.close()
+        await _metrics_server.wait_closed()
+        _metrics_server = None
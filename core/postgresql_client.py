@@ -1,6 +1,9 @@
 import os
+import time
+import asyncio
 import asyncpg
 from dotenv import load_dotenv
+from core.metrics import Counter, Gauge
 
 # Load biến môi trường từ file .env
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
@@ -12,38 +15,213 @@ POSTGRES_DB   = os.getenv("POSTGRES_DB", "health_twin")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "")
 
+# Cấu hình chung cho mọi pool
+POSTGRES_STATEMENT_CACHE_SIZE = int(os.getenv("POSTGRES_STATEMENT_CACHE_SIZE", 256))
+POSTGRES_CONN_MAX_LIFETIME = float(os.getenv("POSTGRES_CONN_MAX_LIFETIME", 3600))  # giây, 0 = không giới hạn
+POSTGRES_CONN_MAX_IDLE = float(os.getenv("POSTGRES_CONN_MAX_IDLE", 300))  # đóng connection rảnh quá lâu
+POSTGRES_ACQUIRE_TIMEOUT = float(os.getenv("POSTGRES_ACQUIRE_TIMEOUT", 30))
+POSTGRES_DEFAULT_PROFILE = os.getenv("POSTGRES_POOL_PROFILE", "api")
+
+# Kích thước pool mặc định cho từng loại process.
+# Có thể override bằng env, ví dụ: POSTGRES_POOL_API_MIN_SIZE=10, POSTGRES_POOL_WORKER_MAX_SIZE=8
+POOL_PROFILES = {
+    "api":        {"min_size": 5, "max_size": 20},
+    "worker":     {"min_size": 2, "max_size": 5},
+    "chatbot":    {"min_size": 2, "max_size": 10},
+    "suggestion": {"min_size": 1, "max_size": 5},
+    "scheduler":  {"min_size": 1, "max_size": 3},
+}
+
 # Biến toàn cục giữ connection pool
 db_pool = None
+_init_lock = asyncio.Lock()
+
+# Metrics của pool (scrape qua /metrics)
+pool_acquire_total = Counter(
+    "postgres_pool_acquire_total", "Số lần lấy connection từ pool", ("profile",))
+pool_acquire_wait_seconds_total = Counter(
+    "postgres_pool_acquire_wait_seconds_total", "Tổng thời gian chờ lấy connection (giây)", ("profile",))
+pool_acquire_waited_total = Counter(
+    "postgres_pool_acquire_waited_total", "Số lần phải chờ > 1ms mới lấy được connection", ("profile",))
+pool_connection_recycled_total = Counter(
+    "postgres_pool_connection_recycled_total", "Số connection bị đóng do vượt max lifetime", ("profile",))
 
 
-async def init_db():
+def get_pool_profile(profile: str) -> dict:
     """
-    Khởi tạo connection pool đến PostgreSQL.
-    Gọi 1 lần khi start app/worker.
+    Trả về cấu hình min_size/max_size của một profile, đã áp dụng override từ env.
     """
-    global db_pool
+    base = POOL_PROFILES.get(profile, POOL_PROFILES["api"])
+    prefix = f"POSTGRES_POOL_{profile.upper()}"
+    min_size = int(os.getenv(f"{prefix}_MIN_SIZE", base["min_size"]))
+    max_size = int(os.getenv(f"{prefix}_MAX_SIZE", base["max_size"]))
+    return {"min_size": min(min_size, max_size), "max_size": max_size}
+
+
+class _AcquireContext:
+    """
+    Thay thế cho `pool.acquire()` của asyncpg: đo thời gian chờ và
+    đóng connection đã sống quá POSTGRES_CONN_MAX_LIFETIME khi trả về pool.
+    """
+    def __init__(self, managed_pool, timeout):
+        self._managed = managed_pool
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        self._conn = await self._managed.pool.acquire(timeout=self._timeout)
+        waited = time.perf_counter() - start
+        profile = self._managed.profile
+        pool_acquire_total.inc(1, profile)
+        pool_acquire_wait_seconds_total.inc(waited, profile)
+        if waited > 0.001:
+            pool_acquire_waited_total.inc(1, profile)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        if self._managed.is_expired(conn):
+            try:
+                # Connection.close() tự trả slot về pool, pool sẽ mở connection mới khi cần
+                await conn.close(timeout=5)
+                pool_connection_recycled_total.inc(1, self._managed.profile)
+                return
+            except Exception as e:
+                print(f"[PostgreSQL] Không đóng được connection hết hạn: {e}")
+        await self._managed.pool.release(conn)
+
+    def __await__(self):
+        # Hỗ trợ cách dùng `conn = await pool.acquire()` giống asyncpg
+        return self._managed.pool.acquire(timeout=self._timeout).__await__()
+
+
+class ManagedPool:
+    """
+    Bọc asyncpg.Pool: giữ tên profile, thời điểm tạo từng connection và
+    cung cấp số liệu in_use/idle. Các thuộc tính khác được chuyển thẳng cho asyncpg.Pool
+    nên code cũ (`pool.acquire()`, `pool.fetch(...)`) vẫn chạy như trước.
+    """
+    def __init__(self, pool: asyncpg.Pool, profile: str, created_at: dict):
+        self.pool = pool
+        self.profile = profile
+        self._created_at = created_at
+
+    def acquire(self, *, timeout: float | None = POSTGRES_ACQUIRE_TIMEOUT):
+        return _AcquireContext(self, timeout)
+
+    def is_expired(self, conn) -> bool:
+        if POSTGRES_CONN_MAX_LIFETIME <= 0 or conn is None or conn.is_closed():
+            return False
+        created = self._created_at.get(conn.get_server_pid())
+        return created is not None and time.monotonic() - created > POSTGRES_CONN_MAX_LIFETIME
+
+    def stats(self) -> dict:
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "profile": self.profile,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
+def _pool_connections_gauge():
     if db_pool is None:
-        db_pool = await asyncpg.create_pool(
+        return None
+    stats = db_pool.stats()
+    return {
+        (stats["profile"], "in_use"): stats["in_use"],
+        (stats["profile"], "idle"): stats["idle"],
+    }
+
+
+def _pool_max_size_gauge():
+    if db_pool is None:
+        return None
+    return {(db_pool.profile,): db_pool.pool.get_max_size()}
+
+
+Gauge("postgres_pool_connections", "Số connection trong pool theo trạng thái",
+      ("profile", "state"), callback=_pool_connections_gauge)
+Gauge("postgres_pool_max_size", "Số connection tối đa của pool", ("profile",),
+      callback=_pool_max_size_gauge)
+
+
+async def init_db(profile: str | None = None):
+    """
+    Khởi tạo connection pool đến PostgreSQL theo profile của process
+    ('api', 'worker', 'chatbot', 'suggestion', 'scheduler').
+    Gọi 1 lần khi start app/worker để mở sẵn min_size connection.
+    """
+    global db_pool
+    async with _init_lock:
+        if db_pool is not None:
+            return db_pool
+
+        profile = profile or POSTGRES_DEFAULT_PROFILE
+        sizing = get_pool_profile(profile)
+        created_at = {}
+
+        async def _on_connection_init(conn):
+            pid = conn.get_server_pid()
+            created_at[pid] = time.monotonic()
+            conn.add_termination_listener(lambda _conn: created_at.pop(pid, None))
+
+        pool = await asyncpg.create_pool(
             user=POSTGRES_USER,
             password=POSTGRES_PASSWORD,
             database=POSTGRES_DB,
             host=POSTGRES_HOST,
             port=POSTGRES_PORT,
-            min_size=1,   # số connection tối thiểu trong pool
-            max_size=10   # số connection tối đa
+            min_size=sizing["min_size"],   # số connection tối thiểu trong pool (mở sẵn khi khởi tạo)
+            max_size=sizing["max_size"],   # số connection tối đa
+            statement_cache_size=POSTGRES_STATEMENT_CACHE_SIZE,
+            max_inactive_connection_lifetime=POSTGRES_CONN_MAX_IDLE,
+            init=_on_connection_init,
         )
-        print("[PostgreSQL] Connection pool created")
+        db_pool = ManagedPool(pool, profile, created_at)
+        print(f"[PostgreSQL] Connection pool created (profile={profile}, "
+              f"min={sizing['min_size']}, max={sizing['max_size']})")
     return db_pool
 
 
 async def get_db():
     """
-    Lấy 1 connection từ pool.
+    Lấy connection pool.
     Nên dùng trong async context:
         async with (await get_db()).acquire() as conn:
             ...
     """
-    global db_pool
     if db_pool is None:
         await init_db()
     return db_pool
+
+
+async def close_db():
+    """
+    Đóng pool khi shutdown, chờ các connection đang dùng trả về trước.
+    """
+    global db_pool
+    if db_pool is None:
+        return
+    pool, db_pool = db_pool, None
+    try:
+        await asyncio.wait_for(pool.pool.close(), timeout=10)
+    except asyncio.TimeoutError:
+        print("[PostgreSQL] Đóng pool quá lâu → terminate")
+        pool.pool.terminate()
+    print("[PostgreSQL] Connection pool closed")
+
+
+def get_pool_stats() -> dict | None:
+    """
+    Số liệu hiện tại của pool (size/idle/in_use) để log hoặc debug.
+    """
+    return db_pool.stats() if db_pool is not None else None
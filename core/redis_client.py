@@ -1,56 +1,168 @@
 import redis.asyncio as redis
 import os
 from dotenv import load_dotenv
+from core.metrics import Gauge
 
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 # Lấy biến môi trường (cấu hình Redis cho queue và cache)
 REDIS_DATA_HOST = os.getenv("REDIS_DATA_HOST", "localhost")
 REDIS_DATA_PORT = int(os.getenv("REDIS_QUEUE_PORT", 6379))
 
+# Cấu hình pool dùng chung cho cả 3 DB
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))      # số connection tối đa mỗi DB
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 10))          # thời gian chờ khi pool đã dùng hết
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 5))     # timeout khi connect
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 30))      # timeout khi đọc/ghi (phải > timeout của BRPOP)
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_USE_HIREDIS = os.getenv("REDIS_USE_HIREDIS", "auto").lower()      # auto | true | false
+REDIS_PIPELINE_CHUNK = int(os.getenv("REDIS_PIPELINE_CHUNK", 500))       # số phần tử mỗi lệnh LPUSH khi bulk
+
+# db0: message queue, db1: kết quả tạm thời, db2: lịch sử chat
+REDIS_DB_DATA = 0
+REDIS_DB_CACHE = 1
+REDIS_DB_HISTORY = 2
+
+# Biến toàn cục để giữ pool và client (chỉ khởi tạo một lần)
+_pools = {}
+_clients = {}
+
+
+def _pool_connection_stats():
+    """
+    Số connection đang dùng / đang rảnh của từng pool (label db và mode str|bytes).
+    """
+    values = {}
+    for (db, decode_responses), pool in list(_pools.items()):
+        mode = "str" if decode_responses else "bytes"
+        values[(db, mode, "in_use")] = len(getattr(pool, "_in_use_connections", ()))
+        values[(db, mode, "idle")] = len(getattr(pool, "_available_connections", ()))
+    return values
+
+
+Gauge("redis_pool_connections", "Số connection Redis theo pool và trạng thái",
+      ("db", "mode", "state"), callback=_pool_connection_stats)
+Gauge("redis_pool_max_connections", "Số connection tối đa mỗi pool Redis",
+      callback=lambda: REDIS_MAX_CONNECTIONS)
+Gauge("redis_clients", "Số Redis client đã khởi tạo trong process",
+      callback=lambda: len(_clients))
+
+
+def _parser_class():
+    """
+    Chọn parser cho connection: hiredis (nhanh hơn khi đọc reply lớn) nếu được bật và đã cài,
+    ngược lại dùng parser thuần Python của redis-py.
+    """
+    try:
+        from redis._parsers import _AsyncHiredisParser, _AsyncRESP2Parser
+        from redis.utils import HIREDIS_AVAILABLE
+    except ImportError:
+        return None
+    if REDIS_USE_HIREDIS in ("0", "false", "no"):
+        return _AsyncRESP2Parser
+    if HIREDIS_AVAILABLE:
+        return _AsyncHiredisParser
+    if REDIS_USE_HIREDIS in ("1", "true", "yes"):
+        print("[Redis] REDIS_USE_HIREDIS bật nhưng chưa cài hiredis → dùng parser mặc định")
+    return None
+
+
+def get_redis_pool(db: int, decode_responses: bool = True) -> redis.BlockingConnectionPool:
+    """
+    Trả về connection pool (có giới hạn) cho một logical DB.
+    Khi pool hết connection, lệnh sẽ chờ tối đa REDIS_POOL_TIMEOUT giây thay vì mở thêm connection.
+    """
+    key = (db, decode_responses)
+    if key not in _pools:
+        kwargs = dict(
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            decode_responses=decode_responses,  # dữ liệu trả về là string thay vì bytes
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        parser_class = _parser_class()
+        if parser_class is not None:
+            kwargs["parser_class"] = parser_class
+        _pools[key] = redis.BlockingConnectionPool.from_url(
+            f"redis://{REDIS_DATA_HOST}:{REDIS_DATA_PORT}/{db}", **kwargs
+        )
+    return _pools[key]
+
+
+def get_redis_client(db: int, decode_responses: bool = True) -> redis.Redis:
+    key = (db, decode_responses)
+    if key not in _clients:
+        _clients[key] = redis.Redis(connection_pool=get_redis_pool(db, decode_responses))
+    return _clients[key]
 
-# Biến toàn cục để giữ kết nối (chỉ khởi tạo một lần)
-redis_data = None
-redis_cache_conn = None
-redis_history_conn = None
 
 # kết nối đến db0 chứa các messeage queue
 async def get_redis_data():
     """
     Kết nối đến Redis QUEUE (dùng để chứa jobs).
     """
-    global redis_data
-    if redis_data is None:
-        redis_data = await redis.from_url(
-            f"redis://{REDIS_DATA_HOST}:{REDIS_DATA_PORT}",
-            decode_responses=True,  # dữ liệu trả về là string thay vì bytes
-            socket_connect_timeout=30,  # timeout khi connect
-            socket_timeout=30           # timeout khi đọc/ghi
-        )
-    return redis_data
+    return get_redis_client(REDIS_DB_DATA)
+
+async def get_redis_data_bytes_conn():
+    """
+    Kết nối đến Redis QUEUE nhưng trả về bytes (job được encode bằng core.codec).
+    """
+    return get_redis_client(REDIS_DB_DATA, decode_responses=False)
 
 
 async def get_redis_cache_conn(): # dùng để kết nối đến redis lưu dữ liệu tạm thời
     """
     Kết nối đến Redis DB 1 (dùng để lưu tạm kết quả).
     """
-    global redis_cache_conn
-    if redis_cache_conn is None:
-        redis_cache_conn = await redis.from_url(
-            f"redis://{REDIS_DATA_HOST}:{REDIS_DATA_PORT}/1",
-            decode_responses=True,
-            socket_connect_timeout=30,  # timeout khi connect
-            socket_timeout=30           # timeout khi đọc/ghi
-        )
-    return redis_cache_conn
+    return get_redis_client(REDIS_DB_CACHE)
+
+async def get_redis_cache_bytes_conn():
+    """
+    Kết nối đến Redis DB 1 nhưng trả về bytes (dùng cho payload đã serialize sẵn).
+    """
+    return get_redis_client(REDIS_DB_CACHE, decode_responses=False)
 
 # --- Redis DB 2 ---
 async def get_redis_history_conn():
-    global redis_history_conn
-    if redis_history_conn is None:
-        redis_history_conn = await redis.from_url(
-            f"redis://{REDIS_DATA_HOST}:{REDIS_DATA_PORT}/2",
-            decode_responses=True,
-            socket_connect_timeout=30,  # timeout khi connect
-            socket_timeout=30           # timeout khi đọc/ghi
-        )
-    return redis_history_conn
\ No newline at end of file
+    return get_redis_client(REDIS_DB_HISTORY)
+
+
+async def close_redis():
+    """
+    Đóng toàn bộ client và pool khi process shutdown.
+    """
+    for client in list(_clients.values()):
+        await client.aclose()
+    for pool in list(_pools.values()):
+        await pool.disconnect()
+    _clients.clear()
+    _pools.clear()
+
+
+# ---------- Helpers gộp nhiều lệnh vào một round trip ----------
+async def bulk_lpush(redis_conn, queue: str, payloads, chunk_size: int = REDIS_PIPELINE_CHUNK) -> int:
+    """
+    Đẩy nhiều payload vào queue. Mỗi chunk là một lệnh LPUSH nhiều giá trị,
+    tất cả chunk được gửi trong một pipeline → chỉ 1 round trip.
+    Thứ tự xử lý (BRPOP) giữ nguyên như khi LPUSH từng phần tử.
+    """
+    payloads = list(payloads)
+    if not payloads:
+        return 0
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for start in range(0, len(payloads), chunk_size):
+            pipe.lpush(queue, *payloads[start:start + chunk_size])
+        await pipe.execute()
+    return len(payloads)
+
+
+async def lpush_and_trim(redis_conn, key: str, value, max_len: int):
+    """
+    LPUSH rồi LTRIM giữ max_len phần tử, gửi trong cùng một MULTI/EXEC.
+    """
+    async with redis_conn.pipeline(transaction=True) as pipe:
+        pipe.lpush(key, value)
+        pipe.ltrim(key, 0, max_len - 1)
+        await pipe.execute()
@@ -0,0 +1,97 @@
+import asyncio
+import argparse
+import json
+import random
+import time
+import sys
+import os
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import codec
+from core.redis_client import get_redis_client, REDIS_DB_DATA, close_redis
+
+# Benchmark codec cho job passive suggestion của một lần chạy ban đêm:
+# so sánh json stdlib (cách cũ) với orjson / msgpack, có và không có zstd.
+# In ra thời gian encode/decode mỗi job, tổng số bytes và (nếu có --redis) bộ nhớ Redis thực tế.
+
+PERIODS = ["Early Morning", "Morning", "Noon", "Afternoon", "Evening"]
+
+
+def fake_job(user_id: int, city_id: int) -> dict:
+    # cùng cấu trúc với get_data_for_json trong scheduler/scheduler_suggestion.py
+    return {
+        "user_id": user_id,
+        "city_id": city_id,
+        "disease_name": "Hen suyễn",
+        "describe_disease": "Khó thở khi trời lạnh hoặc không khí ô nhiễm, dễ lên cơn vào sáng sớm.",
+        "daily_data": [{
+            "period": period,
+            "report_time": {"report_day": 18, "report_month": 10, "report_year": 2025},
+            "weather_details": {
+                "temp": round(random.uniform(20, 35), 2), "feels_like": round(random.uniform(20, 38), 2),
+                "humidity": random.randint(40, 100), "pop": round(random.random(), 2),
+                "wind_speed": round(random.uniform(0, 10), 2), "wind_gust": round(random.uniform(0, 15), 2),
+                "visibility": 10000, "clouds_all": random.randint(0, 100),
+                "weather_main": "Clouds", "weather_description": "mây rải rác",
+            },
+            "climate_details": {
+                "aqi": random.randint(1, 5), "co": round(random.uniform(100, 900), 2),
+                "no": round(random.random(), 2), "no2": round(random.uniform(0, 40), 2),
+                "o3": round(random.uniform(0, 120), 2), "so2": round(random.uniform(0, 20), 2),
+                "pm2_5": round(random.uniform(0, 80), 2), "pm10": round(random.uniform(0, 120), 2),
+                "nh3": round(random.uniform(0, 10), 2),
+            },
+            "uvi_details": {"uvi": round(random.uniform(0, 11), 2)},
+        } for period in PERIODS],
+        "job_id": str(uuid.uuid4()),
+    }
+
+
+VARIANTS = {
+    "json (cũ)": (lambda obj: json.dumps(obj).encode("utf-8"), json.loads),
+    "orjson": (lambda obj: codec.encode(obj, fmt="orjson", zstd_threshold=0), codec.decode),
+    "orjson+zstd": (lambda obj: codec.encode(obj, fmt="orjson"), codec.decode),
+    "msgpack": (lambda obj: codec.encode(obj, fmt="msgpack", zstd_threshold=0), codec.decode),
+    "msgpack+zstd": (lambda obj: codec.encode(obj, fmt="msgpack"), codec.decode),
+}
+
+
+async def redis_memory(payloads) -> int:
+    redis_conn = get_redis_client(REDIS_DB_DATA, decode_responses=False)
+    key = f"benchmark_codec:{uuid.uuid4()}"
+    try:
+        for start in range(0, len(payloads), 500):
+            await redis_conn.lpush(key, *payloads[start:start + 500])
+        return await redis_conn.memory_usage(key, samples=0)
+    finally:
+        await redis_conn.delete(key)
+
+
+async def run(args):
+    jobs = [fake_job(user_id, 1566083 + user_id % 50) for user_id in range(args.jobs)]
+    print(f"{args.jobs} jobs (zstd threshold {codec.CODEC_ZSTD_THRESHOLD} bytes)")
+    for name, (encode, decode) in VARIANTS.items():
+        start = time.perf_counter()
+        payloads = [encode(job) for job in jobs]
+        encode_us = (time.perf_counter() - start) / len(jobs) * 1e6
+        start = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        decode_us = (time.perf_counter() - start) / len(jobs) * 1e6
+        total = sum(len(p) for p in payloads)
+        line = f"{name:>13}: encode {encode_us:7.1f}µs  decode {decode_us:7.1f}µs  total {total / 1024:9.1f} KiB"
+        if args.redis:
+            line += f"  redis {await redis_memory(payloads) / 1024:9.1f} KiB"
+        print(line)
+    if args.redis:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--redis", action="store_true", help="đo thêm MEMORY USAGE trong Redis")
+    asyncio.run(run(parser.parse_args()))
+
+# python dev_phase/benchmark_codec.py --jobs 10000 --redis
@@ -0,0 +1,123 @@
+import asyncio
+import argparse
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from worker.http_client import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_TIMEOUT,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+)
+
+# Benchmark số lần bắt tay TCP+TLS và thời gian mỗi job crawl (3 request: weather, climate, uv)
+# với stub server HTTPS local (chứng chỉ tự ký tạo bằng openssl):
+#   per-call: mỗi request tạo httpx.AsyncClient mới (cách làm cũ trong worker)
+#   shared  : 1 client dùng chung, connection keep-alive (worker/http_client.py)
+# Stub chạy trên localhost nên gần như không có độ trễ mạng; --rtt cộng thêm 2 RTT (TCP + TLS)
+# cho mỗi connection mới để ước lượng với upstream thật.
+
+BODY = b'{"list": []}'
+
+
+class StubServer:
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                self.requests += 1
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(BODY)).encode() + b"\r\n\r\n" + BODY)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def make_cert(directory: str):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+        "-keyout", key, "-out", cert,
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def client_kwargs(verify):
+    return dict(
+        verify=verify,
+        timeout=httpx.Timeout(connect=HTTP_CONNECT_TIMEOUT, read=HTTP_READ_TIMEOUT,
+                              write=HTTP_READ_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+    )
+
+
+async def job_per_call(base_url, verify):
+    for path in ("/weather", "/climate", "/uv"):
+        async with httpx.AsyncClient(**client_kwargs(verify)) as client:
+            (await client.get(base_url + path)).raise_for_status()
+
+
+async def job_shared(client, base_url):
+    for path in ("/weather", "/climate", "/uv"):
+        (await client.get(base_url + path)).raise_for_status()
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_cert(directory)
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(cert, key)
+        verify = ssl.create_default_context(cafile=cert)
+
+        stub = StubServer()
+        server = await asyncio.start_server(stub.handle, "127.0.0.1", 0, ssl=server_ctx,
+                                            ssl_handshake_timeout=30)
+        port = server.sockets[0].getsockname()[1]
+        base_url = f"https://localhost:{port}"
+
+        results = {}
+        for mode in ("per-call", "shared"):
+            stub.connections = stub.requests = 0
+            start = time.perf_counter()
+            if mode == "per-call":
+                for _ in range(args.jobs):
+                    await job_per_call(base_url, verify)
+            else:
+                async with httpx.AsyncClient(**client_kwargs(verify)) as client:
+                    for _ in range(args.jobs):
+                        await job_shared(client, base_url)
+            elapsed = time.perf_counter() - start
+            handshake_time = stub.connections * args.rtt * 2  # TCP + TLS ≈ 2 RTT mỗi connection
+            results[mode] = (elapsed + handshake_time) / args.jobs * 1000, stub.connections / args.jobs
+            print(f"{mode:9s}: {results[mode][0]:7.2f} ms/job, {results[mode][1]:.2f} handshake/job "
+                  f"({stub.requests} requests, {stub.connections} connections)")
+
+        saved_ms = results["per-call"][0] - results["shared"][0]
+        print(f"tiết kiệm : {saved_ms:7.2f} ms/job, "
+              f"{results['per-call'][1] - results['shared'][1]:.2f} handshake/job")
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--rtt", type=float, default=0.0,
+                        help="giả lập RTT (giây) cộng thêm 2 RTT cho mỗi connection mới")
+    asyncio.run(run(parser.parse_args()))
+
+# python dev_phase/benchmark_http_client.py --jobs 200 --rtt 0.03
@@ -0,0 +1,75 @@
+import asyncio
+import argparse
+import time
+import statistics
+import httpx
+
+# Benchmark "login storm": bắn nhiều request /login đồng thời và đo latency của
+# một endpoint không liên quan (GET /) trong cùng lúc.
+# Khi bcrypt chạy trên event loop, p99 của GET / tăng vọt theo số login;
+# sau khi đẩy bcrypt sang thread pool, p99 phải gần như không đổi.
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def probe_latency(client, url, stop_event, samples):
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        await client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def login_storm(client, base_url, username, password, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_login():
+        async with semaphore:
+            await client.post(f"{base_url}/login", json={"username": username, "password": password})
+
+    await asyncio.gather(*(one_login() for _ in range(total)))
+
+
+async def run(args):
+    async with httpx.AsyncClient(timeout=60) as client:
+        # 1. latency nền khi không có login
+        baseline = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_latency(client, f"{args.base_url}/", stop, baseline))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await probe
+
+        # 2. latency khi có login storm
+        under_load = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_latency(client, f"{args.base_url}/", stop, under_load))
+        start = time.perf_counter()
+        await login_storm(client, args.base_url, args.username, args.password, args.logins, args.concurrency)
+        storm_seconds = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    print(f"Login storm: {args.logins} logins, concurrency {args.concurrency}, {storm_seconds:.2f}s")
+    for name, samples in (("baseline", baseline), ("under login storm", under_load)):
+        print(f"GET / {name:>18}: n={len(samples):5d}  p50={statistics.median(samples):7.2f}ms  "
+              f"p99={percentile(samples, 99):7.2f}ms  max={max(samples):7.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--baseline-seconds", type=float, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+# python dev_phase/benchmark_login_storm.py --username demo --password demo
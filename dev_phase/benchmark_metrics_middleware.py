@@ -0,0 +1,62 @@
+import asyncio
+import argparse
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.metrics_middleware import MetricsMiddleware
+from core.metrics import render_prometheus
+
+# Benchmark chi phí của MetricsMiddleware: gọi trực tiếp một ASGI app tối giản (không qua mạng)
+# có và không có middleware, chênh lệch thời gian mỗi request chính là overhead của middleware.
+
+
+class _FakeRoute:
+    path = "/get_data_to_visualize/{city_id}"
+
+
+async def plain_app(scope, receive, send):
+    scope["route"] = _FakeRoute  # giống router FastAPI gắn route đã match vào scope
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def bench(app, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        scope = {"type": "http", "method": "GET", "path": f"/get_data_to_visualize/{i}"}
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def run(args):
+    wrapped = MetricsMiddleware(plain_app)
+    # warm up
+    await bench(plain_app, 1000)
+    await bench(wrapped, 1000)
+    base = min([await bench(plain_app, args.iterations) for _ in range(args.rounds)])
+    with_metrics = min([await bench(wrapped, args.iterations) for _ in range(args.rounds)])
+    print(f"không middleware : {base:6.2f} µs/request")
+    print(f"có MetricsMiddleware: {with_metrics:6.2f} µs/request")
+    print(f"overhead         : {with_metrics - base:6.2f} µs/request")
+    start = time.perf_counter()
+    body = render_prometheus()
+    print(f"render /metrics  : {(time.perf_counter() - start) * 1e3:6.2f} ms ({len(body)} bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+# python dev_phase/benchmark_metrics_middleware.py
@@ -0,0 +1,99 @@
+import asyncio
+import argparse
+import json
+import time
+import sys
+import os
+from decimal import Decimal
+import asyncpg
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.postgresql_client import POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD
+from backend.router import SQL_GET_DATA_TO_VISUALIZE, SQL_GET_DATA_TO_VISUALIZE_COLUMNAR, VISUALIZE_METRICS
+
+# Benchmark payload của /get_data_to_visualize:
+#   legacy   : lấy từng row rồi gom nhóm + json.dumps trong Python (cách cũ)
+#   rows     : Postgres gom nhóm và trả JSON text (shape mặc định)
+#   columnar : Postgres gom nhóm, mỗi chỉ số là 1 mảng (shape=columnar)
+# In ra số request/giây, số row xử lý/giây và kích thước response.
+
+SQL_LEGACY = """
+    SELECT
+        w.report_day, w.report_month, w.report_year, w.period, w.humidity,
+        w.temp, w.feels_like, w.weather_description, w.weather_icon, w.pop, w.wind_speed,
+        cl.aqi, cl.pm2_5, cl.pm10, u.uvi
+    FROM weather w
+    JOIN climate cl ON w.city_id = cl.city_id
+    JOIN uv u ON w.city_id = u.city_id
+    WHERE w.city_id = $1
+    AND w.report_day = cl.report_day AND w.report_day = u.report_day
+    AND w.report_month = cl.report_month AND w.report_month = u.report_month
+    AND w.report_year = cl.report_year AND w.report_year = u.report_year
+    AND w.period = cl.period AND w.period = u.period
+"""
+
+PERIOD_ORDER = {'Early Morning': 1, 'Morning': 2, 'Noon': 3, 'Afternoon': 4, 'Evening': 5}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def legacy_payload(conn, city_id):
+    rows = await conn.fetch(SQL_LEGACY, city_id)
+    grouped = {}
+    for row in rows:
+        key = (row['report_day'], row['report_month'], row['report_year'])
+        if key not in grouped:
+            grouped[key] = {"day": row['report_day'], "month": row['report_month'],
+                            "year": row['report_year'], "periods": []}
+        grouped[key]["periods"].append({"period": row['period'], **{m: row[m] for m in VISUALIZE_METRICS}})
+    result = sorted(grouped.values(), key=lambda x: (x['year'], x['month'], x['day']))
+    for item in result:
+        item["periods"].sort(key=lambda x: PERIOD_ORDER.get(x['period'], 99))
+    return json.dumps({"status": "success", "data": result}, ensure_ascii=False,
+                      default=_json_default).encode("utf-8"), len(rows)
+
+
+async def sql_payload(conn, city_id, query):
+    payload = await conn.fetchval(query, city_id)
+    return (payload or "").encode("utf-8"), None
+
+
+async def bench(name, func, conn, city_id, iterations, row_count):
+    await func(conn, city_id)  # warm up (prepare statement)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        payload, _ = await func(conn, city_id)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>9}: {iterations / elapsed:8.1f} req/s  {iterations * row_count / elapsed:10.0f} rows/s  "
+          f"{len(payload):8d} bytes")
+
+
+async def run(args):
+    conn = await asyncpg.connect(host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB,
+                                 user=POSTGRES_USER, password=POSTGRES_PASSWORD)
+    try:
+        _, row_count = await legacy_payload(conn, args.city_id)
+        if not row_count:
+            print(f"Không có dữ liệu cho city_id {args.city_id}")
+            return
+        print(f"city_id={args.city_id}, {row_count} rows, {args.iterations} lần mỗi cách")
+        await bench("legacy", legacy_payload, conn, args.city_id, args.iterations, row_count)
+        await bench("rows", lambda c, i: sql_payload(c, i, SQL_GET_DATA_TO_VISUALIZE),
+                    conn, args.city_id, args.iterations, row_count)
+        await bench("columnar", lambda c, i: sql_payload(c, i, SQL_GET_DATA_TO_VISUALIZE_COLUMNAR),
+                    conn, args.city_id, args.iterations, row_count)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--city-id", type=int, required=True)
+    parser.add_argument("--iterations", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+# python dev_phase/benchmark_visualize.py --city-id 1566083
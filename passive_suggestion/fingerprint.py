@@ -0,0 +1,73 @@
+import hashlib
+import orjson
+from core.metrics import Counter
+
+# Fingerprint đầu vào của passive suggestion: nếu dự báo (đã làm tròn) và thông tin bệnh của user
+# không đổi so với lần tạo gợi ý trước thì giữ nguyên gợi ý cũ, không gọi embedding/LLM nữa.
+# Fingerprint của lần gợi ý thành công gần nhất lưu trong Redis hash (DB0): field "{user_id}:{city_id}".
+FINGERPRINT_HASH_KEY = "suggestion_fingerprint"
+FINGERPRINT_VERSION = "1"  # đổi khi thay cách làm tròn/prompt để buộc tạo lại toàn bộ
+
+# Bước làm tròn cho từng chỉ số: chênh lệch nhỏ hơn bước này không làm lời khuyên thay đổi
+QUANTIZE_STEPS = {
+    "weather_details": {
+        "temp": 1, "feels_like": 1, "humidity": 5, "pop": 0.1,
+        "wind_speed": 1, "wind_gust": 2, "visibility": 1000, "clouds_all": 10,
+    },
+    "climate_details": {
+        "aqi": 1, "co": 50, "no": 1, "no2": 5, "o3": 10, "so2": 5, "pm2_5": 5, "pm10": 10, "nh3": 2,
+    },
+    "uvi_details": {"uvi": 1},
+}
+
+suggestion_jobs_total = Counter(
+    "suggestion_jobs_total", "Số cặp user-city của passive suggestion theo kết quả (pushed | skipped)", ("result",))
+
+
+def _quantize(value, step):
+    if value is None:
+        return None
+    return round(float(value) / step) * step
+
+
+def city_fingerprint(daily_data: list) -> str:
+    """
+    Digest dự báo của city sau khi làm tròn (tính 1 lần cho mọi user của city).
+    """
+    quantized = []
+    for period_data in daily_data:
+        item = [period_data["period"], period_data["weather_details"].get("weather_main")]
+        for group, steps in QUANTIZE_STEPS.items():
+            details = period_data.get(group, {})
+            item.extend(_quantize(details.get(name), step) for name, step in steps.items())
+        quantized.append(item)
+    return hashlib.sha1(orjson.dumps(quantized)).hexdigest()
+
+
+def job_fingerprint(city_digest: str, disease_name: str, describe_disease: str) -> str:
+    describe = " ".join((describe_disease or "").split()).lower()
+    raw = "\x1f".join([FINGERPRINT_VERSION, city_digest, disease_name or "", describe])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def _field(user_id: int, city_id: int) -> str:
+    return f"{user_id}:{city_id}"
+
+
+async def get_stored_fingerprints(redis_conn, pairs: list) -> list:
+    """
+    Fingerprint đã lưu cho list (user_id, city_id), None nếu chưa có.
+    """
+    if not pairs:
+        return []
+    values = await redis_conn.hmget(FINGERPRINT_HASH_KEY, [_field(u, c) for u, c in pairs])
+    return [v.decode("utf-8") if isinstance(v, bytes) else v for v in values]
+
+
+async def store_fingerprints(redis_conn, user_ids: list, city_id: int, fingerprint: str):
+    await redis_conn.hset(FINGERPRINT_HASH_KEY, mapping={_field(u, city_id): fingerprint for u in user_ids})
+
+
+async def delete_fingerprints(redis_conn, pairs: list):
+    if pairs:
+        await redis_conn.hdel(FINGERPRINT_HASH_KEY, *[_field(u, c) for u, c in pairs])
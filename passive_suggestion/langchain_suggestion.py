@@ -56,11 +56,12 @@ async def rag_for_suggestion(job_data: dict):
     for _ in range(len(GEMINI_API_KEYS)):
         try:
             # Lấy thông tin cần thiết từ job_data
-            user_id = job_data.get('user_id')
+            # job theo cohort mang danh sách user_ids (job cũ chỉ có 1 user_id)
+            user_ids = job_data.get('user_ids') or [job_data.get('user_id')]
             city_id = job_data.get('city_id')
             
             # Kiểm tra xem user_id và city_id có tồn tại không
-            if user_id is None or city_id is None:
+            if None in user_ids or city_id is None:
                 logger.error("Dữ liệu job_data không chứa user_id hoặc city_id.")
                 return
 
@@ -156,9 +157,10 @@ async def rag_for_suggestion(job_data: dict):
             print('check_response_object: ', text_suggestion )
             pool = await get_db()
             async with pool.acquire() as conn:
+                # cùng 1 gợi ý cho mọi thành viên cohort, ghi trong 1 câu lệnh
                 insert_query = """
                     INSERT INTO suggestion (user_id, city_id, text_suggestion, report_year, report_month, report_day)
-                    VALUES ($1, $2, $3, $4, $5, $6)
+                    SELECT user_id, $2, $3, $4, $5, $6 FROM unnest($1::int[]) AS t(user_id)
                     ON CONFLICT (user_id, city_id) DO UPDATE SET
                         text_suggestion = EXCLUDED.text_suggestion,
                         report_year = EXCLUDED.report_year,
@@ -167,10 +169,10 @@ async def rag_for_suggestion(job_data: dict):
                 """
                 await conn.execute(
                     insert_query,
-                    user_id, city_id, text_suggestion, report_year, report_month, report_day
+                    user_ids, city_id, text_suggestion, report_year, report_month, report_day
                 )
-            print('Already Insert to Database')
-            return
+            print(f'Already Insert to Database for {len(user_ids)} users')
+            return True
         except google.api_core.exceptions.ServiceUnavailable as e:
             print(f"[RAG ERROR] API call failed with ServiceUnavailable error. This is a server-side issue. Retrying with a new key... {e}")
             await asyncio.sleep(2) # Chờ lâu hơn một chút
@@ -180,10 +182,10 @@ async def rag_for_suggestion(job_data: dict):
             await asyncio.sleep(1)
         except Exception as e:
             print(f"[RAG ERROR] Failed to perform RAG for job: {e}")
-            return
+            return False
     
     # Nếu tất cả các key đều bị lỗi, trả về một lỗi cuối cùng
     print('tất cả key đã bị rate limit')
-    return
+    return False
 
 
@@ -1,9 +1,13 @@
 import os
-from core.redis_client import get_redis_data
+from core.redis_client import get_redis_data_bytes_conn, close_redis
+from core import codec
+from core.city_data import load_city_data
+from .fingerprint import store_fingerprints
+from core.postgresql_client import init_db, close_db
+from core.metrics import start_metrics_server, stop_metrics_server
 from dotenv import load_dotenv
 from .langchain_suggestion import rag_for_suggestion
 import asyncio
-import json
 import traceback
 import redis.asyncio as redis
 import time
@@ -13,12 +17,22 @@ load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 QUEUE_PASSIVE_SUGGESTION = os.getenv("QUEUE_PASSIVE_SUGGESTION", "queue_passive_suggestion")
 
 async def process_job(job_data: dict):
-    await rag_for_suggestion(job_data)
+    # job mới chỉ mang key tới blob dự báo dùng chung của city
+    if "daily_data" not in job_data and job_data.get("data_key"):
+        daily_data = await load_city_data(redis_data, job_data["data_key"])
+        if daily_data is None:
+            print(f"[Suggestion_Worker] Blob {job_data['data_key']} đã hết hạn → skip job {job_data.get('job_id')}")
+            return
+        job_data["daily_data"] = daily_data
+    # chỉ lưu fingerprint khi gợi ý đã được ghi, để job lỗi được tạo lại ở lần chạy sau
+    if await rag_for_suggestion(job_data) and job_data.get("fingerprint"):
+        user_ids = job_data.get("user_ids") or [job_data["user_id"]]
+        await store_fingerprints(redis_data, user_ids, job_data["city_id"], job_data["fingerprint"])
 
 PING_INTERVAL = 1800  # 30 phút ping Redis 1 lần
 async def worker_loop():
     global redis_data
-    redis_data = await get_redis_data()
+    redis_data = await get_redis_data_bytes_conn()
     print("[Suggestion_Worker] Started worker loop...")
     last_ping = time.time()
     while True:
@@ -29,15 +43,15 @@ async def worker_loop():
                     print("[Worker] Redis ping OK")
                 else:
                     print("[Worker] Redis ping failed → reconnecting")
-                    redis_data = await get_redis_data()
+                    redis_data = await get_redis_data_bytes_conn()
             except Exception as e:
                 print(f"[Worker] Redis ping error: {e} → reconnecting")
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
             last_ping = time.time()
 
         try:
             if redis_data is None:
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
 
             job_json = await redis_data.brpop(QUEUE_PASSIVE_SUGGESTION, timeout=5)
 
@@ -63,7 +77,7 @@ async def worker_loop():
             continue
 
         _, job_str = job_json
-        job_data = json.loads(job_str)
+        job_data = codec.decode(job_str)
 
         try:
             await process_job(job_data) 
@@ -71,9 +85,20 @@ async def worker_loop():
             print(f"[Suggestion_Worker] Error processing job {job_data.get('job_id')}: {e}")
             traceback.print_exc()
 
+async def main():
+    # Khởi tạo sẵn pool PostgreSQL theo profile của worker gợi ý
+    await init_db("suggestion")
+    await start_metrics_server()
+    try:
+        await worker_loop()
+    finally:
+        await stop_metrics_server()
+        await close_redis()
+        await close_db()
+
 if __name__ == "__main__":
     try:
-        asyncio.run(worker_loop())
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\n[Suggestion_Worker] Stopped by user (Ctrl+C)")
 
@@ -0,0 +1,175 @@
+import os
+import uuid
+import socket
+import asyncio
+import functools
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+from core.redis_client import get_redis_data
+from core.metrics import Counter, Gauge
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Bầu leader giữa các replica scheduler bằng lease trong Redis:
+#   leader:scheduler = instance_id, SET NX PX lease → replica nào giữ key là leader
+#   leader gia hạn lease mỗi lease/3 (Lua: chỉ gia hạn nếu vẫn là chủ key)
+#   leader chết → key hết hạn sau tối đa 1 lease, replica khác claim được
+# Mọi replica đều chạy APScheduler; mỗi lần job được kích hoạt chỉ leader chạy,
+# và key "đã fire" (SET NX) theo thời điểm kích hoạt chặn chạy trùng trong lúc chuyển leader.
+VIETNAM_TIMEZONE = ZoneInfo("Asia/Ho_Chi_Minh")
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", 15))
+SCHEDULER_FIRE_KEY_TTL = int(os.getenv("SCHEDULER_FIRE_KEY_TTL", 86400))
+# tìm thời điểm kích hoạt theo lịch trong khoảng này trước hiện tại (lớn hơn misfire grace + độ trễ event loop)
+SCHEDULER_FIRE_LOOKBACK = float(os.getenv("SCHEDULER_FIRE_LOOKBACK", 3600))
+LEADER_KEY_PREFIX = "leader:"
+
+scheduler_is_leader = Gauge("scheduler_is_leader", "1 nếu replica này đang là leader")
+scheduler_leader_changes_total = Counter(
+    "scheduler_leader_changes_total", "Số lần replica này nhận/mất quyền leader", ("event",))
+scheduler_job_fires_total = Counter(
+    "scheduler_job_fires_total", "Số lần job được kích hoạt theo kết quả", ("job", "result"))
+
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderElector:
+    def __init__(self, name: str = "scheduler", lease_seconds: float = SCHEDULER_LEASE_SECONDS):
+        self.key = f"{LEADER_KEY_PREFIX}{name}"
+        self.lease_ms = int(lease_seconds * 1000)
+        self.lease_seconds = lease_seconds
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._leader_until = 0.0  # thời điểm (loop.time) lease hết hạn theo đồng hồ local
+        self._became_leader = asyncio.Event()
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        # chỉ tin vào lease nếu chưa hết hạn theo đồng hồ local (phòng event loop bị treo lâu)
+        return asyncio.get_running_loop().time() < self._leader_until
+
+    def _set_leader(self, leader: bool, renewed_at: float):
+        was_leader = self._leader_until > renewed_at
+        if leader:
+            # trừ hao 1/3 lease cho độ lệch thời gian giữa lúc gửi lệnh và lúc Redis set TTL
+            self._leader_until = renewed_at + self.lease_seconds * 2 / 3
+            self._became_leader.set()
+            if not was_leader:
+                scheduler_leader_changes_total.inc(1, "acquired")
+                print(f"[Leader] {self.instance_id} trở thành leader")
+        else:
+            self._leader_until = 0.0
+            self._became_leader.clear()
+            if was_leader:
+                scheduler_leader_changes_total.inc(1, "lost")
+                print(f"[Leader] {self.instance_id} mất quyền leader")
+        scheduler_is_leader.set(1 if leader else 0)
+
+    async def _try_acquire_or_renew(self):
+        redis_conn = await get_redis_data()
+        now = asyncio.get_running_loop().time()
+        if self._leader_until > 0:
+            renewed = await redis_conn.eval(_RENEW_SCRIPT, 1, self.key, self.instance_id, self.lease_ms)
+            self._set_leader(bool(renewed), now)
+        else:
+            acquired = await redis_conn.set(self.key, self.instance_id, nx=True, px=self.lease_ms)
+            self._set_leader(bool(acquired), now)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._try_acquire_or_renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Leader] Lỗi gia hạn lease: {e}")
+                self._set_leader(False, asyncio.get_running_loop().time())
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # nhả lease ngay để replica khác không phải chờ hết hạn
+        try:
+            redis_conn = await get_redis_data()
+            await redis_conn.eval(_RELEASE_SCRIPT, 1, self.key, self.instance_id)
+        except Exception as e:
+            print(f"[Leader] Lỗi nhả lease: {e}")
+        self._set_leader(False, 0.0)
+
+    async def wait_for_leadership(self, timeout: float) -> bool:
+        if self.is_leader:
+            return True
+        try:
+            await asyncio.wait_for(self._became_leader.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.is_leader
+
+
+def scheduled_fire_time(trigger, now: datetime) -> datetime | None:
+    """
+    Thời điểm kích hoạt theo lịch gần nhất (<= now) của trigger APScheduler.
+    Mọi replica tính ra cùng một giá trị dù mỗi replica thức dậy lệch nhau vài giây/phút.
+    """
+    fire = trigger.get_next_fire_time(None, now - timedelta(seconds=SCHEDULER_FIRE_LOOKBACK))
+    if fire is None or fire > now:
+        return None
+    while True:
+        following = trigger.get_next_fire_time(fire, fire + timedelta(seconds=1))
+        if following is None or following > now:
+            return fire
+        fire = following
+
+
+def leader_only(elector: LeaderElector, job_name: str, trigger):
+    """
+    Bọc job của APScheduler: chỉ leader chạy, mỗi thời điểm kích hoạt chỉ chạy 1 lần trên toàn cụm.
+    Key chống chạy trùng lấy theo thời điểm kích hoạt theo lịch của `trigger` (không theo đồng hồ lúc chạy).
+    Replica chưa là leader chờ tối đa 1 lease (trường hợp leader cũ vừa chết đúng lúc job tới giờ).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            now = datetime.now(VIETNAM_TIMEZONE)
+            scheduled = scheduled_fire_time(trigger, now)
+            if scheduled is None:
+                # chạy tay/ngoài lịch: không có thời điểm theo lịch để so
+                print(f"[Leader] Job {job_name} chạy ngoài lịch lúc {now:%Y-%m-%dT%H:%M}")
+                scheduled = now
+            fire_time = scheduled.astimezone(VIETNAM_TIMEZONE).strftime("%Y-%m-%dT%H:%M")
+            if not await elector.wait_for_leadership(elector.lease_seconds * 1.5):
+                scheduler_job_fires_total.inc(1, job_name, "not_leader")
+                return
+            redis_conn = await get_redis_data()
+            fire_key = f"scheduler:fired:{job_name}:{fire_time}"
+            if not await redis_conn.set(fire_key, elector.instance_id, nx=True, ex=SCHEDULER_FIRE_KEY_TTL):
+                scheduler_job_fires_total.inc(1, job_name, "duplicate")
+                print(f"[Leader] Job {job_name} lúc {fire_time} đã được replica khác chạy → skip")
+                return
+            scheduler_job_fires_total.inc(1, job_name, "run")
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+import os
+import time
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+from core.postgresql_client import get_db
+from core.redis_client import get_redis_data
+from core.metrics import Counter, Gauge
+from core.forecast_generation import wait_for_activation, activate_generation, get_pending_jobs
+from .scheduler_push_job_collect_data import push_jobs_collect_data
+from .scheduler_suggestion import push_job_passive_suggestion
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Pipeline ban đêm: crawl → (chờ crawl xong hoặc hết hạn) → passive suggestion.
+# Thay cho 2 cron cố định 0h01 / 0h30: stage sau chạy ngay khi stage trước xong.
+VIETNAM_TIMEZONE = ZoneInfo("Asia/Ho_Chi_Minh")
+PIPELINE_CRAWL_DEADLINE = float(os.getenv("PIPELINE_CRAWL_DEADLINE", 1800))  # giây
+PIPELINE_PROGRESS_INTERVAL = float(os.getenv("PIPELINE_PROGRESS_INTERVAL", 60))
+
+pipeline_stage_duration_seconds = Gauge(
+    "pipeline_stage_duration_seconds", "Thời gian chạy của từng stage ở lần chạy gần nhất", ("stage",))
+pipeline_runs_total = Counter(
+    "pipeline_runs_total", "Số lần chạy pipeline theo kết quả", ("status",))
+
+
+async def ensure_pipeline_schema():
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_stage_run (
+                run_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at TIMESTAMPTZ NOT NULL,
+                finished_at TIMESTAMPTZ NOT NULL,
+                duration_seconds DOUBLE PRECISION NOT NULL,
+                detail TEXT,
+                PRIMARY KEY (run_id, stage)
+            );
+        """)
+
+
+async def record_stage(run_id: str, stage: str, status: str, started_at: datetime, duration: float, detail: str = ""):
+    """
+    Lưu thời gian của stage vào bảng pipeline_stage_run (để xem xu hướng theo ngày).
+    """
+    pipeline_stage_duration_seconds.set(duration, stage)
+    print(f"[Pipeline {run_id}] Stage {stage}: {status} sau {duration:.1f}s {detail}")
+    try:
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO pipeline_stage_run (run_id, stage, status, started_at, finished_at, duration_seconds, detail)
+                VALUES ($1, $2, $3, $4, now(), $5, $6)
+                ON CONFLICT (run_id, stage) DO UPDATE
+                SET status = EXCLUDED.status, finished_at = EXCLUDED.finished_at,
+                    duration_seconds = EXCLUDED.duration_seconds, detail = EXCLUDED.detail
+            """, run_id, stage, status, started_at, duration, detail)
+    except Exception as e:
+        print(f"[Pipeline {run_id}] Không lưu được thời gian stage {stage}: {e}")
+
+
+async def _wait_crawl_drained(run_id: str, generation: int) -> bool:
+    """
+    Chờ worker chạy hết job của generation (generation được chuyển active), log tiến độ định kỳ.
+    Trả về False nếu hết PIPELINE_CRAWL_DEADLINE.
+    """
+    redis_data = await get_redis_data()
+    deadline = time.monotonic() + PIPELINE_CRAWL_DEADLINE
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if await wait_for_activation(generation, min(remaining, PIPELINE_PROGRESS_INTERVAL)):
+            return True
+        print(f"[Pipeline {run_id}] Còn {await get_pending_jobs(redis_data, generation)} job crawl chưa xong")
+
+
+async def run_nightly_pipeline():
+    run_id = datetime.now(VIETNAM_TIMEZONE).strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    print(f"[Pipeline {run_id}] Bắt đầu")
+    status = "success"
+
+    # Stage 1: crawl dữ liệu dự báo vào generation staging
+    started_at, start = datetime.now(VIETNAM_TIMEZONE), time.monotonic()
+    try:
+        generation, pushed = await push_jobs_collect_data()
+        if await _wait_crawl_drained(run_id, generation):
+            crawl_status = "drained"
+        else:
+            # hết hạn: chuyển generation luôn (city chưa crawl xong được chép từ generation cũ)
+            crawl_status = "deadline"
+            status = "partial"
+            await activate_generation(generation)
+        await record_stage(run_id, "crawl", crawl_status, started_at, time.monotonic() - start,
+                           f"generation={generation} jobs={pushed}")
+    except Exception as e:
+        await record_stage(run_id, "crawl", "failed", started_at, time.monotonic() - start, str(e))
+        pipeline_runs_total.inc(1, "failed")
+        raise
+
+    # Stage 2: passive suggestion cho ngày hiện tại, chạy ngay sau khi dữ liệu mới đã active
+    started_at, start = datetime.now(VIETNAM_TIMEZONE), time.monotonic()
+    try:
+        await push_job_passive_suggestion(started_at.day, started_at.month, started_at.year)
+        await record_stage(run_id, "suggestion", "pushed", started_at, time.monotonic() - start)
+    except Exception as e:
+        await record_stage(run_id, "suggestion", "failed", started_at, time.monotonic() - start, str(e))
+        pipeline_runs_total.inc(1, "failed")
+        raise
+
+    pipeline_runs_total.inc(1, status)
+    print(f"[Pipeline {run_id}] Hoàn tất ({status})")
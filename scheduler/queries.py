@@ -1,22 +1,33 @@
 # queries.py
+from core.forecast_generation import ACTIVE_GENERATION_SQL
 
-GET_FULL_DATA_QUERY = """
+# Dự báo trong ngày của mọi city có người theo dõi: mỗi city chỉ đọc 1 lần (không nhân theo số user)
+GET_CITY_FORECAST_QUERY = f"""
     SELECT
-        uc.user_id, uc.city_id, d.disease_name, u.describe_disease,
-        w.period, w.report_day, w.report_month, w.report_year,
+        w.city_id, w.period, w.report_day, w.report_month, w.report_year,
         w.temp, w.feels_like, w.humidity, w.pop, w.wind_speed, w.wind_gust, w.visibility, w.clouds_all,
         w.weather_main, w.weather_description,
         cl.aqi, cl.co, cl.no, cl.no2, cl.o3, cl.so2, cl.pm2_5, cl.pm10, cl.nh3,
         uvid.uvi
-    FROM user_city uc
-    JOIN users u ON uc.user_id = u.user_id
-    JOIN disease d ON u.disease_id = d.disease_id
-    JOIN weather w ON uc.city_id = w.city_id
-    JOIN climate cl ON uc.city_id = cl.city_id
-    JOIN uv uvid ON uc.city_id = uvid.city_id
+    FROM weather w
+    JOIN climate cl ON w.city_id = cl.city_id
+    JOIN uv uvid ON w.city_id = uvid.city_id
     WHERE
+        w.city_id IN (SELECT DISTINCT city_id FROM user_city) AND
         w.report_day = $1 AND w.report_month = $2 AND w.report_year = $3 AND
         cl.report_day = $1 AND cl.report_month = $2 AND cl.report_year = $3 AND
         uvid.report_day = $1 AND uvid.report_month = $2 AND uvid.report_year = $3 AND
-        w.period = cl.period AND w.period = uvid.period;
-"""
\ No newline at end of file
+        w.period = cl.period AND w.period = uvid.period AND
+        w.generation = {ACTIVE_GENERATION_SQL} AND
+        cl.generation = w.generation AND uvid.generation = w.generation
+    ORDER BY w.city_id;
+"""
+
+# Danh sách user theo dõi từng city kèm thông tin bệnh (đọc bằng cursor theo từng chunk)
+GET_CITY_SUBSCRIBERS_QUERY = """
+    SELECT uc.user_id, uc.city_id, d.disease_name, u.describe_disease
+    FROM user_city uc
+    JOIN users u ON uc.user_id = u.user_id
+    JOIN disease d ON u.disease_id = d.disease_id
+    ORDER BY uc.city_id, uc.user_id;
+"""
@@ -1,33 +1,34 @@
 import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 import sys
 import os
-from datetime import datetime
 from zoneinfo import ZoneInfo
-from .scheduler_suggestion import push_job_passive_suggestion
-from .scheduler_push_job_collect_data import push_jobs_collect_data
+from .pipeline import run_nightly_pipeline, ensure_pipeline_schema
+from .leader import LeaderElector, leader_only
+from core.postgresql_client import init_db, close_db
+from core.redis_client import close_redis
+from core.forecast_generation import ensure_generation_schema
+from core.metrics import start_metrics_server, stop_metrics_server
 
 # Múi giờ Việt Nam
 VIETNAM_TIMEZONE = ZoneInfo("Asia/Ho_Chi_Minh")
 
-async def run_push_job_passive_suggestion():
-    """
-    Hàm wrapper để lấy ngày, tháng, năm hiện tại theo múi giờ Việt Nam
-    và truyền vào hàm lập lịch.
-    """
-    now = datetime.now(VIETNAM_TIMEZONE)
-    day_now = now.day
-    month_now = now.month
-    year_now = now.year
-    # Gọi hàm push_job_passive_suggestion với các tham số đã lấy được
-    await push_job_passive_suggestion(day_now, month_now, year_now)
-
 async def main():
+    await init_db("scheduler")
+    await ensure_generation_schema()
+    await ensure_pipeline_schema()
+    await start_metrics_server()
+    # có thể chạy nhiều replica: chỉ leader (giữ lease trong Redis) chạy job khi tới giờ
+    elector = LeaderElector("scheduler")
+    elector.start()
     scheduler = AsyncIOScheduler(timezone=VIETNAM_TIMEZONE)
-    scheduler.add_job(push_jobs_collect_data, "cron", hour=0, minute=1)
-    scheduler.add_job(run_push_job_passive_suggestion, "cron", hour=0, minute=30)
+    # crawl → passive suggestion chạy nối tiếp trong cùng pipeline (không còn cron 0h30 cố định)
+    nightly_trigger = CronTrigger(hour=0, minute=1, timezone=VIETNAM_TIMEZONE)
+    scheduler.add_job(leader_only(elector, "nightly_pipeline", nightly_trigger)(run_nightly_pipeline),
+                      nightly_trigger, max_instances=1, coalesce=True)
     scheduler.start()
-    print("[Scheduler] Push job scheduled for 0h01 (collect data) and 0h30 (suggestion) daily.")
+    print(f"[Scheduler] {elector.instance_id}: nightly pipeline scheduled for 0h01 daily (collect data → suggestion).")
 
     try:
         # Giữ scheduler chạy mãi.
@@ -40,6 +41,10 @@ async def main():
         print("[Scheduler] Stopped by user (Ctrl+C)")
     finally:
         scheduler.shutdown()
+        await elector.stop()
+        await stop_metrics_server()
+        await close_redis()
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
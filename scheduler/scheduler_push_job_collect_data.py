@@ -1,10 +1,12 @@
 import uuid
 from core.postgresql_client import get_db
-from core.redis_client import get_redis_data
+from core.redis_client import get_redis_data, bulk_lpush
+from core import codec
+from core.inflight import claim_cities
+from core.forecast_generation import create_staging_generation, set_pending_jobs
 from dotenv import load_dotenv
 import os
 import asyncio
-import json
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 
 QUEUE_DATA = os.getenv("QUEUE_DATA", "queue_data")
@@ -23,37 +25,34 @@ async def fetch_city_data():
         """)
         return rows
 
-async def clear_old_data(): # hàm xoá dữ liệu trước khi thực hiện push_job lặp lịch
-    """
-    Xoá toàn bộ dữ liệu trong các bảng weather, climate, uv
-    """
-    pool = await get_db()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute("TRUNCATE TABLE weather RESTART IDENTITY CASCADE;")
-            await conn.execute("TRUNCATE TABLE climate RESTART IDENTITY CASCADE;")
-            await conn.execute("TRUNCATE TABLE uv RESTART IDENTITY CASCADE;")
-            print("[Postgres] Cleared data from weather, climate, uv")
-
-
 async def push_jobs_collect_data():
     """
-    Clear old data, sau đó build job JSON và push vào QUEUE_DATA
+    Tạo generation staging mới, sau đó build job và push vào QUEUE_DATA.
+    Dữ liệu cũ vẫn được đọc bình thường tới khi job cuối cùng xong và generation mới được chuyển active.
     """
-    await clear_old_data()
+    generation = await create_staging_generation()
 
     redis_data = await get_redis_data()
     rows = await fetch_city_data()
 
-    for row in rows:
-        job_data = {
-            "job_id": str(uuid.uuid4()),
-            "city_id": row["city_id"],
-            "longitude": row["longitude"],
-            "latitude": row["latitude"]
-        }
-        await redis_data.lpush(QUEUE_DATA, json.dumps(job_data))
-        print(f"[PUSHED to {QUEUE_DATA}] {job_data}")
+    jobs = [{
+        "job_id": str(uuid.uuid4()),
+        "city_id": row["city_id"],
+        "longitude": row["longitude"],
+        "latitude": row["latitude"],
+        "generation": generation
+    } for row in rows]
+    # bỏ các city đã có job đang chờ/đang crawl (vd: do API vừa push; job đó tính lại generation lúc ghi
+    # nên cũng ghi vào generation staging này)
+    jobs = await claim_cities(redis_data, jobs, source="scheduler")
+    payloads = [codec.encode(job_data) for job_data in jobs]
+
+    # ghi số job cần chờ trước khi push để worker không chuyển generation quá sớm
+    await set_pending_jobs(redis_data, generation, len(payloads))
+    # đẩy toàn bộ job trong một pipeline thay vì mỗi job một round trip
+    pushed = await bulk_lpush(redis_data, QUEUE_DATA, payloads)
+    print(f"[PUSHED to {QUEUE_DATA}] {pushed} jobs (generation {generation})")
+    return generation, pushed
 
 # này chỉ để test cho scheduler
 if __name__ == "__main__":
@@ -1,11 +1,14 @@
 import uuid
 from core.postgresql_client import get_db
-from core.redis_client import get_redis_data
+from core.redis_client import get_redis_data, bulk_lpush
+from core import codec
+from core.metrics import Counter, Histogram
 from dotenv import load_dotenv
 import os
 import asyncio
-import json
-from .queries import GET_FULL_DATA_QUERY
+from core.city_data import city_data_key, store_city_data
+from passive_suggestion.fingerprint import city_fingerprint, job_fingerprint, get_stored_fingerprints, delete_fingerprints, suggestion_jobs_total
+from .queries import GET_CITY_FORECAST_QUERY, GET_CITY_SUBSCRIBERS_QUERY
 from datetime import datetime
 from zoneinfo import ZoneInfo
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
@@ -13,112 +16,192 @@ QUEUE_PASSIVE_SUGGESTION = os.getenv("QUEUE_PASSIVE_SUGGESTION", "queue_passive_
 # để test
 VIETNAM_TIMEZONE = ZoneInfo("Asia/Ho_Chi_Minh")
 
-async def get_data_for_json(day: int, month: int, year: int):
+SUGGESTION_CURSOR_CHUNK = int(os.getenv("SUGGESTION_CURSOR_CHUNK", 1000))
+
+suggestion_cohort_size = Histogram(
+    "suggestion_cohort_size", "Số user trong mỗi cohort passive suggestion (1 cohort = 1 lần gọi LLM)",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000))
+suggestion_llm_calls_saved_total = Counter(
+    "suggestion_llm_calls_saved_total", "Số lần gọi LLM tiết kiệm được nhờ gộp user vào cohort")
+
+# Define a custom order for periods
+PERIOD_ORDER = {
+    'Early Morning': 1,
+    'Morning': 2,
+    'Noon': 3,
+    'Afternoon': 4,
+    'Evening': 5
+}
+
+def _period_data(row) -> dict:
+    return {
+        "period": row['period'],
+        "report_time":{
+            "report_day": row['report_day'],
+            "report_month": row['report_month'],
+            "report_year": row['report_year'],
+        },
+        "weather_details": {
+            "temp": row['temp'],
+            "feels_like": row['feels_like'],
+            "humidity": row['humidity'],
+            "pop": row['pop'],
+            "wind_speed": row['wind_speed'],
+            "wind_gust": row['wind_gust'],
+            "visibility": row['visibility'],
+            "clouds_all": row['clouds_all'],
+            "weather_main": row['weather_main'],
+            "weather_description": row['weather_description']
+        },
+        "climate_details": {
+            "aqi": row['aqi'],
+            "co": row['co'],
+            "no": row['no'],
+            "no2": row['no2'],
+            "o3": row['o3'],
+            "so2": row['so2'],
+            "pm2_5": row['pm2_5'],
+            "pm10": row['pm10'],
+            "nh3": row['nh3']
+        },
+        "uvi_details": {
+            "uvi": row['uvi']
+        }
+    }
+
+async def store_city_forecasts(conn, redis_data, day: int, month: int, year: int) -> dict:
     """
-    Retrieves weather, climate, and UV data, and structures it into a JSON-like format,
-    grouped by user and city.
+    Đọc dự báo trong ngày của từng city (mỗi city 1 lần) bằng cursor và ghi thành blob trong Redis.
+    Trả về {city_id: (data_key, digest)} của các city có dữ liệu; digest là fingerprint dự báo đã làm tròn.
     """
-    pool = await get_db()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(GET_FULL_DATA_QUERY, day, month, year)
-    
-    grouped_data = {}
-    for row in rows:
-        user_id = row['user_id']
-        city_id = row['city_id']
-        key = (user_id, city_id)
-        
-        # Initialize the user-city entry if it doesn't exist
-        if key not in grouped_data:
-            grouped_data[key] = {
-                "user_id": user_id,
-                "city_id": city_id,
-                "disease_name": row['disease_name'],
-                "describe_disease": row['describe_disease'],
-                "daily_data": []
-            }
-        
-        # Append the weather, climate, and UV data for the specific period
-        grouped_data[key]["daily_data"].append({
-            "period": row['period'],
-            "report_time":{
-                "report_day": row['report_day'],
-                "report_month": row['report_month'],
-                "report_year": row['report_year'],
-            },
-            "weather_details": {
-                "temp": row['temp'],
-                "feels_like": row['feels_like'],
-                "humidity": row['humidity'],
-                "pop": row['pop'],
-                "wind_speed": row['wind_speed'],
-                "wind_gust": row['wind_gust'],
-                "visibility": row['visibility'],
-                "clouds_all": row['clouds_all'],
-                "weather_main": row['weather_main'],
-                "weather_description": row['weather_description']
-            },
-            "climate_details": {
-                "aqi": row['aqi'],
-                "co": row['co'],
-                "no": row['no'],
-                "no2": row['no2'],
-                "o3": row['o3'],
-                "so2": row['so2'],
-                "pm2_5": row['pm2_5'],
-                "pm10": row['pm10'],
-                "nh3": row['nh3']
-            },
-            "uvi_details": {
-                "uvi": row['uvi']
-            }
-        })
-    
-    # Define a custom order for periods
-    period_order = {
-        'Early Morning': 1,
-        'Morning': 2,
-        'Noon': 3,
-        'Afternoon': 4,
-        'Evening': 5
-    }
+    city_keys = {}
+    pending = {}
+    current_city, current_periods = None, []
+
+    def close_city():
+        if current_city is not None and current_periods:
+            current_periods.sort(key=lambda x: PERIOD_ORDER.get(x['period'], 99))
+            key = city_data_key(day, month, year, current_city)
+            pending[key] = current_periods
+            city_keys[current_city] = (key, city_fingerprint(current_periods))
 
-    # Convert the dictionary values to a list and sort the daily_data
-    # based on the custom period order
-    final_data_list = list(grouped_data.values())
-    for item in final_data_list:
-        item["daily_data"].sort(key=lambda x: period_order.get(x['period'], 99))
-    
-    return final_data_list
+    cursor = await conn.cursor(GET_CITY_FORECAST_QUERY, day, month, year)
+    while True:
+        rows = await cursor.fetch(SUGGESTION_CURSOR_CHUNK)
+        if not rows:
+            break
+        for row in rows:
+            # query đã ORDER BY city_id → city đổi thì city trước đã đủ period
+            if row['city_id'] != current_city:
+                close_city()
+                current_city, current_periods = row['city_id'], []
+            current_periods.append(_period_data(row))
+        if len(pending) >= SUGGESTION_CURSOR_CHUNK:
+            await store_city_data(redis_data, pending)
+            pending = {}
+    close_city()
+    await store_city_data(redis_data, pending)
+    return city_keys
 
-async def clear_old_data_in_suggestion_table(): # hàm xoá dữ liệu trước khi thực hiện push_job lặp lịch
+async def prune_orphan_suggestions(conn, redis_data):
     """
-    Xoá toàn bộ dữ liệu trong các bảng suggestion
+    Xoá gợi ý của các cặp user-city không còn trong user_city (thay cho TRUNCATE toàn bảng:
+    gợi ý của cặp có đầu vào không đổi được giữ lại). Fingerprint của cặp bị xoá cũng bị xoá,
+    để nếu user thêm lại city thì gợi ý được tạo mới.
     """
-    pool = await get_db()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute("TRUNCATE TABLE suggestion RESTART IDENTITY CASCADE;")
-            print("[Postgres] Cleared data from suggestion")
+    rows = await conn.fetch("""
+        DELETE FROM suggestion s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_city uc WHERE uc.user_id = s.user_id AND uc.city_id = s.city_id
+        )
+        RETURNING s.user_id, s.city_id
+    """)
+    await delete_fingerprints(redis_data, [(row['user_id'], row['city_id']) for row in rows])
+    print(f"[Postgres] Pruned {len(rows)} orphan suggestions")
+
+async def touch_unchanged_suggestions(conn, pairs: list, day: int, month: int, year: int):
+    """
+    Gợi ý của cặp bị skip vẫn đúng cho ngày mới → chỉ cập nhật ngày báo cáo.
+    """
+    if not pairs:
+        return
+    await conn.execute("""
+        UPDATE suggestion s
+        SET report_day = $1, report_month = $2, report_year = $3
+        FROM unnest($4::int[], $5::int[]) AS t(user_id, city_id)
+        WHERE s.user_id = t.user_id AND s.city_id = t.city_id
+    """, day, month, year, [u for u, _ in pairs], [c for _, c in pairs])
+
+def _cohort_job(cohort: dict) -> bytes:
+    suggestion_cohort_size.observe(len(cohort["user_ids"]))
+    suggestion_llm_calls_saved_total.inc(len(cohort["user_ids"]) - 1)
+    # Use a unique job ID for each job
+    return codec.encode({**cohort, "job_id": str(uuid.uuid4())})
 
 async def push_job_passive_suggestion(day: int, month: int, year: int):
     """
-    Pushes individual user-city data as separate jobs to Redis Queue.
+    Push job passive suggestion vào Redis Queue theo cohort: các user cùng city và cùng hồ sơ bệnh
+    (disease_name + describe_disease đã chuẩn hoá, tức cùng fingerprint) dùng chung 1 job → 1 lần gọi LLM,
+    worker ghi kết quả cho mọi thành viên.
+    Dự báo của city được ghi 1 lần thành blob dùng chung; job chỉ tham chiếu tới blob (data_key),
+    danh sách user được đọc bằng server-side cursor theo từng chunk; cohort được gom theo từng city
+    (query đã ORDER BY city_id) nên bộ nhớ chỉ tăng theo số user của 1 city.
+    Cặp có fingerprint đầu vào trùng với lần gợi ý thành công trước thì giữ gợi ý cũ, không vào cohort.
     """
-    await clear_old_data_in_suggestion_table()
     redis_data = await get_redis_data()
-    list_dic_data = await get_data_for_json(day, month, year)
-
-    # Push each user-city dictionary as a separate job
-    for user_city_data in list_dic_data:
-        # Use a unique job ID for each job
-        job_id = str(uuid.uuid4())
-        # Convert the dictionary to a JSON string for storage in Redis
-        job_data_json = json.dumps(user_city_data)
-        
-        await redis_data.lpush(QUEUE_PASSIVE_SUGGESTION, job_data_json)
-        
-        print(f"[Redis] Pushed job {job_id} for user {user_city_data['user_id']} to queue '{QUEUE_PASSIVE_SUGGESTION}'")
+    pool = await get_db()
+
+    pushed = skipped = jobs = 0
+    async with pool.acquire() as conn:
+        # cursor của asyncpg cần chạy trong transaction
+        async with conn.transaction():
+            await prune_orphan_suggestions(conn, redis_data)
+            city_keys = await store_city_forecasts(conn, redis_data, day, month, year)
+            print(f"[Redis] Stored forecast blobs for {len(city_keys)} cities")
+
+            cohorts = {}  # fingerprint → job của cohort, chỉ chứa cohort của city đang đọc
+            current_city = None
+            cursor = await conn.cursor(GET_CITY_SUBSCRIBERS_QUERY)
+            while True:
+                rows = await cursor.fetch(SUGGESTION_CURSOR_CHUNK)
+                if not rows:
+                    break
+                rows = [row for row in rows if row['city_id'] in city_keys]  # city chưa có dữ liệu dự báo cho ngày này
+                stored = await get_stored_fingerprints(redis_data, [(row['user_id'], row['city_id']) for row in rows])
+                payloads, unchanged = [], []
+                for row, previous in zip(rows, stored):
+                    if row['city_id'] != current_city:
+                        # city trước đã đọc hết user → cohort của nó đã đủ thành viên
+                        payloads.extend(_cohort_job(cohort) for cohort in cohorts.values())
+                        cohorts, current_city = {}, row['city_id']
+                    data_key, digest = city_keys[row['city_id']]
+                    fingerprint = job_fingerprint(digest, row['disease_name'], row['describe_disease'])
+                    if fingerprint == previous:
+                        unchanged.append((row['user_id'], row['city_id']))
+                        continue
+                    cohort = cohorts.get(fingerprint)
+                    if cohort is None:
+                        cohort = cohorts[fingerprint] = {
+                            "user_ids": [],
+                            "city_id": row['city_id'],
+                            "disease_name": row['disease_name'],
+                            "describe_disease": row['describe_disease'],
+                            "data_key": data_key,
+                            "fingerprint": fingerprint,
+                        }
+                    cohort["user_ids"].append(row['user_id'])
+                    pushed += 1
+                await touch_unchanged_suggestions(conn, unchanged, day, month, year)
+                skipped += len(unchanged)
+                # mỗi chunk được gửi trong một pipeline thay vì mỗi job một round trip
+                jobs += await bulk_lpush(redis_data, QUEUE_PASSIVE_SUGGESTION, payloads)
+            jobs += await bulk_lpush(redis_data, QUEUE_PASSIVE_SUGGESTION,
+                                     [_cohort_job(cohort) for cohort in cohorts.values()])
+
+    suggestion_jobs_total.inc(pushed, "pushed")
+    suggestion_jobs_total.inc(skipped, "skipped")
+    print(f"[Redis] Pushed {jobs} cohort jobs ({pushed} user-city pairs) to queue '{QUEUE_PASSIVE_SUGGESTION}', "
+          f"skipped {skipped} unchanged")
 
 # này chỉ để test cho scheduler
 if __name__ == "__main__":
@@ -50,53 +50,35 @@ function Dashboard() {
       try {
         setLoading(true);
         console.log('Dashboard fetchData BASE_URL:', import.meta.env.VITE_API_BASE_URL, 'cityId:', cityId);
-        const resVisual = await fetch(`${import.meta.env.VITE_API_BASE_URL}/get_data_to_visualize/${cityId}`, {
+        // Một request duy nhất: visualize + suggestion + profile (backend truy vấn song song)
+        const accessToken = sessionStorage.getItem('access_token');
+        const resDashboard = await fetch(`${import.meta.env.VITE_API_BASE_URL}/dashboard/${cityId}`, {
           headers: {
+            'Authorization': accessToken ? `Bearer ${accessToken}` : '',
             'ngrok-skip-browser-warning': 'true',
           },
         });
-        console.log('resVisual:', resVisual);
-        let dataVisual = null;
-        const contentType = resVisual.headers.get('content-type');
+        console.log('resDashboard:', resDashboard);
+        let dataDashboard = null;
+        const contentType = resDashboard.headers.get('content-type');
         if (contentType && contentType.includes('application/json')) {
           try {
-            dataVisual = await resVisual.json();
-            console.log('dataVisual:', dataVisual);
+            dataDashboard = await resDashboard.json();
+            console.log('dataDashboard:', dataDashboard);
           } catch (jsonErr) {
-            console.error('Lỗi parse JSON resVisual:', jsonErr);
+            console.error('Lỗi parse JSON resDashboard:', jsonErr);
           }
         } else {
-          const text = await resVisual.text();
-          console.error('Response text resVisual (not JSON):', text);
+          const text = await resDashboard.text();
+          console.error('Response text resDashboard (not JSON):', text);
         }
+        const dataVisual = dataDashboard?.visual;
         if (dataVisual && dataVisual.status === 'success') {
           setVisualData(dataVisual.data);
         } else {
           setError('Không lấy được dữ liệu visualize');
         }
-        // Gọi luôn API lấy suggestion
-        const accessToken = sessionStorage.getItem('access_token');
-        const resSuggest = await fetch(`${import.meta.env.VITE_API_BASE_URL}/get_passive_suggestion/${cityId}`, {
-          headers: {
-            'Authorization': accessToken ? `Bearer ${accessToken}` : '',
-            'ngrok-skip-browser-warning': 'true',
-          },
-        });
-        console.log('resSuggest:', resSuggest);
-        let dataSuggest = null;
-        try {
-          dataSuggest = await resSuggest.json();
-          console.log('dataSuggest:', dataSuggest);
-        } catch (jsonErr) {
-          console.error('Lỗi parse JSON resSuggest:', jsonErr);
-          const text = await resSuggest.text();
-          console.error('Response text resSuggest:', text);
-        }
-        if (dataSuggest && dataSuggest.status === 'success') {
-          setSuggestion(dataSuggest.suggestion);
-        } else {
-          setSuggestion("");
-        }
+        setSuggestion(dataDashboard?.suggestion ?? "");
       } catch (err) {
         console.error('API error:', err);
         setError('Lỗi khi gọi API');
@@ -232,6 +214,102 @@ function Dashboard() {
     }
   }, [chatHistory, showSuggestion, showDetail]);
 
+  // Đọc một endpoint Server-Sent Events (dùng fetch để gửi được header ngrok).
+  // onEvent trả về khác undefined thì dừng stream và trả về giá trị đó; stream lỗi → undefined
+  const readSSE = async <T,>(path: string, accessToken: string, onEvent: (event: string, data: any) => T | undefined): Promise<T | undefined> => {
+    try {
+      const res = await fetch(`${import.meta.env.VITE_API_BASE_URL}${path}`, {
+        headers: {
+          'Accept': 'text/event-stream',
+          'Authorization': `Bearer ${accessToken}`,
+          'ngrok-skip-browser-warning': 'true',
+        }
+      });
+      if (!res.ok || !res.body) return undefined;
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+          let eventName = 'message';
+          let eventData = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event:')) eventName = line.slice(6).trim();
+            else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+          }
+          if (!eventData) continue;
+          const outcome = onEvent(eventName, JSON.parse(eventData));
+          if (outcome !== undefined) {
+            reader.cancel();
+            return outcome;
+          }
+        }
+      }
+      return undefined;
+    } catch (streamErr) {
+      console.error(`Lỗi SSE ${path}:`, streamErr);
+      return undefined;
+    }
+  };
+
+  // Chờ kết quả hoàn chỉnh của chatbot (không có token từng phần)
+  const streamChatbotResult = (requestId: string, accessToken: string) =>
+    readSSE<string | null>(`/stream_chatbot_result/${requestId}`, accessToken, (event, data) => {
+      if (event === 'result') return data.data;
+      if (event === 'timeout') return null;
+      return undefined;
+    });
+
+  // Nhận từng phần câu trả lời (token) để hiển thị dần, trả về câu trả lời cuối cùng
+  const streamChatbotTokens = (requestId: string, accessToken: string, onPartial: (text: string) => void) => {
+    let partial = '';
+    return readSSE<string | null>(`/stream_chatbot_tokens/${requestId}`, accessToken, (event, data) => {
+      if (event === 'token') {
+        partial += data.data;
+        onPartial(partial);
+      } else if (event === 'reset') {
+        partial = '';
+        onPartial(partial);
+      } else if (event === 'done') {
+        return data.data;
+      } else if (event === 'error' || event === 'timeout') {
+        return null;
+      }
+      return undefined;
+    });
+  };
+
+  // Polling dự phòng khi không dùng được SSE
+  const pollChatbotResult = async (requestId: string, accessToken: string): Promise<string | null> => {
+    let tries = 0;
+    while (tries < 30) {
+      await new Promise(r => setTimeout(r, 1000));
+      const res2 = await fetch(`${import.meta.env.VITE_API_BASE_URL}/get_chatbot_result/${requestId}`, {
+        headers: {
+          'Authorization': `Bearer ${accessToken}`,
+          'ngrok-skip-browser-warning': 'true',
+        }
+      });
+      let data2 = null;
+      try {
+        data2 = await res2.json();
+      } catch (jsonErr2) {
+        console.error(`Lỗi parse JSON polling lần ${tries + 1}:`, jsonErr2);
+      }
+      if (res2.status === 200 && data2 && data2.status === 'completed' && data2.data) {
+        return data2.data;
+      }
+      tries++;
+    }
+    return null;
+  };
+
   // Gửi tin nhắn chatbot
   const handleSendChat = async () => {
     if (!chatInput.trim() || chatLoading) return;
@@ -270,37 +348,34 @@ function Dashboard() {
         console.error('Response text submit_chatbot_query:', text);
       }
       if (res.ok && data && data.request_id) {
-        let result = null;
-        let tries = 0;
-        while (!result && tries < 30) {
-          await new Promise(r => setTimeout(r, 1000));
-          const res2 = await fetch(`${import.meta.env.VITE_API_BASE_URL}/get_chatbot_result/${data.request_id}`, {
-            headers: {
-              'Authorization': `Bearer ${accessToken}`,
-              'ngrok-skip-browser-warning': 'true',
-            }
-          });
-          console.log(`Polling lần ${tries + 1}:`, res2);
-          let data2 = null;
-          try {
-            data2 = await res2.json();
-            console.log(`Data polling lần ${tries + 1}:`, data2);
-          } catch (jsonErr2) {
-            console.error(`Lỗi parse JSON polling lần ${tries + 1}:`, jsonErr2);
-            const text2 = await res2.text();
-            console.error(`Response text polling lần ${tries + 1}:`, text2);
+        // Hiển thị dần câu trả lời qua stream token; lỗi thì chờ kết quả qua SSE, cuối cùng mới polling
+        let streamStarted = false;
+        const showPartial = (text: string) => {
+          if (!streamStarted) {
+            streamStarted = true;
+            setChatHistory(prev => [...prev, { role: 'bot', message: text }]);
+          } else {
+            setChatHistory(prev => [...prev.slice(0, -1), { role: 'bot', message: text }]);
           }
-          if (res2.status === 200 && data2 && data2.status === 'completed' && data2.data) {
-            result = data2.data;
-            break;
-          }
-          tries++;
+        };
+        let result = await streamChatbotTokens(data.request_id, accessToken, showPartial);
+        if (result === undefined) {
+          result = await streamChatbotResult(data.request_id, accessToken);
+        }
+        if (result === undefined) {
+          result = await pollChatbotResult(data.request_id, accessToken);
         }
-        if (result) {
-          setChatHistory(prev => [...prev, { role: 'bot', message: result }]);
+        const finalMessage = result || 'Chatbot không phản hồi. Vui lòng thử lại sau.';
+        if (streamStarted) {
+          setChatHistory(prev => [...prev.slice(0, -1), { role: 'bot', message: finalMessage }]);
         } else {
-          setChatHistory(prev => [...prev, { role: 'bot', message: 'Chatbot không phản hồi. Vui lòng thử lại sau.' }]);
+          setChatHistory(prev => [...prev, { role: 'bot', message: finalMessage }]);
         }
+      } else if (res.status === 429 || res.status === 503) {
+        // Server đang quá tải: báo cho user thời gian nên thử lại (Retry-After, giây)
+        const retryAfter = res.headers.get('Retry-After');
+        const wait = retryAfter ? ` sau khoảng ${retryAfter} giây` : ' sau';
+        setChatHistory(prev => [...prev, { role: 'bot', message: `Chatbot đang quá tải, vui lòng thử lại${wait}.` }]);
       } else {
         setChatHistory(prev => [...prev, { role: 'bot', message: 'Không gửi được yêu cầu đến chatbot.' }]);
       }
@@ -0,0 +1,96 @@
+import os
+import asyncio
+import importlib.util
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Mỗi upstream (scheme + host) dùng chung 1 httpx.AsyncClient cho cả process:
+# connection được giữ keep-alive giữa các job/lần retry nên không phải bắt tay TCP+TLS lại mỗi request.
+# HTTP/2 chỉ bật khi có package h2 (httpx[http2]) và server hỗ trợ (ALPN), nếu không tự dùng HTTP/1.1.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 20))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", 10))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+# Số request đồng thời tối đa tới mỗi upstream (trên 1 process), dạng "host=n,host=n".
+# Cần thiết cả khi dùng HTTP/2 vì nhiều stream chạy chung 1 connection nên max_connections không chặn được.
+HTTP_UPSTREAM_CONCURRENCY = os.getenv("HTTP_UPSTREAM_CONCURRENCY", "api.openweathermap.org=10,currentuvindex.com=5")
+HTTP_DEFAULT_UPSTREAM_CONCURRENCY = int(os.getenv("HTTP_DEFAULT_UPSTREAM_CONCURRENCY", 10))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+# upstream của worker thu thập dữ liệu, client được tạo sẵn lúc worker khởi động
+UPSTREAMS = (
+    "https://api.openweathermap.org",
+    "https://currentuvindex.com",
+)
+
+_clients = {}
+_semaphores = {}
+_upstream_limits = {
+    host.strip(): int(limit)
+    for host, _, limit in (item.partition("=") for item in HTTP_UPSTREAM_CONCURRENCY.split(",") if "=" in item)
+}
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT, read=HTTP_READ_TIMEOUT,
+            write=HTTP_READ_TIMEOUT, pool=HTTP_POOL_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def init_http_clients(origins=UPSTREAMS):
+    for origin in origins:
+        get_http_client(origin)
+    print(f"[HTTP] Shared clients for {len(_clients)} upstreams (http2={HTTP2_ENABLED})")
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """
+    Client dùng chung theo origin của url (tạo mới nếu chưa có hoặc đã bị đóng).
+    """
+    origin = _origin(url)
+    client = _clients.get(origin)
+    if client is None or client.is_closed:
+        client = _clients[origin] = _new_client()
+    return client
+
+
+def _upstream_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).hostname
+    semaphore = _semaphores.get(host)
+    if semaphore is None:
+        semaphore = _semaphores[host] = asyncio.Semaphore(
+            _upstream_limits.get(host, HTTP_DEFAULT_UPSTREAM_CONCURRENCY))
+    return semaphore
+
+
+async def http_get(url: str, params: dict) -> httpx.Response:
+    """
+    GET qua client dùng chung, giới hạn số request đồng thời tới upstream.
+    """
+    async with _upstream_semaphore(url):
+        return await get_http_client(url).get(url, params=params)
+
+
+async def close_http_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,122 @@
+import os
+import random
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+from core.redis_client import get_redis_data
+from core.metrics import Counter, Gauge
+
+load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
+
+# Rate limit dùng chung cho mọi worker process: mỗi API key OpenWeather có 1 token bucket trong Redis
+# (hash ratelimit:openweather:{key_id}) với 2 cửa sổ: theo phút và theo ngày, nạp lại liên tục theo thời gian.
+# Lấy token bằng 1 script Lua (atomic, đồng hồ lấy từ Redis TIME nên không lệch giữa các máy):
+# duyệt các key, key nào còn token ở cả 2 cửa sổ thì trừ 1 token và dùng; hết thì trả về thời gian
+# chờ ngắn nhất tới khi có token → worker ngủ đúng khoảng đó thay vì gọi API rồi nhận 429.
+OPENWEATHER_API_KEYS = [k.strip() for k in os.getenv("OPEN_WEATHER_API", "").split(",") if k.strip()]
+OPENWEATHER_CALLS_PER_MINUTE = float(os.getenv("OPENWEATHER_CALLS_PER_MINUTE", 60))
+OPENWEATHER_CALLS_PER_DAY = float(os.getenv("OPENWEATHER_CALLS_PER_DAY", 30000))
+OPENWEATHER_BLOCK_SECONDS = float(os.getenv("OPENWEATHER_BLOCK_SECONDS", 60))  # khi vẫn bị 429
+OPENWEATHER_MAX_WAIT_SLICE = float(os.getenv("OPENWEATHER_MAX_WAIT_SLICE", 30))  # ngủ tối đa mỗi lần chờ
+RATE_LIMIT_KEY_PREFIX = "ratelimit:openweather:"
+RATE_LIMIT_TTL_MS = 2 * 86400 * 1000
+
+_ACQUIRE_SCRIPT = """
+-- Redis < 5: cho phép ghi sau lệnh không tất định (TIME)
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local minute_cap = tonumber(ARGV[1])
+local day_cap = tonumber(ARGV[2])
+local start = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local n = #KEYS
+local best_wait = -1
+for i = 0, n - 1 do
+    local idx = ((start + i) % n) + 1
+    local s = redis.call('HMGET', KEYS[idx], 'm', 'd', 'ts', 'blocked')
+    local m = tonumber(s[1]) or minute_cap
+    local d = tonumber(s[2]) or day_cap
+    local elapsed = math.max(0, now - (tonumber(s[3]) or now))
+    m = math.min(minute_cap, m + elapsed * minute_cap / 60000)
+    d = math.min(day_cap, d + elapsed * day_cap / 86400000)
+    local wait = math.max(0, (tonumber(s[4]) or 0) - now)
+    if m < 1 then wait = math.max(wait, math.ceil((1 - m) * 60000 / minute_cap)) end
+    if d < 1 then wait = math.max(wait, math.ceil((1 - d) * 86400000 / day_cap)) end
+    if wait == 0 then
+        m = m - 1
+        d = d - 1
+        redis.call('HSET', KEYS[idx], 'm', tostring(m), 'd', tostring(d), 'ts', now)
+        redis.call('PEXPIRE', KEYS[idx], ttl)
+        return {idx, 0, math.floor(m), math.floor(d)}
+    end
+    if best_wait < 0 or wait < best_wait then best_wait = wait end
+end
+return {0, best_wait, 0, 0}
+"""
+
+_BLOCK_SCRIPT = """
+-- Redis < 5: cho phép ghi sau lệnh không tất định (TIME)
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('HSET', KEYS[1], 'blocked', now + tonumber(ARGV[1]))
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+openweather_key_tokens_remaining = Gauge(
+    "openweather_key_tokens_remaining", "Số token còn lại của API key theo cửa sổ (lần lấy gần nhất)",
+    ("key", "window"))
+openweather_key_wait_seconds_total = Counter(
+    "openweather_key_wait_seconds_total", "Tổng thời gian worker chờ token của key pool")
+openweather_key_rate_limited_total = Counter(
+    "openweather_key_rate_limited_total", "Số lần API key vẫn nhận 429 từ OpenWeather", ("key",))
+
+_start = random.randrange(1 << 16)  # mỗi process bắt đầu duyệt từ key khác nhau
+
+
+def key_id(api_key: str) -> str:
+    # không đưa API key thật vào Redis key hay label metrics
+    return hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _bucket_key(api_key: str) -> str:
+    return f"{RATE_LIMIT_KEY_PREFIX}{key_id(api_key)}"
+
+
+async def acquire_key() -> str:
+    """
+    Lấy 1 API key còn quota (trừ 1 token). Nếu mọi key đều hết thì chờ tới khi key sớm nhất có token.
+    """
+    global _start
+    if not OPENWEATHER_API_KEYS:
+        raise ValueError("Không tìm thấy OPEN_WEATHER_API key nào trong file .env.")
+    bucket_keys = [_bucket_key(k) for k in OPENWEATHER_API_KEYS]
+    while True:
+        redis_conn = await get_redis_data()
+        _start += 1
+        index, wait_ms, minute_left, day_left = await redis_conn.eval(
+            _ACQUIRE_SCRIPT, len(bucket_keys), *bucket_keys,
+            OPENWEATHER_CALLS_PER_MINUTE, OPENWEATHER_CALLS_PER_DAY, _start, RATE_LIMIT_TTL_MS)
+        if index:
+            api_key = OPENWEATHER_API_KEYS[index - 1]
+            openweather_key_tokens_remaining.set(minute_left, key_id(api_key), "minute")
+            openweather_key_tokens_remaining.set(day_left, key_id(api_key), "day")
+            return api_key
+        # thêm jitter để các process không cùng thức dậy tranh 1 token
+        sleep_time = min(wait_ms / 1000, OPENWEATHER_MAX_WAIT_SLICE) + random.uniform(0, 0.05)
+        print(f"[KeyPool] Tất cả key hết quota → chờ {sleep_time:.2f}s")
+        openweather_key_wait_seconds_total.inc(sleep_time)
+        await asyncio.sleep(sleep_time)
+
+
+async def block_key(api_key: str):
+    """
+    Key vẫn bị 429 (quota thực tế thấp hơn cấu hình): chặn key với mọi process trong OPENWEATHER_BLOCK_SECONDS.
+    """
+    redis_conn = await get_redis_data()
+    await redis_conn.eval(_BLOCK_SCRIPT, 1, _bucket_key(api_key),
+                          int(OPENWEATHER_BLOCK_SECONDS * 1000), RATE_LIMIT_TTL_MS)
+    openweather_key_rate_limited_total.inc(1, key_id(api_key))
+    print(f"[KeyPool] Key {key_id(api_key)} bị rate-limit → block {OPENWEATHER_BLOCK_SECONDS}s")
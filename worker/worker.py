@@ -1,13 +1,23 @@
 import os
 import pandas as pd
-from core.redis_client import get_redis_data
+from core.redis_client import get_redis_data_bytes_conn, close_redis
+from core import codec
+from core.inflight import confirm_city, release_city
 from dotenv import load_dotenv
 from .weather import aggregate_weather_by_period # dấu chấm thể hiện module cùng cấp
 from .climate import process_air_pollution_by_period
 from .uv import aggregate_uv_by_period
-from core.postgresql_client import get_db
+from .http_client import init_http_clients, http_get, close_http_clients
+from .key_pool import acquire_key, block_key
+from core.postgresql_client import get_db, init_db, close_db
+from core.cache import invalidate_tags, bump_city_generation
+from core.metrics import Gauge, start_metrics_server, stop_metrics_server
+from core.forecast_generation import (
+    FORECAST_COLUMNS, get_write_generations, finish_generation_job, ensure_generation_schema
+)
 import asyncio
-import json, traceback
+import signal
+import traceback
 import httpx
 import redis.asyncio as redis
 from redis.exceptions import ResponseError, ConnectionError, TimeoutError
@@ -15,77 +25,62 @@ import time
 
 load_dotenv('/Users/macbook/Desktop/BangA_DSC2025/.env')
 QUEUE_DATA = os.getenv("QUEUE_DATA", "queue_data")
-API_KEYS = os.getenv("OPEN_WEATHER_API", "").split(",") # POOL API KEY OPEN_WEATHER
 BASE_BACKOFF = float(os.getenv("BASE_BACKOFF", 0.5))  # seconds
 MAX_RETRY = int(os.getenv("MAX_RETRY", 5))
+CITY_FETCH_ATTEMPTS = int(os.getenv("CITY_FETCH_ATTEMPTS", 2))  # số lần thử lại cả city khi 1 nguồn lỗi
 
-# track API key status
-api_key_pool = [{"key": k.strip(), "blocked_until": 0} for k in API_KEYS] # thêm pool apikey vào
-current_index = 0
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 8))  # số job chạy đồng thời trong 1 process
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", 60))  # giây chờ job đang chạy khi tắt worker
 
-async def get_next_key():
-    """
-    Lấy key tiếp theo chưa bị block. Nếu tất cả blocked, sleep thời gian nhỏ nhất.
-    """
-    global current_index
-    n = len(api_key_pool)
-    start_index = current_index
-    while True:
-        key_info = api_key_pool[current_index]
-        current_index = (current_index + 1) % n
-        if key_info["blocked_until"] <= asyncio.get_event_loop().time():
-            return key_info, None
-
-        if current_index == start_index:
-            # tất cả key đang block
-            sleep_time = min(k["blocked_until"] - asyncio.get_event_loop().time() for k in api_key_pool)
-            sleep_time = max(sleep_time, 0.1)
-            print(f"[Worker] All keys blocked. Sleeping {sleep_time:.2f}s")
-            return None, sleep_time
-
-# hàm này chỉ dùng cho uv_index
+URL_WEATHER = "https://api.openweathermap.org/data/2.5/forecast"
+URL_CLIMATE = "https://api.openweathermap.org/data/2.5/air_pollution/forecast"  # https để dùng chung connection với weather
+URL_UV = "https://currentuvindex.com/api/v1/uvi"
+
+_running_jobs = set()  # task của các job đang chạy trong process
+Gauge("worker_inflight_jobs", "Số job thu thập dữ liệu đang chạy trong process", callback=lambda: len(_running_jobs))
+
+# hàm này chỉ dùng cho uv_index (không cần API key), retry/backoff giống fetch_api
 async def fetch_api_uv(url, params): 
-    """Gọi API Air Pollution Forecast và trả về JSON"""
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, params=params)
+    """Gọi API UV index và trả về JSON"""
+    retry = 0
+    while retry < MAX_RETRY:
+        try:
+            response = await http_get(url, params)
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print("Lỗi API:", response.status_code, response.text)
-            return None
-    except httpx.RequestError as e:
-        print(f"Lỗi kết nối API: {e}")
-        return None
+            if response.status_code == 200:
+                return response.json()
+            elif response.status_code == 429 or response.status_code >= 500:
+                print(f"[Worker] API UV lỗi {response.status_code} → thử lại")
+            else:
+                # lỗi phía request (4xx) thì thử lại cũng không khác
+                print("Lỗi API:", response.status_code, response.text)
+                return None
+        except httpx.RequestError as e:
+            print(f"Lỗi kết nối API: {e}")
+        retry += 1
+        await asyncio.sleep(BASE_BACKOFF * retry)  # backoff tăng dần
+
+    print("[Worker] Gọi API UV thất bại sau nhiều lần thử.")
+    return None
 
 # ta sẽ xử lý xoay api ở đây
 async def fetch_api(url, params):
     """
-    Gọi API với xoay API key từ pool. 
-    Nếu gặp 429 thì block key đó một thời gian rồi thử key khác.
+    Gọi API với key lấy từ token bucket dùng chung (worker/key_pool.py): chờ tới khi có key còn quota.
+    Nếu vẫn gặp 429 thì block key đó với mọi worker rồi thử key khác.
     """
-    global api_key_pool
     retry = 0
     while retry < MAX_RETRY:
-        key_info, sleep_time = await get_next_key()
-        if key_info is None:
-            await asyncio.sleep(sleep_time)  # tất cả key block → chờ rồi thử lại
-            continue
-
-        params["appid"] = key_info["key"]
+        api_key = await acquire_key()
+        params["appid"] = api_key
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
+            response = await http_get(url, params)
 
             if response.status_code == 200:
                 return response.json()
 
             elif response.status_code == 429:
-                # rate-limit → block key trong 60s
-                block_time = 60
-                key_info["blocked_until"] = asyncio.get_event_loop().time() + block_time
-                print(f"[Worker] Key {key_info['key']} bị rate-limit → block {block_time}s")
+                await block_key(api_key)
                 retry += 1
                 await asyncio.sleep(BASE_BACKOFF * retry)  # backoff tăng dần
                 continue
@@ -104,119 +99,108 @@ async def fetch_api(url, params):
     return None
 
 
-async def insert_weather(data_weather: pd.DataFrame):
-    # rename cho khớp schema table in database
-    data_weather = data_weather.rename(columns={
-        "year": "report_year",
-        "month": "report_month",
-        "day": "report_day"
-    })
-
-    # reorder đúng thứ tự cột trong DB
-    data_weather = data_weather[
-        [
-            "city_id",
-            "report_year",
-            "report_month",
-            "report_day",
-            "period",
-            "temp",
-            "feels_like",
-            "humidity",
-            "pop",
-            "rain_3h",
-            "wind_speed",
-            "wind_gust",
-            "visibility",
-            "clouds_all",
-            "weather_main",
-            "weather_description",
-            "weather_icon",
-        ]
-    ]
-
-    pool = await get_db()
-    async with pool.acquire() as conn:
-        records = list(data_weather.itertuples(index=False, name=None))
-        await conn.copy_records_to_table(
-            table_name="weather",
-            records=records,
-            columns=list(data_weather.columns)  # lấy trực tiếp từ DF cho chắc
-        )
-
-    print(f"[Worker] Đã insert {len(records)} rows weather cho city_id {data_weather['city_id'].iloc[0]}")
-
-# hàm thêm dữ liệu vào bảng climate
-async def insert_climate(data_climate: pd.DataFrame):
-    # rename cho khớp schema table in database
-    data_climate = data_climate.rename(columns={
-        "year": "report_year",
-        "month": "report_month",
-        "day": "report_day"
-    })
-
-    # reorder đúng thứ tự cột trong DB
-    data_climate = data_climate[
-        [
-            "city_id",
-            "report_year",
-            "report_month",
-            "report_day",
-            "period",
-            "aqi",
-            "co",
-            "no",
-            "no2",
-            "o3",
-            "so2",
-            "pm2_5",
-            "pm10",
-            "nh3"
-        ]
-    ]
-
-    pool = await get_db()
-    async with pool.acquire() as conn:
-        records = list(data_climate.itertuples(index=False, name=None))
-        await conn.copy_records_to_table(
-            table_name="climate",
-            records=records,
-            columns=list(data_climate.columns)  # lấy trực tiếp từ DF cho chắc
-        )
-
-    print(f"[Worker] Đã insert {len(records)} rows climate cho city_id {data_climate['city_id'].iloc[0]}")
-
-# hàm insert vào bảng UV
-async def insert_uv(data_uv: pd.DataFrame):
+async def copy_forecast_rows(conn, table: str, data: pd.DataFrame, generations: list):
+    """
+    Ghi DataFrame vào bảng dự báo cho từng generation (cột generation ở cuối mỗi record).
+    """
     # rename cho khớp schema table in database
-    data_uv = data_uv.rename(columns={
+    data = data.rename(columns={
         "year": "report_year",
         "month": "report_month",
         "day": "report_day"
     })
-
     # reorder đúng thứ tự cột trong DB
-    data_uv = data_uv[
-        [
-            "city_id",
-            "report_year",
-            "report_month",
-            "report_day",
-            "period",
-            "uvi"
-        ]
-    ]
-
+    columns = FORECAST_COLUMNS[table]
+    data = data[columns]
+    base_records = list(data.itertuples(index=False, name=None))
+    records = [record + (generation,) for generation in generations for record in base_records]
+    await conn.copy_records_to_table(
+        table_name=table,
+        records=records,
+        columns=columns + ["generation"]
+    )
+    return len(base_records)
+
+async def insert_city_forecast(city_id: int, frames: dict, generations: list, nightly: bool):
+    """
+    Ghi weather, climate, uv của city trong 1 transaction trên 1 connection:
+    hoặc đủ cả 3 bảng, hoặc không bảng nào (join ở phía đọc không bị thiếu period).
+    Generation được khoá FOR SHARE rồi kiểm tra lại: nếu trong lúc crawl generation đã bị chuyển
+    (pipeline hết hạn → activate_generation chép dữ liệu cũ của city sang) hoặc bị bỏ, thì không ghi vào nữa
+    để city không có 2 bộ dữ liệu trong cùng generation.
+    """
     pool = await get_db()
     async with pool.acquire() as conn:
-        records = list(data_uv.itertuples(index=False, name=None))
-        await conn.copy_records_to_table(
-            table_name="uv",
-            records=records,
-            columns=list(data_uv.columns)  # lấy trực tiếp từ DF cho chắc
-        )
+        async with conn.transaction():
+            # FOR SHARE chờ activate_generation (FOR UPDATE) commit xong → thấy được dữ liệu đã chép sang
+            if nightly:
+                # job ban đêm chỉ ghi vào generation staging của nó
+                rows = await conn.fetch("""
+                    SELECT generation, status FROM forecast_generation
+                    WHERE generation = ANY($1::bigint[])
+                    ORDER BY generation
+                    FOR SHARE
+                """, generations)
+                writable = [row["generation"] for row in rows if row["status"] == "staging"]
+            else:
+                # job city mới: tính lại generation cần ghi lúc này (không dùng danh sách lấy trước khi crawl),
+                # vì trong lúc crawl có thể đã có generation staging mới hoặc generation đã được chuyển
+                writable = await get_write_generations(conn, for_share=True)
+            existing = await conn.fetch(
+                "SELECT DISTINCT generation FROM weather WHERE city_id = $1 AND generation = ANY($2::bigint[])",
+                city_id, writable
+            )
+            writable = [g for g in writable if g not in {row["generation"] for row in existing}]
+            if not writable:
+                print(f"[Worker] Generation {generations} của city_id {city_id} đã được chuyển/bỏ → không ghi")
+                return
+            counts = {table: await copy_forecast_rows(conn, table, data, writable) for table, data in frames.items()}
+            generations = writable
+    print(f"[Worker] Đã insert {counts} rows cho city_id {city_id} (generation {generations})")
+    await invalidate_tags(f"city:{city_id}:forecast")
+    await bump_city_generation(city_id)
+
+async def fetch_city_forecast(city_id: int, latitude, longitude) -> dict | None:
+    """
+    Gọi đồng thời 3 API của city và chuẩn hoá thành DataFrame theo period.
+    Trả về None nếu một trong 3 nguồn lỗi hoặc rỗng (cả city được thử lại/bỏ qua như một đơn vị).
+    """
+    params_weather = { # không cần khai báo thêm key vì hàm fetch_api sẽ chịu trách nhiệm thêm và xoay api
+        "id": city_id,
+        "units": "metric",  # nhiệt độ Celsius
+        "lang": "vi"        # ngôn ngữ tiếng Việt
+    }
+    params_climate = {
+        "lat": latitude,
+        "lon": longitude,
+    }
+    params_uv = {
+        "latitude": latitude,
+        "longitude": longitude
+    }
+    response_weather, response_climate, response_uv = await asyncio.gather(
+        fetch_api(URL_WEATHER, params_weather),
+        fetch_api(URL_CLIMATE, params_climate),
+        fetch_api_uv(URL_UV, params_uv),
+    )
+    responses = {"weather": response_weather, "climate": response_climate, "uv": response_uv}
+    failed = [name for name, response in responses.items() if response is None]
+    if failed:
+        print(f"[Worker] Không lấy được dữ liệu {failed} cho city_id {city_id}")
+        return None
 
-    print(f"[Worker] Đã insert {len(records)} rows uv index cho city_id {data_uv['city_id'].iloc[0]}")
+    frames = {
+        "weather": aggregate_weather_by_period(response_weather),
+        "climate": process_air_pollution_by_period(response_climate),
+        "uv": aggregate_uv_by_period(response_uv),
+    }
+    empty = [name for name, data in frames.items() if data.empty]
+    if empty:
+        print(f"[Worker] Dữ liệu {empty} cho city_id {city_id} bị rỗng")
+        return None
+    frames["climate"]["city_id"] = city_id
+    frames["uv"]["city_id"] = city_id
+    return frames
 
 
 async def process_job(job_data):
@@ -230,75 +214,91 @@ async def process_job(job_data):
 
     pool = await get_db()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT 1 FROM weather WHERE city_id = $1 LIMIT 1", city_id
+        # job của lần refresh ban đêm ghi vào generation staging của nó;
+        # job city mới (từ API) ghi vào generation active và staging (nếu có)
+        generations = [job_data["generation"]] if job_data.get("generation") is not None \
+            else await get_write_generations(conn)
+        existing = await conn.fetch(
+            "SELECT DISTINCT generation FROM weather WHERE city_id = $1 AND generation = ANY($2::bigint[])",
+            city_id, generations
         )
-    if row:
+    generations = [g for g in generations if g not in {row["generation"] for row in existing}]
+    if not generations:
         print(f"[Worker] city_id {city_id} đã tồn tại trong bảng weather → skip")
         return  # không crawl nữa
-    # crawl weather
-    print(f"crawling weather data.....")    
-    url_weather = "https://api.openweathermap.org/data/2.5/forecast"
-    params_weather = { # không cần khai báo thêm key vì hàm fetch_api sẽ chịu trách nhiệm thêm và xoay api
-        "id": city_id,
-        "units": "metric",  # nhiệt độ Celsius
-        "lang": "vi"        # ngôn ngữ tiếng Việt
-    }
-    response_weather = await fetch_api(url_weather, params_weather)
-    if response_weather is None:
-        print(f"[Worker] Không lấy được dữ liệu weather cho city_id {city_id}")
-        return
-    data_weather = aggregate_weather_by_period(response_weather)
-    if data_weather.empty:
-        print(f"[Worker] Weather data cho city_id {city_id} bị rỗng → skip insert")
-    else:
-        await insert_weather(data_weather)  # chỉ insert khi có dữ liệu
 
-    # crawl climate
-    print(f"crawling climate data.....")
-    url_climate = "http://api.openweathermap.org/data/2.5/air_pollution/forecast"
-    params_climate = { # không cần khai báo thêm key vì hàm fetch_api sẽ chịu trách nhiệm thêm và xoay api
-        "lat": latitude,
-        "lon": longitude,
-    }
-    response_climate = await fetch_api(url_climate,params_climate)
-    if response_climate is None:
-        print(f"[Worker] Không lấy được dữ liệu climate cho city_id {city_id}")
-        return
-    data_climate = process_air_pollution_by_period(response_climate)
-    if data_climate.empty:
-        print(f"[Worker] Climate data cho city_id {city_id} bị rỗng → skip insert")
+    # crawl weather, climate, uv đồng thời; lỗi ở bất kỳ nguồn nào thì thử lại cả city
+    for attempt in range(1, CITY_FETCH_ATTEMPTS + 1):
+        print(f"crawling weather/climate/uv data (lần {attempt}).....")
+        frames = await fetch_city_forecast(city_id, latitude, longitude)
+        if frames is not None:
+            break
+        if attempt < CITY_FETCH_ATTEMPTS:
+            await asyncio.sleep(BASE_BACKOFF * attempt)
     else:
-        data_climate["city_id"] = city_id
-        await insert_climate(data_climate)
-
-    # crawl uv index
-    print(f"crawling uv index data.....")
-    url_uv = "https://currentuvindex.com/api/v1/uvi"
-    params_uv = {
-        "latitude": latitude,
-        "longitude": longitude
-    }
-    response_uv = await fetch_api_uv(url_uv,params_uv)
-    if response_uv is None:
-        print(f"[Worker] Không lấy được dữ liệu uv_index cho city_id {city_id}")
+        print(f"[Worker] Bỏ qua city_id {city_id}: không đủ dữ liệu sau {CITY_FETCH_ATTEMPTS} lần thử")
         return
-    data_uv = aggregate_uv_by_period(response_uv)
+    await insert_city_forecast(city_id, frames, generations, nightly=job_data.get("generation") is not None)
+
+
+async def run_job(job_str: bytes):
+    """
+    Chạy 1 job đã BRPOP: claim city → process_job → nhả city → cập nhật generation.
+    Job bị huỷ khi worker tắt (quá thời gian drain) được đẩy lại vào queue cho worker khác.
+    """
+    redis_conn = await get_redis_data_bytes_conn()
+    job_data = codec.decode(job_str)
+    city_id, job_id = job_data["city_id"], job_data["job_id"]
+    try:
+        # job trùng city với job khác đang chạy → bỏ qua
+        if not await confirm_city(redis_conn, city_id, job_id):
+            print(f"[Worker] city_id {city_id} đang được job khác xử lý → skip job {job_id}")
+        else:
+            try:
+                await process_job(job_data) # city_id, longitude, latitude
+            finally:
+                # xong (thành công hay lỗi) thì xoá marker để lần refresh sau được crawl lại
+                await asyncio.shield(release_city(redis_conn, city_id, job_id))
+    except asyncio.CancelledError:
+        print(f"[Worker] Job {job_id} bị huỷ khi tắt worker → đẩy lại vào queue")
+        await asyncio.shield(redis_conn.rpush(QUEUE_DATA, job_str))  # RPUSH: được BRPOP lại đầu tiên
+        raise
+    except Exception as e:
+        print(f"[Worker] Error in worker loop for job {job_id}: {e}")
+        traceback.print_exc()
+    # job cuối cùng của lần refresh sẽ chuyển generation staging sang active
+    if job_data.get("generation") is not None:
+        try:
+            await finish_generation_job(redis_conn, job_data["generation"])
+        except Exception as e:
+            print(f"[Worker] Không cập nhật được generation {job_data['generation']}: {e}")
+            traceback.print_exc()
 
-    if data_uv.empty:
-        print(f"[Worker] UV data cho city_id {city_id} bị rỗng → skip insert")
-    else:
-        data_uv["city_id"] = city_id
-        await insert_uv(data_uv)
+
+async def drain_jobs():
+    """
+    Chờ các job đang chạy xong (tối đa WORKER_DRAIN_TIMEOUT), job còn lại bị huỷ và trả về queue.
+    """
+    if not _running_jobs:
+        return
+    print(f"[Worker] Chờ {len(_running_jobs)} job đang chạy hoàn tất...")
+    _, pending = await asyncio.wait(set(_running_jobs), timeout=WORKER_DRAIN_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"[Worker] Huỷ {len(pending)} job chưa xong sau {WORKER_DRAIN_TIMEOUT}s")
 
 
 PING_INTERVAL = 1800  # 30 phút ping Redis 1 lần
-async def worker_loop():
+async def worker_loop(stop_event: asyncio.Event):
     global redis_data
-    redis_data = await get_redis_data()
-    print("[Worker] Started worker loop...")
+    redis_data = await get_redis_data_bytes_conn()
+    # chỉ BRPOP khi còn slot → job không nằm chờ trong process mà vẫn ở queue cho worker khác
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    print(f"[Worker] Started worker loop (concurrency={WORKER_CONCURRENCY})...")
     last_ping = time.time()
-    while True:
+    while not stop_event.is_set():
         if time.time() - last_ping > PING_INTERVAL:
             try:
                 pong = await redis_data.ping()
@@ -306,24 +306,30 @@ async def worker_loop():
                     print("[Worker] Redis ping OK")
                 else:
                     print("[Worker] Redis ping failed → reconnecting")
-                    redis_data = await get_redis_data()
+                    redis_data = await get_redis_data_bytes_conn()
             except Exception as e:
                 print(f"[Worker] Redis ping error: {e} → reconnecting")
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
             last_ping = time.time()
 
+        await slots.acquire()
+        if stop_event.is_set():  # dừng trong lúc chờ slot
+            slots.release()
+            break
         try:
 
             if redis_data is None:
-                redis_data = await get_redis_data()
+                redis_data = await get_redis_data_bytes_conn()
 
             job_json = await redis_data.brpop(QUEUE_DATA, timeout=5)
         except ResponseError as e:
+            slots.release()
             print(f"[Worker] BRPOP was force-unblocked, retrying... {e}")
             await asyncio.sleep(0.5)
             continue
 
         except (ConnectionError, TimeoutError) as e:
+            slots.release()
             print(f"[Worker] Redis connection lost: {e}. Reconnecting...")
             redis_data = None  # force reconnect
             traceback.print_exc()
@@ -331,26 +337,47 @@ async def worker_loop():
             continue
 
         except Exception as e:
+            slots.release()
             print(f"[Worker] Unexpected error during BRPOP: {e}")
             traceback.print_exc()
             await asyncio.sleep(1)
             continue
 
         if job_json is None:
+            slots.release()
             continue
 
         _, job_str = job_json
-        job_data = json.loads(job_str)
-
-        try:
-            await process_job(job_data) # city_id, longitude, latitude
-        except Exception as e:
-            print(f"[Worker] Error in worker loop for job {job_data.get('job_id')}: {e}")
-            traceback.print_exc()
+        task = asyncio.create_task(run_job(job_str))
+        _running_jobs.add(task)
+        task.add_done_callback(_running_jobs.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+    print("[Worker] Nhận tín hiệu dừng → không nhận job mới")
+    await drain_jobs()
+
+async def main():
+    # Khởi tạo sẵn pool PostgreSQL theo profile của worker thu thập dữ liệu
+    await init_db("worker")
+    await ensure_generation_schema()
+    await start_metrics_server()
+    init_http_clients()
+    # SIGTERM/SIGINT: ngừng nhận job, chờ job đang chạy xong rồi mới đóng kết nối
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await worker_loop(stop_event)
+    finally:
+        await close_http_clients()
+        await stop_metrics_server()
+        await close_redis()
+        await close_db()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(worker_loop())
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\n[Worker] Stopped by user (Ctrl+C)")
 